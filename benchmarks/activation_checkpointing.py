@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import argparse
+
+import torch
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+from transformers import T5Config, T5ForConditionalGeneration
+from cpeft import PromptTuningConfig, get_peft_model
+from memory import saved_tensor_bytes
+
+# (stacks, every) of enable_activation_checkpointing, None trains without it
+SETTINGS = [None, ("encoder", 1), ("decoder", 1), ("all", 2), ("all", 1)]
+
+
+def benchmark(setting, args, device):
+    torch.manual_seed(0)
+    model_config = T5Config(
+        d_model=args.d_model,
+        d_kv=args.d_model // args.num_heads,
+        d_ff=4 * args.d_model,
+        num_layers=args.num_layers,
+        num_heads=args.num_heads,
+        decoder_start_token_id=0,
+    )
+    cpeft_config = PromptTuningConfig(
+        task_type="seq_2_seq_lm", num_virtual_tokens=args.num_virtual_tokens
+    )
+    model = get_peft_model(T5ForConditionalGeneration(model_config), cpeft_config)
+    model.to(device)
+    model.train()
+
+    if setting is not None:
+        model.enable_activation_checkpointing(*setting)
+
+    optimizer = torch.optim.AdamW(
+        [p for p in model.parameters() if p.requires_grad], lr=1e-3
+    )
+
+    batch = {
+        "input_ids": torch.randint(
+            1, model_config.vocab_size, (args.batch_size, args.source_length)
+        ),
+        "attention_mask": torch.ones(
+            args.batch_size, args.source_length, dtype=torch.long
+        ),
+        "labels": torch.randint(
+            1, model_config.vocab_size, (args.batch_size, args.target_length)
+        ),
+    }
+    batch = {k: v.to(device) for k, v in batch.items()}
+
+    saved_bytes = saved_tensor_bytes(model, batch)
+
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+
+    for step in range(args.warmup + args.steps):
+        if step == args.warmup:
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+            start = time.perf_counter()
+
+        loss = model(**batch).loss
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    step_time = (time.perf_counter() - start) / args.steps
+
+    name = "none" if setting is None else f"{setting[0]}/{setting[1]}"
+    result = f"{name:<10} step {step_time * 1000:8.1f} ms   saved tensors {saved_bytes / 2**20:8.1f} MiB"
+    if device.type == "cuda":
+        peak = torch.cuda.max_memory_allocated(device)
+        result += f"   peak memory {peak / 2**20:8.1f} MiB"
+
+    print(result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Activation checkpointing benchmark",
+        description="Train step time and activation memory of prompt tuning with the T5 blocks checkpointed per setting (stacks/every), on a randomly initialized t5-small sized model.",
+    )
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--source_length", type=int, default=512)
+    parser.add_argument("--target_length", type=int, default=16)
+    parser.add_argument("--num_virtual_tokens", type=int, default=50)
+    parser.add_argument("--d_model", type=int, default=512)
+    parser.add_argument("--num_layers", type=int, default=6)
+    parser.add_argument("--num_heads", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--steps", type=int, default=5)
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    for setting in SETTINGS:
+        benchmark(setting, args, device)
@@ -0,0 +1,38 @@
+import torch
+
+
+def saved_tensor_bytes(model, batch):
+    """Bytes autograd keeps for the backward pass of one training step.
+
+    Shared storages are counted once. Checkpointed blocks keep only their inputs,
+    which are counted instead of the tensors saved inside the block.
+    """
+    storages = {}
+
+    def add(tensor):
+        storage = tensor.untyped_storage()
+        storages[storage.data_ptr()] = storage.nbytes()
+        return tensor
+
+    def add_inputs(module, args, kwargs):
+        for value in list(args) + list(kwargs.values()):
+            if isinstance(value, torch.Tensor):
+                add(value)
+
+    # blocks with a forward of their own are checkpointed
+    handles = [
+        module.register_forward_pre_hook(add_inputs, with_kwargs=True)
+        for module in model.modules()
+        if "forward" in module.__dict__
+    ]
+
+    with torch.autograd.graph.saved_tensors_hooks(add, lambda tensor: tensor):
+        loss = model(**batch).loss
+
+    for handle in handles:
+        handle.remove()
+
+    loss.backward()
+    model.zero_grad(set_to_none=True)
+
+    return sum(storages.values())
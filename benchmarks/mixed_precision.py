@@ -0,0 +1,116 @@
+import os
+import sys
+import time
+import argparse
+
+import torch
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+from transformers import T5Config, T5ForConditionalGeneration
+from cpeft import PromptTuningConfig, get_peft_model
+
+PRECISIONS = ["fp32", "bf16"]
+
+
+def timed(step, args, device):
+    for i in range(args.warmup + args.steps):
+        if i == args.warmup:
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+            start = time.perf_counter()
+
+        result = step()
+
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+    return (time.perf_counter() - start) / args.steps, result
+
+
+def benchmark(precision, args, device):
+    torch.manual_seed(0)
+    model_config = T5Config(
+        d_model=args.d_model,
+        d_kv=args.d_model // args.num_heads,
+        d_ff=4 * args.d_model,
+        num_layers=args.num_layers,
+        num_heads=args.num_heads,
+        decoder_start_token_id=0,
+        dropout_rate=0.0,
+    )
+    cpeft_config = PromptTuningConfig(
+        task_type="seq_2_seq_lm", num_virtual_tokens=args.num_virtual_tokens
+    )
+    model = get_peft_model(T5ForConditionalGeneration(model_config), cpeft_config)
+    model.to(device)
+
+    optimizer = torch.optim.AdamW(
+        [p for p in model.parameters() if p.requires_grad], lr=1e-3
+    )
+    autocast = torch.autocast(
+        device.type, dtype=torch.bfloat16, enabled=precision == "bf16"
+    )
+
+    batch = {
+        "input_ids": torch.randint(
+            1, model_config.vocab_size, (args.batch_size, args.source_length)
+        ),
+        "attention_mask": torch.ones(
+            args.batch_size, args.source_length, dtype=torch.long
+        ),
+        "labels": torch.randint(
+            1, model_config.vocab_size, (args.batch_size, args.target_length)
+        ),
+    }
+    batch = {k: v.to(device) for k, v in batch.items()}
+
+    def train_step():
+        with autocast:
+            loss = model(**batch).loss
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+
+        return loss.detach().float()
+
+    def eval_step():
+        with torch.no_grad(), autocast:
+            loss, _ = model.eval_step(max_new_tokens=args.target_length, **batch)
+
+        return loss.float()
+
+    model.train()
+    train_time, train_loss = timed(train_step, args, device)
+    model.eval()
+    eval_time, eval_loss = timed(eval_step, args, device)
+
+    print(
+        f"{precision:<5} train {args.batch_size / train_time:8.1f} samples/s   "
+        f"eval {args.batch_size / eval_time:8.1f} samples/s   "
+        f"train loss {train_loss.item():.4f}   eval loss {eval_loss.item():.4f}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Mixed precision benchmark",
+        description="Train and eval throughput of prompt tuning with the backbone in fp32 and under bf16 autocast, on a randomly initialized t5-small sized model.",
+    )
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--source_length", type=int, default=256)
+    parser.add_argument("--target_length", type=int, default=8)
+    parser.add_argument("--num_virtual_tokens", type=int, default=50)
+    parser.add_argument("--d_model", type=int, default=512)
+    parser.add_argument("--num_layers", type=int, default=6)
+    parser.add_argument("--num_heads", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--steps", type=int, default=5)
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    for precision in PRECISIONS:
+        benchmark(precision, args, device)
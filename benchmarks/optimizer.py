@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import torch
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+from transformers import T5Config, T5ForConditionalGeneration
+from cpeft import AttemptConfig, get_peft_model
+from trainer.optim import build_optimizer
+
+# name -> optimizer, "all" is AdamW over every parameter of the model
+OPTIMIZERS = ["all", "adamw", "lazy_adamw"]
+
+
+def benchmark(name, n_targets, args, device, prompt_path):
+    torch.manual_seed(0)
+    model_config = T5Config(
+        d_model=args.d_model,
+        d_kv=args.d_model // args.num_heads,
+        d_ff=4 * args.d_model,
+        num_layers=args.num_layers,
+        num_heads=args.num_heads,
+        decoder_start_token_id=0,
+    )
+    cpeft_config = AttemptConfig(
+        task_type="seq_2_seq_lm",
+        num_virtual_tokens=args.num_virtual_tokens,
+        prompt_init="embedding_multi",
+        prompt_init_embedding=prompt_path,
+        prompt_embedding_paths=[prompt_path] * 2,
+        prefix_num=2,
+        n_targets=n_targets,
+    )
+    model = get_peft_model(T5ForConditionalGeneration(model_config), cpeft_config)
+    model.to(device)
+    model.train()
+
+    config = {"learning_rate": 1e-3, "optimizer": name}
+    if name == "all":
+        optimizer = torch.optim.AdamW(model.parameters(), lr=1e-3)
+    else:
+        optimizer = build_optimizer(model, config)
+
+    # batches hold a few tasks of the bank
+    batch = {
+        "input_ids": torch.randint(
+            1, model_config.vocab_size, (args.batch_size, args.source_length)
+        ),
+        "labels": torch.randint(
+            1, model_config.vocab_size, (args.batch_size, args.target_length)
+        ),
+        "task_ids": torch.randint(0, args.tasks_per_batch, (args.batch_size,)),
+    }
+    batch = {k: v.to(device) for k, v in batch.items()}
+    model(**batch).loss.backward()
+
+    for step in range(args.warmup + args.steps):
+        if step == args.warmup:
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+            start = time.perf_counter()
+
+        optimizer.step()
+
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    step_time = (time.perf_counter() - start) / args.steps
+
+    print(f"{name:<10} targets {n_targets:4d}   step {step_time * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Optimizer benchmark",
+        description="Optimizer step time for ATTEMPT with a multi-target prompt bank, on a randomly initialized t5-small sized model.",
+    )
+    parser.add_argument("--n_targets", type=int, nargs="+", default=[8, 64, 256])
+    parser.add_argument("--tasks_per_batch", type=int, default=2)
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--source_length", type=int, default=64)
+    parser.add_argument("--target_length", type=int, default=4)
+    parser.add_argument("--num_virtual_tokens", type=int, default=50)
+    parser.add_argument("--d_model", type=int, default=512)
+    parser.add_argument("--num_layers", type=int, default=6)
+    parser.add_argument("--num_heads", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--steps", type=int, default=10)
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        prompt_path = os.path.join(tmp, "prompt.bin")
+        torch.save(torch.randn(2 * args.num_virtual_tokens, args.d_model), prompt_path)
+
+        for n_targets in args.n_targets:
+            for name in OPTIMIZERS:
+                benchmark(name, n_targets, args, device, prompt_path)
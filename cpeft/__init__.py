@@ -1,5 +1,12 @@
 from .prompt_tuning import *
 from .attempt import *
+from .prefix_tuning import *
 from .config import PeftConfig
-from .model import PeftModel
+from .model import (
+    PeftModel,
+    PeftModelForCausalLM,
+    PeftModelForSeq2SeqLM,
+    PeftModelForSequenceClassification,
+)
 from .mapping import get_peft_model
+from .registry import AdapterRegistry
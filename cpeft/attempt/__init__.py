@@ -1,2 +1,2 @@
 from .config import AttemptConfig
-from .model import AttemptSubModule
+from .model import AttemptSubModule, AttemptSparseSubModule
@@ -7,7 +7,9 @@ from ..prompt_tuning.config import PromptTuningConfig
 
 
 @dataclass
-class AttemptConfig(PromptTuningConfig):
+class SourcePromptsConfig(PromptTuningConfig):
+    """Fields of the configs that mix frozen source prompts per instance."""
+
     prompt_init_embedding: str = field(
         default=None,
         metadata={"help": "Embedding to init the promt with."},
@@ -16,12 +18,56 @@ class AttemptConfig(PromptTuningConfig):
         default=None,
         metadata={"help": "List of paths to source prompts, default is empty list."},
     )
+    prompt_bank: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "Packed prompt bank file, prompts missing in it are loaded from their paths."
+        },
+    )
+    save_source_prompts: bool = field(
+        default=False,
+        metadata={
+            "help": "Embed source prompts into the adapter, it is then loaded without the prompt files. "
+            "By default only a reference (prompt bank, paths and sha256 of the prompts) is saved."
+        },
+    )
+    source_prompts_sha256: Optional[List[str]] = field(
+        default=None,
+        metadata={
+            "help": "sha256 of the source prompts, set on save and checked when they are loaded from their files."
+        },
+    )
+    deduplicate_source_prompts: bool = field(
+        default=False,
+        metadata={"help": "Save identical source prompts only once."},
+    )
     attn_method: str = field(
         default="sub",
         metadata={
-            "help": "Method of attention calculation, default is sub (subnetwork)."
+            "help": "Method of attention calculation [sub, sub_topk], default is sub (subnetwork)."
+        },
+    )
+    top_k: int = field(
+        default=8,
+        metadata={"help": "Number of source prompts mixed per instance by sub_topk."},
+    )
+    index_method: str = field(
+        default="auto",
+        metadata={
+            "help": "Source prompt retrieval for sub_topk [auto, exact, ivf], default is auto."
         },
     )
+    exact_search_limit: int = field(
+        default=1024,
+        metadata={"help": "Largest number of source prompts searched exactly by auto."},
+    )
+    n_clusters: Optional[int] = field(
+        default=None,
+        metadata={"help": "Number of ivf clusters, default is sqrt(prefix_num)."},
+    )
+    n_probe: int = field(
+        default=4, metadata={"help": "Number of ivf clusters searched per instance."}
+    )
     prefix_num: int = field(default=0, metadata={"help": "Number of source prompts."})
     temperature: int = field(
         default=2087,
@@ -31,5 +77,12 @@ class AttemptConfig(PromptTuningConfig):
         default=False, metadata={"help": "multi-task attention sharing"}
     )
 
+
+@dataclass
+class AttemptConfig(SourcePromptsConfig):
     def __post_init__(self):
         self.peft_type = "attempt"
+
+    @property
+    def mixes_source_prompts(self) -> bool:
+        return True
@@ -5,11 +5,23 @@ import torch.nn.functional as F
 class AttemptModule(torch.nn.Module):
     def __init__(self):
         super().__init__()
+        self.prefix_loaded = False
 
     def store_prefix_weights(self, prefix_embeddings):
-        embeddings = torch.stack(prefix_embeddings)
-        self.mul_prefix_emb.data = embeddings.clone().detach()
+        # a stacked tensor (e.g. a view into a prompt bank) is used as is, without a copy
+        if isinstance(prefix_embeddings, torch.Tensor):
+            embeddings = prefix_embeddings.detach()
+        else:
+            embeddings = torch.stack(prefix_embeddings).clone().detach()
+
+        self.mul_prefix_emb.data = embeddings
+        self.prefix_loaded = True
         self.mul_prefix_emb.requires_grad = False
+        self.update_prefix_keys()
+
+    def update_prefix_keys(self):
+        # source prompts are frozen, so their max-pooled keys are computed only once
+        self.mul_prefix_keys = torch.max(self.mul_prefix_emb.detach(), 1)[0]
 
 
 class AttemptSubModule(AttemptModule):
@@ -18,6 +30,7 @@ class AttemptSubModule(AttemptModule):
 
         self.temperature = config.temperature
         self.shared_attn = config.shared_attn
+        self.num_virtual_tokens = config.num_virtual_tokens
 
         total_virtual_tokens = (
             config.num_virtual_tokens * config.num_transformer_submodules
@@ -26,6 +39,14 @@ class AttemptSubModule(AttemptModule):
         self.mul_prefix_emb = torch.nn.Parameter(
             torch.zeros((config.prefix_num, total_virtual_tokens, config.token_dim))
         )
+        self.register_buffer(
+            "mul_prefix_keys",
+            torch.zeros((config.prefix_num, config.token_dim)),
+            persistent=False,
+        )
+        self.register_load_state_dict_post_hook(
+            lambda module, incompatible_keys: module.update_prefix_keys()
+        )
 
         self.attn_W_down = torch.nn.Linear(
             config.token_dim, total_virtual_tokens, bias=False
@@ -36,41 +57,174 @@ class AttemptSubModule(AttemptModule):
         self.attn_non_linear = torch.nn.SiLU()
         self.layer_norm = torch.nn.LayerNorm(config.token_dim)
 
-    def forward(self, inputs_embeds, prefix_emb, task_ids=None):
+    def get_query(self, inputs_embeds):
         avg_inputs_embeds, _ = torch.max(inputs_embeds, 1)
 
-        target_prompts = prefix_emb
+        x = self.attn_W_down(avg_inputs_embeds)
+        x = self.attn_non_linear(x)
+        x = self.attn_W_up(x)
+        x = self.layer_norm(x)
+
+        return x
 
-        # print("Target prompts shape:", target_prompts.shape)
-        # print(target_prompts)
+    def forward(self, inputs_embeds, prefix_emb, task_ids=None):
+        # only the first num_virtual_tokens of the mixed prompt are prepended to the input,
+        # but the keys are max-pooled over all of the prompt tokens
+        target_prompts = prefix_emb[:, : self.num_virtual_tokens]
+        source_prompts = self.mul_prefix_emb[:, : self.num_virtual_tokens]
+        avg_target_prompts, _ = torch.max(prefix_emb, 1)
 
-        # print(prefix_emb.size(), inputs_embeds.shape)
-        # print(target_prompts.size())
-        # print(self.mul_prefix_emb.repeat(inputs_embeds.shape[0], 1, 1, 1).size())
-        # print(target_prompts.unsqueeze(1).size())
-        # exit(0)
+        x = self.get_query(inputs_embeds)
 
-        mul_prefix_emb_added = torch.cat(
+        # scores of the shared source prompts are broadcast over the batch,
+        # the target prompt is scored per instance
+        attn_scores = torch.cat(
             (
-                self.mul_prefix_emb.repeat(inputs_embeds.shape[0], 1, 1, 1),
-                target_prompts.unsqueeze(1),
+                x.matmul(self.mul_prefix_keys.t()),
+                (avg_target_prompts * x).sum(-1, keepdim=True),
             ),
-            dim=1,
+            dim=-1,
         )
-        avg_mul_prefix_emb, _ = torch.max(mul_prefix_emb_added, 2)
+        normalized_attn_scores = F.softmax(attn_scores / self.temperature, -1)
 
-        x = self.attn_W_down(avg_inputs_embeds)
-        x = self.attn_non_linear(x)
-        x = self.attn_W_up(x)
-        x = self.layer_norm(x)
-        x = x.unsqueeze(-1)
+        soft_prompts = torch.einsum(
+            "bp, pld -> bld", normalized_attn_scores[:, :-1], source_prompts
+        )
+        soft_prompts = (
+            soft_prompts + normalized_attn_scores[:, -1:, None] * target_prompts
+        )
+
+        soft_prompts = soft_prompts + target_prompts
+
+        return soft_prompts
+
+
+class AttemptSparseSubModule(AttemptSubModule):
+    """Attends only over the top_k source prompts retrieved for every instance, so that
+    memory and compute of the mixture grow with top_k instead of the library size."""
+
+    def __init__(self, config):
+        super().__init__(config)
+
+        self.top_k = min(config.top_k, config.prefix_num)
+        self.n_probe = config.n_probe
+
+        self.index_method = config.index_method
+        if self.index_method == "auto":
+            self.index_method = (
+                "exact" if config.prefix_num <= config.exact_search_limit else "ivf"
+            )
 
-        attn_scores = avg_mul_prefix_emb.bmm(x).squeeze(-1) / self.temperature
-        normalized_attn_scores = F.softmax(attn_scores, -1)
+        if self.index_method not in ["exact", "ivf"]:
+            raise ValueError(f"Unknown index method {config.index_method}.")
+
+        self.n_clusters = config.n_clusters
+        if self.n_clusters is None:
+            self.n_clusters = max(1, int(config.prefix_num**0.5))
+
+        self.register_buffer(
+            "cluster_centroids",
+            torch.zeros((self.n_clusters, config.token_dim)),
+            persistent=False,
+        )
+        self.register_buffer(
+            "cluster_members",
+            torch.full((self.n_clusters, 1), -1, dtype=torch.long),
+            persistent=False,
+        )
+
+    def update_prefix_keys(self):
+        super().update_prefix_keys()
+
+        if self.index_method == "ivf":
+            self.build_index()
+
+    @torch.no_grad()
+    def build_index(self, n_iter=20, seed=42):
+        # k-means over the source prompt keys, every cluster keeps a padded list of its members
+        keys = self.mul_prefix_keys
+        n_clusters = min(self.n_clusters, keys.shape[0])
+
+        generator = torch.Generator()
+        generator.manual_seed(seed)
+        init = torch.randperm(keys.shape[0], generator=generator)[:n_clusters]
+        centroids = keys[init.to(keys.device)].clone()
+
+        for _ in range(n_iter):
+            assignment = torch.cdist(keys, centroids).argmin(-1)
+            sums = torch.zeros_like(centroids).index_add_(0, assignment, keys)
+            counts = torch.bincount(assignment, minlength=n_clusters)
+            non_empty = counts > 0
+            centroids[non_empty] = sums[non_empty] / counts[non_empty, None].to(
+                keys.dtype
+            )
+
+        assignment = torch.cdist(keys, centroids).argmin(-1)
+        counts = torch.bincount(assignment, minlength=n_clusters)
+
+        order = torch.argsort(assignment, stable=True)
+        offsets = torch.cumsum(counts, 0) - counts
+        positions = (
+            torch.arange(keys.shape[0], device=keys.device) - offsets[assignment[order]]
+        )
+
+        members = torch.full(
+            (n_clusters, int(counts.max())), -1, dtype=torch.long, device=keys.device
+        )
+        members[assignment[order], positions] = order
+
+        self.cluster_centroids = centroids
+        self.cluster_members = members
+
+    @torch.no_grad()
+    def retrieve(self, x):
+        if self.index_method == "exact":
+            scores = x.matmul(self.mul_prefix_keys.t())
+            return scores.topk(self.top_k, dim=-1)[1]
+
+        n_probe = min(self.n_probe, self.cluster_centroids.shape[0])
+        probe = x.matmul(self.cluster_centroids.t()).topk(n_probe, dim=-1)[1]
+        candidates = self.cluster_members[probe].flatten(1)
+
+        valid = candidates >= 0
+        scores = torch.einsum(
+            "bd, bcd -> bc", x, self.mul_prefix_keys[candidates.clamp(min=0)]
+        )
+        scores = scores.masked_fill(~valid, -torch.inf)
+
+        top_k = min(self.top_k, candidates.shape[1])
+        positions = scores.topk(top_k, dim=-1)[1]
+
+        # clusters might hold less than top_k prompts, those slots are marked with -1
+        return candidates.gather(1, positions)
+
+    def forward(self, inputs_embeds, prefix_emb, task_ids=None):
+        target_prompts = prefix_emb[:, : self.num_virtual_tokens]
+        avg_target_prompts, _ = torch.max(prefix_emb, 1)
+
+        x = self.get_query(inputs_embeds)
+
+        indices = self.retrieve(x)
+        valid = indices >= 0
+        indices = indices.clamp(min=0)
+
+        # scores of the retrieved prompts are recomputed with gradients flowing to the query
+        source_scores = torch.einsum("bd, bkd -> bk", x, self.mul_prefix_keys[indices])
+        source_scores = source_scores.masked_fill(~valid, -torch.inf)
+
+        attn_scores = torch.cat(
+            (source_scores, (avg_target_prompts * x).sum(-1, keepdim=True)), dim=-1
+        )
+        normalized_attn_scores = F.softmax(attn_scores / self.temperature, -1)
+
+        source_prompts = self.mul_prefix_emb[indices, : self.num_virtual_tokens]
         soft_prompts = torch.einsum(
-            "bp, bpld -> bld", normalized_attn_scores, mul_prefix_emb_added
+            "bk, bkld -> bld", normalized_attn_scores[:, :-1], source_prompts
+        )
+        soft_prompts = (
+            soft_prompts + normalized_attn_scores[:, -1:, None] * target_prompts
         )
 
-        soft_prompts = soft_prompts + prefix_emb.unsqueeze(0)
+        soft_prompts = soft_prompts + target_prompts
 
-        return soft_prompts.squeeze(0)
+        return soft_prompts
@@ -0,0 +1,43 @@
+import torch
+
+from torch.utils.checkpoint import checkpoint, noop_context_fn
+
+
+def checkpoint_blocks(blocks, context_fn=noop_context_fn):
+    """Recomputes the activations of blocks in the backward pass instead of storing them.
+
+    Only the inputs of a block are kept. The backbone is frozen, so gradients flow
+    only through the block inputs (the prompts), the non-reentrant checkpoint
+    handles that and keyword arguments. The RNG state is restored for recomputing,
+    dropout masks stay the same. Without gradients blocks run as usual. context_fn
+    is passed to the checkpoint, e.g. to restore state read by hooks for recomputing.
+    """
+    for block in blocks:
+        if "forward" in block.__dict__:
+            continue
+
+        block.forward = _CheckpointedForward(block.forward, context_fn)
+
+
+def uncheckpoint_blocks(blocks):
+    for block in blocks:
+        if isinstance(block.__dict__.get("forward", None), _CheckpointedForward):
+            del block.forward
+
+
+class _CheckpointedForward:
+    def __init__(self, forward, context_fn):
+        self.forward = forward
+        self.context_fn = context_fn
+
+    def __call__(self, *args, **kwargs):
+        if not torch.is_grad_enabled():
+            return self.forward(*args, **kwargs)
+
+        return checkpoint(
+            self.forward,
+            *args,
+            use_reentrant=False,
+            context_fn=self.context_fn,
+            **kwargs,
+        )
@@ -0,0 +1,74 @@
+import torch
+import torch.nn.functional as F
+
+
+class ClassificationHead(torch.nn.Module):
+    """Scores the labels of the tasks from the pooled encoder output.
+
+    Classes are the distinct tokenized labels of all tasks in config.label_token_ids,
+    so tasks sharing label strings (e.g. "0", "1") share classes. With task ids the
+    classes of other tasks are masked out.
+    """
+
+    def __init__(self, config):
+        super().__init__()
+
+        if not config.label_token_ids:
+            raise ValueError("Sequence classification needs label_token_ids.")
+
+        classes = []
+        for task_label_token_ids in config.label_token_ids:
+            for token_ids in task_label_token_ids:
+                if list(token_ids) not in classes:
+                    classes.append(list(token_ids))
+
+        task_mask = torch.zeros(
+            len(config.label_token_ids), len(classes), dtype=torch.bool
+        )
+        for task_id, task_label_token_ids in enumerate(config.label_token_ids):
+            for token_ids in task_label_token_ids:
+                task_mask[task_id, classes.index(list(token_ids))] = True
+
+        # labels padded with -100 as in the tokenized targets
+        length = max(len(token_ids) for token_ids in classes)
+        label_token_ids = torch.full((len(classes), length), -100, dtype=torch.long)
+        for i, token_ids in enumerate(classes):
+            label_token_ids[i, : len(token_ids)] = torch.tensor(token_ids)
+
+        self.register_buffer("label_token_ids", label_token_ids, persistent=False)
+        self.register_buffer("task_mask", task_mask, persistent=False)
+
+        self.dense = torch.nn.Linear(config.token_dim, len(classes))
+
+    def forward(self, pooled_output, task_ids=None):
+        logits = self.dense(pooled_output.to(self.dense.weight.dtype))
+
+        if task_ids is not None:
+            logits = logits.masked_fill(
+                ~self.task_mask[task_ids], torch.finfo(logits.dtype).min
+            )
+
+        return logits
+
+    def get_classes(self, labels, pad_token_id=None):
+        if pad_token_id is not None:
+            labels = labels.masked_fill(labels == pad_token_id, -100)
+
+        length = max(labels.shape[1], self.label_token_ids.shape[1])
+        labels = F.pad(labels, (0, length - labels.shape[1]), value=-100)
+        label_token_ids = F.pad(
+            self.label_token_ids,
+            (0, length - self.label_token_ids.shape[1]),
+            value=-100,
+        )
+
+        matches = (labels[:, None] == label_token_ids[None]).all(dim=-1)
+        if not matches.any(dim=-1).all():
+            raise ValueError("Labels do not match any label of the tasks.")
+
+        return matches.long().argmax(dim=-1)
+
+    def get_label_token_ids(self, classes, pad_token_id):
+        return self.label_token_ids[classes].masked_fill(
+            self.label_token_ids[classes] == -100, pad_token_id
+        )
@@ -0,0 +1,446 @@
+import copy
+import inspect
+import torch
+
+from transformers import LogitsProcessor, LogitsProcessorList
+from transformers.modeling_outputs import BaseModelOutput
+
+# generation settings greedy_search handles itself, anything else goes to the HF generate
+GREEDY_SEARCH_KEYS = {
+    "max_length",
+    "max_new_tokens",
+    "bos_token_id",
+    "eos_token_id",
+    "pad_token_id",
+    "decoder_start_token_id",
+    "use_cache",
+    "transformers_version",
+    "_from_model_config",
+}
+
+
+class VocabularyLogitsProcessor(LogitsProcessor):
+    """Keeps only the scores of vocab_ids, the HF generate counterpart of greedy_search vocab_ids."""
+
+    def __init__(self, vocab_ids):
+        self.vocab_ids = vocab_ids
+
+    def __call__(self, input_ids, scores):
+        mask = torch.full_like(scores, float("-inf"))
+        mask[:, self.vocab_ids.to(scores.device)] = 0
+
+        return scores + mask
+
+
+class LabelTrie:
+    """Prefix trie over tokenized labels for constrained decoding.
+
+    Nodes are ids into children (token id -> node), the root is 0. Labels should end
+    with EOS, a row is finished when it reaches a leaf, i.e. a complete label.
+    """
+
+    def __init__(self, label_token_ids):
+        self.children = [{}]
+
+        for token_ids in label_token_ids:
+            node = 0
+            for token_id in _token_list(token_ids):
+                if token_id not in self.children[node]:
+                    self.children.append({})
+                    self.children[node][token_id] = len(self.children) - 1
+
+                node = self.children[node][token_id]
+
+    def get_mask(self, vocab_size, device=None):
+        # additive scores mask of every node, only children of the node are allowed
+        mask = torch.full((len(self.children), vocab_size), float("-inf"))
+        for node, children in enumerate(self.children):
+            mask[node, list(children)] = 0
+
+        return mask.to(device)
+
+    def get_leaves(self, device=None):
+        return torch.tensor([not children for children in self.children], device=device)
+
+    def step(self, nodes, token_ids):
+        return torch.tensor(
+            [
+                self.children[node][token_id]
+                for node, token_id in zip(nodes.tolist(), token_ids.tolist())
+            ],
+            dtype=torch.long,
+            device=nodes.device,
+        )
+
+    def allowed_tokens(self, batch_id, input_ids):
+        # prefix_allowed_tokens_fn of the HF generate, input_ids start with the decoder start token
+        node = 0
+        for token_id in input_ids[1:].tolist():
+            # beams scored -inf can leave the trie, they get no allowed tokens
+            if token_id not in self.children[node]:
+                return []
+
+            node = self.children[node][token_id]
+
+        return list(self.children[node])
+
+
+def generate(model, inputs_embeds, attention_mask=None, **kwargs):
+    """Generates with an encoder-decoder model from already prompted input embeddings."""
+    if attention_mask is None:
+        attention_mask = torch.ones(
+            inputs_embeds.shape[:2], dtype=torch.long, device=inputs_embeds.device
+        )
+
+    encoder_outputs = model.get_encoder()(
+        inputs_embeds=inputs_embeds, attention_mask=attention_mask, return_dict=True
+    )
+
+    return decode(model, encoder_outputs, attention_mask, **kwargs)
+
+
+def decode(
+    model, encoder_outputs, attention_mask, vocab_ids=None, label_trie=None, **kwargs
+):
+    """Generates from already computed encoder outputs.
+
+    Plain greedy decoding runs in greedy_search, other generation settings fall back
+    to the HF generate with the encoder outputs. vocab_ids restricts the generated
+    tokens, e.g. to the tokens of the labels, label_trie constrains the outputs to
+    complete labels.
+    """
+    generation_config, model_kwargs, greedy = prepare_generation_config(model, kwargs)
+
+    if not greedy:
+        if vocab_ids is not None:
+            model_kwargs["logits_processor"] = LogitsProcessorList(
+                [VocabularyLogitsProcessor(vocab_ids)]
+                + list(model_kwargs.get("logits_processor", None) or [])
+            )
+
+        if label_trie is not None:
+            model_kwargs["prefix_allowed_tokens_fn"] = label_trie.allowed_tokens
+
+        return model.generate(
+            encoder_outputs=encoder_outputs,
+            attention_mask=attention_mask,
+            generation_config=generation_config,
+            **model_kwargs,
+        )
+
+    return greedy_search(
+        model,
+        encoder_outputs.last_hidden_state,
+        attention_mask,
+        get_max_new_tokens(generation_config, 1),
+        generation_config.decoder_start_token_id,
+        generation_config.eos_token_id,
+        generation_config.pad_token_id,
+        vocab_ids,
+        label_trie,
+    )
+
+
+@torch.no_grad()
+def rank_classification(
+    model,
+    encoder_hidden_states,
+    attention_mask,
+    label_token_ids,
+    decoder_start_token_id,
+    pad_token_id,
+):
+    """Picks the label with the highest log-likelihood under teacher forcing.
+
+    All candidate labels are scored against the encoder output in one decoder pass.
+    label_token_ids is [labels, length], padded with -100. Returns the predicted
+    labels laid out as generate output.
+    """
+    batch_size = encoder_hidden_states.shape[0]
+    labels = label_token_ids.to(encoder_hidden_states.device)
+    num_labels = labels.shape[0]
+
+    decoder_input_ids = labels.new_full(labels.shape, decoder_start_token_id)
+    decoder_input_ids[:, 1:] = labels[:, :-1].masked_fill(
+        labels[:, :-1] == -100, pad_token_id
+    )
+
+    # [batch * labels, ...], candidates of one row are next to each other
+    outputs = model(
+        encoder_outputs=BaseModelOutput(
+            last_hidden_state=encoder_hidden_states.repeat_interleave(num_labels, 0)
+        ),
+        attention_mask=attention_mask.repeat_interleave(num_labels, 0),
+        decoder_input_ids=decoder_input_ids.repeat(batch_size, 1),
+        use_cache=False,
+        return_dict=True,
+    )
+
+    targets = labels.repeat(batch_size, 1)
+    log_probs = outputs.logits.float().log_softmax(dim=-1)
+    scores = log_probs.gather(-1, targets.clamp(min=0).unsqueeze(-1)).squeeze(-1)
+    scores = scores.masked_fill(targets == -100, 0).sum(dim=-1)
+
+    predictions = labels[scores.view(batch_size, num_labels).argmax(dim=-1)]
+    predictions = predictions.masked_fill(predictions == -100, pad_token_id)
+
+    return torch.cat(
+        (predictions.new_full((batch_size, 1), decoder_start_token_id), predictions),
+        dim=1,
+    )
+
+
+def build_generation_config(model, **kwargs):
+    """Copy of the generation config of model updated with kwargs.
+
+    Built once (e.g. per task) and passed as generation_config, it is then used as
+    is instead of copying the generation config of the model on every call.
+    """
+    generation_config = copy.deepcopy(model.generation_config)
+    generation_config.update(**kwargs)
+
+    return generation_config
+
+
+def prepare_generation_config(model, kwargs):
+    generation_config = kwargs.pop("generation_config", None)
+
+    if generation_config is not None and not kwargs:
+        model_kwargs = {}
+    else:
+        if generation_config is None:
+            generation_config = model.generation_config
+
+        generation_config = copy.deepcopy(generation_config)
+        model_kwargs = generation_config.update(**kwargs)
+
+    greedy = not model_kwargs and set(generation_config.to_diff_dict()) <= (
+        GREEDY_SEARCH_KEYS
+    )
+
+    return generation_config, model_kwargs, greedy
+
+
+def get_max_new_tokens(generation_config, input_length):
+    if generation_config.max_new_tokens is not None:
+        return generation_config.max_new_tokens
+
+    return generation_config.max_length - input_length
+
+
+@torch.no_grad()
+def greedy_search(
+    model,
+    encoder_hidden_states,
+    attention_mask,
+    max_new_tokens,
+    decoder_start_token_id,
+    eos_token_id,
+    pad_token_id=None,
+    vocab_ids=None,
+    label_trie=None,
+):
+    """Greedy decoding with the decoder KV cache, same output as the HF greedy search.
+
+    Rows that emitted EOS are dropped from the batch (and from the cache), the rest
+    of their sequence is padding. Decoding stops when all rows are finished.
+    With vocab_ids the argmax runs over those tokens and is mapped back to the full
+    vocabulary, for T5 only those rows of the LM head are computed. With label_trie every row follows a
+    label and is finished as soon as the label is complete.
+    """
+    if isinstance(eos_token_id, int):
+        eos_token_id = [eos_token_id]
+
+    if pad_token_id is None:
+        pad_token_id = eos_token_id[0]
+
+    batch_size = encoder_hidden_states.shape[0]
+    device = encoder_hidden_states.device
+    eos_token_id = torch.tensor(eos_token_id, device=device)
+
+    lm_head = None
+    if vocab_ids is not None:
+        vocab_ids = vocab_ids.to(device)
+
+        # the head rows of the vocabulary are computed only for T5, other models get
+        # their logits from their own head and only the vocabulary is kept
+        if model.config.model_type == "t5":
+            lm_head = model.get_output_embeddings().weight[vocab_ids]
+
+    if label_trie is not None:
+        vocab_size = model.get_output_embeddings().weight.shape[0]
+        trie_mask = label_trie.get_mask(vocab_size, device)
+        if vocab_ids is not None:
+            trie_mask = trie_mask[:, vocab_ids]
+
+        trie_leaves = label_trie.get_leaves(device)
+        nodes = torch.zeros(batch_size, dtype=torch.long, device=device)
+
+    sequences = torch.full(
+        (batch_size, max_new_tokens + 1), pad_token_id, dtype=torch.long, device=device
+    )
+    sequences[:, 0] = decoder_start_token_id
+
+    # rows of the batch that are still decoded
+    rows = torch.arange(batch_size, device=device)
+    decoder_input_ids = sequences[:, :1]
+    past_key_values = None
+    length = max_new_tokens + 1
+
+    for step in range(max_new_tokens):
+        if lm_head is None:
+            outputs = model(
+                encoder_outputs=BaseModelOutput(
+                    last_hidden_state=encoder_hidden_states
+                ),
+                attention_mask=attention_mask,
+                decoder_input_ids=decoder_input_ids,
+                past_key_values=past_key_values,
+                use_cache=True,
+                return_dict=True,
+            )
+
+            logits = outputs.logits[:, -1]
+            if vocab_ids is not None:
+                logits = logits[:, vocab_ids]
+        else:
+            outputs = model.get_decoder()(
+                input_ids=decoder_input_ids,
+                encoder_hidden_states=encoder_hidden_states,
+                encoder_attention_mask=attention_mask,
+                past_key_values=past_key_values,
+                use_cache=True,
+                return_dict=True,
+            )
+
+            hidden_states = outputs.last_hidden_state[:, -1]
+            # T5 rescales the decoder output before tied embeddings
+            if model.config.tie_word_embeddings:
+                hidden_states = hidden_states * (model.config.d_model**-0.5)
+
+            logits = hidden_states @ lm_head.T
+
+        if label_trie is not None:
+            logits = logits + trie_mask[nodes]
+
+        next_tokens = logits.argmax(dim=-1)
+        if vocab_ids is not None:
+            next_tokens = vocab_ids[next_tokens]
+
+        sequences[rows, step + 1] = next_tokens
+
+        unfinished = ~torch.isin(next_tokens, eos_token_id)
+        if label_trie is not None:
+            nodes = label_trie.step(nodes, next_tokens)
+            unfinished &= ~trie_leaves[nodes]
+
+        if not unfinished.any():
+            length = step + 2
+            break
+
+        past_key_values = outputs.past_key_values
+        if not unfinished.all():
+            rows = rows[unfinished]
+            next_tokens = next_tokens[unfinished]
+            if label_trie is not None:
+                nodes = nodes[unfinished]
+            encoder_hidden_states = encoder_hidden_states[unfinished]
+            attention_mask = attention_mask[unfinished]
+            past_key_values = tuple(
+                tuple(past[unfinished] for past in layer_past)
+                for layer_past in past_key_values
+            )
+
+        decoder_input_ids = next_tokens.unsqueeze(-1)
+
+    return sequences[:, :length]
+
+
+@torch.no_grad()
+def causal_greedy_search(
+    model,
+    input_ids,
+    attention_mask,
+    max_new_tokens,
+    eos_token_id,
+    pad_token_id=None,
+    inputs_embeds=None,
+    past_key_values=None,
+):
+    """Greedy decoding for decoder-only models, same output as the HF greedy search.
+
+    The first step runs inputs_embeds (prompted inputs) or input_ids after
+    past_key_values (a cached prompt), attention_mask covers both. Returns input_ids
+    followed by the generated tokens, finished rows are dropped as in greedy_search.
+    """
+    if isinstance(eos_token_id, int):
+        eos_token_id = [eos_token_id]
+
+    if pad_token_id is None:
+        pad_token_id = eos_token_id[0]
+
+    batch_size = input_ids.shape[0]
+    device = input_ids.device
+    eos_token_id = torch.tensor(eos_token_id, device=device)
+    use_position_ids = "position_ids" in inspect.signature(model.forward).parameters
+
+    sequences = torch.full(
+        (batch_size, max_new_tokens), pad_token_id, dtype=torch.long, device=device
+    )
+
+    rows = torch.arange(batch_size, device=device)
+    if inputs_embeds is not None:
+        model_inputs = {"inputs_embeds": inputs_embeds}
+    else:
+        model_inputs = {"input_ids": input_ids}
+    length = max_new_tokens
+
+    for step in range(max_new_tokens):
+        if use_position_ids:
+            # positions of padded batches, as in prepare_inputs_for_generation
+            position_ids = attention_mask.long().cumsum(-1) - 1
+            position_ids.masked_fill_(attention_mask == 0, 1)
+            num_inputs = next(iter(model_inputs.values())).shape[1]
+            model_inputs["position_ids"] = position_ids[:, -num_inputs:]
+
+        outputs = model(
+            **model_inputs,
+            attention_mask=attention_mask,
+            past_key_values=past_key_values,
+            use_cache=True,
+            return_dict=True,
+        )
+
+        next_tokens = outputs.logits[:, -1].argmax(dim=-1)
+        sequences[rows, step] = next_tokens
+
+        unfinished = ~torch.isin(next_tokens, eos_token_id)
+        if not unfinished.any():
+            length = step + 1
+            break
+
+        past_key_values = outputs.past_key_values
+        attention_mask = torch.cat(
+            (attention_mask, attention_mask.new_ones((attention_mask.shape[0], 1))),
+            dim=1,
+        )
+        if not unfinished.all():
+            rows = rows[unfinished]
+            next_tokens = next_tokens[unfinished]
+            attention_mask = attention_mask[unfinished]
+            past_key_values = tuple(
+                tuple(past[unfinished] for past in layer_past)
+                for layer_past in past_key_values
+            )
+
+        model_inputs = {"input_ids": next_tokens.unsqueeze(-1)}
+
+    return torch.cat((input_ids, sequences[:, :length]), dim=1)
+
+
+def _token_list(token_ids):
+    # padded label tensors use -100 after the label
+    if isinstance(token_ids, torch.Tensor):
+        token_ids = token_ids.tolist()
+
+    return [token_id for token_id in token_ids if token_id != -100]
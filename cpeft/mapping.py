@@ -1,14 +1,27 @@
-from .model import PeftModelForSeq2SeqLM, PeftModel
+from .model import (
+    PeftModel,
+    PeftModelForCausalLM,
+    PeftModelForSeq2SeqLM,
+    PeftModelForSequenceClassification,
+)
 from .config import PeftConfig
 from .utils import _prepare_prompt_learning_config
 from .prompt_tuning import PromptTuningConfig
 from .attempt import AttemptConfig
+from .prefix_tuning import PrefixTuningConfig
 
 from transformers import PreTrainedModel
 
+MODEL_TYPE_TO_PEFT_MODEL_MAPPING = {
+    "seq_2_seq_lm": PeftModelForSeq2SeqLM,
+    "causal_lm": PeftModelForCausalLM,
+    "seq_cls": PeftModelForSequenceClassification,
+}
+
 PEFT_TYPE_TO_CONFIG_MAPPING = {
     "prompt_tuning": PromptTuningConfig,
     "attempt": AttemptConfig,
+    "prefix_tuning": PrefixTuningConfig,
 }
 
 
@@ -23,4 +36,6 @@ def get_peft_model(
 
         peft_config = _prepare_prompt_learning_config(peft_config, model_config)
 
-        return PeftModelForSeq2SeqLM(model, peft_config, adapter_name)
+        return MODEL_TYPE_TO_PEFT_MODEL_MAPPING[peft_config.task_type](
+            model, peft_config, adapter_name
+        )
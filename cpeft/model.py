@@ -1,19 +1,72 @@
 import torch
 import os
-from cpeft import PeftConfig, PromptTuningEmbedding, AttemptSubModule
+import contextlib
+import functools
+
+from collections import OrderedDict
+from cpeft import (
+    PeftConfig,
+    PromptTuningEmbedding,
+    PackedPromptEmbedding,
+    AttemptSubModule,
+    AttemptSparseSubModule,
+    PrefixEncoderHooks,
+)
 
 from transformers import PreTrainedModel
 from transformers.utils import PushToHubMixin
 from typing import Dict, Any, List, Optional
-from copy import deepcopy
 
-from .utils import _prepare_prompt_learning_config, infer_device, _get_batch_size
+from transformers.modeling_outputs import SequenceClassifierOutput
+
+from .checkpointing import checkpoint_blocks, uncheckpoint_blocks
+from .classification import ClassificationHead
+from .generation import (
+    causal_greedy_search,
+    decode,
+    generate,
+    get_max_new_tokens,
+    prepare_generation_config,
+    rank_classification,
+)
+from .prompt_bank import load_prompts
+from .utils import (
+    _prepare_prompt_learning_config,
+    infer_device,
+    _get_batch_size,
+    _mean_pool,
+)
 from .save_and_load import (
     get_peft_model_state_dict,
+    get_prompt_sha256,
     set_peft_model_state_dict,
     load_peft_weights,
+    save_peft_weights,
 )
 
+# prefix masks of the most recent batch shapes, the last batch of an epoch and
+# generation produce a few more shapes than the training batch size
+MAX_PREFIX_ATTENTION_MASKS = 8
+
+
+def _weight_version(weight):
+    # _version only counts in-place updates of one tensor, its storage can be swapped
+    return (id(weight), weight._version, weight.data_ptr(), weight.device)
+
+
+def _clears_prefix(method):
+    # the prefix set by prepend_prompts (and its autograd graph) is dropped once the
+    # encoder has run, also when it fails
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            if hasattr(self, "prefix_hooks"):
+                self.prefix_hooks.clear()
+
+    return wrapper
+
 
 class PeftModel(PushToHubMixin, torch.nn.Module):
     def __init__(
@@ -21,6 +74,7 @@ class PeftModel(PushToHubMixin, torch.nn.Module):
         model: PreTrainedModel,
         peft_config: PeftConfig,
         adapter_name: str = "peft",
+        init_prompts: bool = True,
     ):
         super().__init__()
         self.base_model = model
@@ -31,25 +85,13 @@ class PeftModel(PushToHubMixin, torch.nn.Module):
         self._is_prompt_learning = peft_config.is_prompt_learning
 
         self.config = getattr(self.base_model, "config", {"model_type": "custom"})
-        self.add_adapter(adapter_name, peft_config)
-
-        prefix_embeddings = []
-        if self.peft_config[self.active_adapter].peft_type == "attempt":
-            for path in self.peft_config[self.active_adapter].prompt_embedding_paths:
-                emb = torch.load(path)
-                # this is because of original attempt prompts are not dict
-                if type(emb) == dict:
-                    prefix_embeddings.append(emb["prompt_embeddings"].to(self.device))
-                else:
-                    prefix_embeddings.append(emb.to(self.device))
-
-            # print(prefix_embeddings)
-            self.attention_module[adapter_name].store_prefix_weights(prefix_embeddings)
+        self.add_adapter(adapter_name, peft_config, init_prompts=init_prompts)
 
     def save_pretrained(
         self,
         save_directory: str,
         selected_adapters: Optional[List[str]] = None,
+        safe_serialization: bool = True,
         **kwargs: Any,
     ):
         if os.path.isfile(save_directory):
@@ -62,6 +104,14 @@ class PeftModel(PushToHubMixin, torch.nn.Module):
 
         for adapter_name in selected_adapters:
             peft_config = self.peft_config[adapter_name]
+
+            # source prompts left out of the bundle are referenced by their hashes
+            if peft_config.mixes_source_prompts and not peft_config.save_source_prompts:
+                peft_config.source_prompts_sha256 = [
+                    get_prompt_sha256(prompt)
+                    for prompt in self.attention_module[adapter_name].mul_prefix_emb
+                ]
+
             output_state_dict = get_peft_model_state_dict(
                 self,
                 state_dict=kwargs.get("state_dict", None),
@@ -75,7 +125,9 @@ class PeftModel(PushToHubMixin, torch.nn.Module):
 
             os.makedirs(output_dir, exist_ok=True)
 
-            torch.save(output_state_dict, os.path.join(output_dir, "adapter_model.bin"))
+            save_peft_weights(
+                output_state_dict, output_dir, safe_serialization=safe_serialization
+            )
 
             inference_mode = peft_config.inference_mode
             peft_config.inference_mode = True
@@ -93,16 +145,16 @@ class PeftModel(PushToHubMixin, torch.nn.Module):
         config: Optional[PeftConfig] = None,
         **kwargs: Any,
     ):
-        if config is None:
-            model_path = model_id
+        model_path = model_id
 
-            if adapter_name != "peft":
-                model_path = os.path.join(model_path, adapter_name)
+        if adapter_name != "peft":
+            model_path = os.path.join(model_path, adapter_name)
 
+        if config is None:
             from .mapping import PEFT_TYPE_TO_CONFIG_MAPPING
 
             config = PEFT_TYPE_TO_CONFIG_MAPPING[
-                PeftConfig._get_peft_type(model_id)
+                PeftConfig._get_peft_type(model_path)
             ].from_pretrained(model_path, **kwargs)
 
         if config.is_prompt_learning and is_trainable:
@@ -112,7 +164,12 @@ class PeftModel(PushToHubMixin, torch.nn.Module):
         else:
             config.inference_mode = not is_trainable
 
-        model = PeftModelForSeq2SeqLM(model, config, adapter_name)
+        from .mapping import MODEL_TYPE_TO_PEFT_MODEL_MAPPING
+
+        # prompts are restored from the bundle, the init files are not read
+        model = MODEL_TYPE_TO_PEFT_MODEL_MAPPING[config.task_type](
+            model, config, adapter_name, init_prompts=False
+        )
         model.load_adapter(
             model_path, adapter_name, is_trainable=is_trainable, **kwargs
         )
@@ -156,7 +213,9 @@ class PeftModel(PushToHubMixin, torch.nn.Module):
 
         return trainable_params, all_param
 
-    def add_adapter(self, adapter_name: str, peft_config: PeftConfig):
+    def add_adapter(
+        self, adapter_name: str, peft_config: PeftConfig, init_prompts: bool = True
+    ):
         self.peft_config[adapter_name] = peft_config
 
         if peft_config.is_prompt_learning:
@@ -166,26 +225,152 @@ class PeftModel(PushToHubMixin, torch.nn.Module):
                 dict_config = self.config
 
             peft_config = _prepare_prompt_learning_config(peft_config, dict_config)
-            self._setup_prompt_encoder(adapter_name)
+            self._setup_prompt_encoder(adapter_name, init_prompts)
+
+            if peft_config.mixes_source_prompts:
+                self._setup_attention_module(adapter_name, init_prompts)
+
+            if peft_config.peft_type == "prefix_tuning":
+                self._setup_prefix_hooks(adapter_name)
 
-            if peft_config.peft_type == "attempt":
-                self._setup_attention_module(adapter_name)
+    def set_adapter(self, adapter_name: str):
+        if adapter_name not in self.peft_config:
+            raise ValueError(f"Adapter {adapter_name} not found.")
+
+        self.active_adapter = adapter_name
+
+    def delete_adapter(self, adapter_name: str):
+        if adapter_name not in self.peft_config:
+            raise ValueError(f"Adapter {adapter_name} not found.")
+
+        if adapter_name == self.active_adapter:
+            raise ValueError(f"Active adapter {adapter_name} cannot be deleted.")
+
+        del self.peft_config[adapter_name]
+        del self.prompt_encoder[adapter_name]
+
+        if hasattr(self, "attention_module") and adapter_name in self.attention_module:
+            del self.attention_module[adapter_name]
+
+        if (
+            hasattr(self, "classification_head")
+            and adapter_name in self.classification_head
+        ):
+            del self.classification_head[adapter_name]
+
+        self._invalidate_prompt_cache(adapter_name)
+
+    def _invalidate_prompt_cache(self, adapter_name: str):
+        # cached prompts and prompt states are views of the adapter weights, they have to
+        # go when the weights are deleted or moved to another device
+        self._prompt_cache = {
+            key: value
+            for key, value in self._prompt_cache.items()
+            if key[0] != adapter_name
+        }
+        self._prompt_states = {
+            key: value
+            for key, value in self._prompt_states.items()
+            if key[0] != adapter_name
+        }
+
+    def enable_activation_checkpointing(self, stacks: str = "all", every: int = 1):
+        """Checkpoints every `every`-th block of the frozen backbone.
+
+        stacks selects the encoder, the decoder or both ("all") blocks, decoder-only
+        models have just the decoder. Saves activation memory for recomputing the
+        blocks in the backward pass.
+        """
+        self.disable_activation_checkpointing()
+
+        for blocks in self._get_backbone_blocks(stacks):
+            checkpoint_blocks(blocks[::every], self._checkpoint_context)
+
+    def _checkpoint_context(self):
+        # encoder layers are recomputed in backward, after the prefix has been cleared
+        if hasattr(self, "prefix_hooks"):
+            return self.prefix_hooks.recompute_context()
+
+        return contextlib.nullcontext(), contextlib.nullcontext()
+
+    def disable_activation_checkpointing(self):
+        for blocks in self._get_backbone_blocks("all"):
+            uncheckpoint_blocks(blocks)
+
+    def _get_backbone_blocks(self, stacks):
+        if stacks not in ["all", "encoder", "decoder"]:
+            raise ValueError(f"Unknown stacks {stacks} to checkpoint.")
+
+        if hasattr(self.base_model, "get_encoder"):
+            modules = {
+                "encoder": self.base_model.get_encoder(),
+                "decoder": self.base_model.get_decoder(),
+            }
+        else:
+            modules = {"decoder": self.base_model}
+
+        # the first module list of a stack holds its blocks (T5 block, GPT-2 h, ...)
+        return [
+            next(m for m in module.modules() if isinstance(m, torch.nn.ModuleList))
+            for name, module in modules.items()
+            if stacks in ["all", name]
+        ]
+
+    def get_adapter_modules(self, adapter_name: str):
+        modules = [self.prompt_encoder[adapter_name]]
+
+        if hasattr(self, "attention_module") and adapter_name in self.attention_module:
+            modules.append(self.attention_module[adapter_name])
+
+        if (
+            hasattr(self, "classification_head")
+            and adapter_name in self.classification_head
+        ):
+            modules.append(self.classification_head[adapter_name])
+
+        return modules
+
+    def _get_single_adapter(self, adapter_names):
+        if adapter_names is None:
+            return self.active_adapter
+
+        if len(set(adapter_names)) == 1:
+            return adapter_names[0]
+
+        return None
 
     def load_adapter(
         self,
         model_id: str,
         adapter_name: str,
         is_trainable: bool = False,
+        device: Optional[str] = None,
         **kwargs: Any,
     ):
-        torch_device = infer_device()
+        if adapter_name not in self.peft_config:
+            from .mapping import PEFT_TYPE_TO_CONFIG_MAPPING
+
+            peft_config = PEFT_TYPE_TO_CONFIG_MAPPING[
+                PeftConfig._get_peft_type(model_id)
+            ].from_pretrained(model_id)
+            peft_config.inference_mode = not is_trainable
+            self.add_adapter(adapter_name, peft_config, init_prompts=False)
+
+        torch_device = infer_device() if device is None else device
 
-        adapters_weights = load_peft_weights(model_id, device=torch_device, **kwargs)
+        adapters_weights = load_peft_weights(model_id, device=torch_device)
 
         load_result = set_peft_model_state_dict(
             self, adapters_weights, adapter_name=adapter_name
         )
 
+        # bundles saved without source prompts still need their original files
+        if (
+            self.peft_config[adapter_name].mixes_source_prompts
+            and not self.attention_module[adapter_name].prefix_loaded
+        ):
+            self._load_source_prompts(adapter_name)
+
         if not is_trainable:
             self.eval()
 
@@ -194,60 +379,294 @@ class PeftModel(PushToHubMixin, torch.nn.Module):
     def get_prompt_embedding_to_save(self, adapter_name: str):
         prompt_encoder = self.prompt_encoder[adapter_name]
 
-        if type(prompt_encoder.embedding) == torch.nn.ModuleList:
-            prompt_tokens = self.prompt_tokens[adapter_name].to(
-                prompt_encoder.embedding[0].weight.device
-            )
+        if isinstance(prompt_encoder.embedding, PackedPromptEmbedding):
+            return prompt_encoder.embedding.weight.detach().cpu()
 
-            prompt_embeddings = prompt_encoder(
-                prompt_tokens,
-                task_ids=torch.tensor(range(len(prompt_encoder.embedding))),
-            )
-        else:
-            prompt_tokens = self.prompt_tokens[adapter_name].to(
-                prompt_encoder.embedding.weight.device
-            )
-            prompt_embeddings = prompt_encoder(prompt_tokens, task_ids=None)
+        prompt_embeddings = prompt_encoder(prompt_encoder.prompt_tokens, task_ids=None)
         return prompt_embeddings.detach().cpu()
 
-    def get_prompt(self, batch_size: int, task_ids: List[int]):
-        peft_config = self.active_peft_config
-        prompt_encoder = self.prompt_encoder[self.active_adapter]
+    def get_prompt(
+        self,
+        batch_size: int,
+        task_ids: List[int],
+        dtype: Optional[torch.dtype] = None,
+        adapter_name: Optional[str] = None,
+    ):
+        adapter_name = self.active_adapter if adapter_name is None else adapter_name
+        peft_config = self.peft_config[adapter_name]
+        prompt_encoder = self.prompt_encoder[adapter_name]
         # print(prompt_encoder.embedding[0].weight.device)
 
-        if type(prompt_encoder.embedding) == torch.nn.ModuleList:
-            prompt_tokens = self.prompt_tokens[self.active_adapter].to(
-                prompt_encoder.embedding[0].weight.device
-            )
-        else:
-            prompt_tokens = (
-                self.prompt_tokens[self.active_adapter]
-                .unsqueeze(0)
-                .expand(batch_size, -1)
-                .to(prompt_encoder.embedding.weight.device)
-            )
+        if not isinstance(prompt_encoder.embedding, PackedPromptEmbedding):
+            # task ids only select a target prompt from a multi-target bank
+            task_ids = None
 
         if peft_config.inference_mode:
             # print("inference")
+            weight = prompt_encoder.embedding.weight
             if task_ids is None:
-                prompts = prompt_encoder.embedding.weight.repeat(batch_size, 1, 1)
+                return self._get_cached_prompt(weight, batch_size, dtype, adapter_name)
+
+            task_ids = torch.as_tensor(task_ids, device=weight.device)
+            prompts = weight[task_ids]
+        else:
+            if isinstance(prompt_encoder.embedding, PackedPromptEmbedding):
+                prompt_tokens = prompt_encoder.prompt_tokens
             else:
-                prompts = torch.stack(
-                    [prompt_encoder.embedding[id].weight for id in task_ids]
+                prompt_tokens = prompt_encoder.prompt_tokens.unsqueeze(0).expand(
+                    batch_size, -1
                 )
-        else:
+
             prompts = prompt_encoder(prompt_tokens, task_ids)
 
+        if dtype is not None:
+            prompts = prompts.to(dtype)
+
         return prompts
 
-    def get_instance_prompt(self, inputs_embeds, prompts):
-        attention_module = self.attention_module[self.active_adapter]
+    def _get_cached_prompt(self, weight, batch_size, dtype, adapter_name):
+        # the expanded prompt is reused until the prompt weights are changed in place, replaced
+        # or their storage is swapped (param.data = ..., moved to another device)
+        dtype = weight.dtype if dtype is None else dtype
+        key = (adapter_name, batch_size, dtype, weight.device)
+        version = _weight_version(weight)
+
+        cached = self._prompt_cache.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        prompts = weight.unsqueeze(0).expand(batch_size, -1, -1).to(dtype)
+        if not (torch.is_grad_enabled() and weight.requires_grad):
+            self._prompt_cache[key] = (version, prompts)
+
+        return prompts
+
+    def get_prefix_attention_mask(
+        self,
+        batch_size: int,
+        attention_mask: torch.Tensor,
+        num_virtual_tokens: Optional[int] = None,
+    ):
+        # prefix masks are allocated once per batch size, dtype and device, only the most
+        # recently used ones are kept
+        if num_virtual_tokens is None:
+            num_virtual_tokens = self.active_peft_config.num_virtual_tokens
+
+        key = (
+            batch_size,
+            num_virtual_tokens,
+            attention_mask.dtype,
+            attention_mask.device,
+        )
+
+        if key in self._prefix_attention_masks:
+            self._prefix_attention_masks.move_to_end(key)
+            return self._prefix_attention_masks[key]
+
+        prefix_attention_mask = torch.ones(
+            (batch_size, num_virtual_tokens),
+            dtype=attention_mask.dtype,
+            device=attention_mask.device,
+        )
+        self._prefix_attention_masks[key] = prefix_attention_mask
+        while len(self._prefix_attention_masks) > MAX_PREFIX_ATTENTION_MASKS:
+            self._prefix_attention_masks.popitem(last=False)
+
+        return prefix_attention_mask
+
+    def get_instance_prompt(self, inputs_embeds, prompts, adapter_name=None):
+        adapter_name = self.active_adapter if adapter_name is None else adapter_name
+        attention_module = self.attention_module[adapter_name]
 
         instance_prompts = attention_module(inputs_embeds, prompts)
 
         return instance_prompts
 
-    def _setup_attention_module(self, adapter_name):
+    def get_adapter_prompts(self, inputs_embeds, task_ids=None, adapter_name=None):
+        adapter_name = self.active_adapter if adapter_name is None else adapter_name
+        peft_config = self.peft_config[adapter_name]
+        batch_size = inputs_embeds.shape[0]
+
+        prompts = self.get_prompt(
+            batch_size=batch_size,
+            task_ids=task_ids,
+            dtype=inputs_embeds.dtype,
+            adapter_name=adapter_name,
+        )
+
+        if peft_config.mixes_source_prompts:
+            prompts = self.get_instance_prompt(inputs_embeds, prompts, adapter_name)
+
+        prompts = prompts.to(inputs_embeds.dtype)
+
+        return prompts[:, : peft_config.num_virtual_tokens]
+
+    def get_prefix_key_values(self, inputs_embeds, task_ids=None, adapter_name=None):
+        adapter_name = self.active_adapter if adapter_name is None else adapter_name
+        peft_config = self.peft_config[adapter_name]
+        batch_size = inputs_embeds.shape[0]
+
+        prompts = self.get_prompt(
+            batch_size=batch_size,
+            task_ids=task_ids,
+            dtype=inputs_embeds.dtype,
+            adapter_name=adapter_name,
+        )
+
+        if peft_config.mixes_source_prompts:
+            prompts = self.get_instance_prompt(inputs_embeds, prompts, adapter_name)
+
+        prompts = prompts.to(inputs_embeds.dtype)
+
+        # [layers, 2, batch, heads, tokens, head_dim]
+        key_values = prompts.view(
+            batch_size,
+            peft_config.num_layers,
+            2,
+            peft_config.num_virtual_tokens,
+            peft_config.num_attention_heads,
+            peft_config.token_dim // peft_config.num_attention_heads,
+        ).permute(1, 2, 0, 4, 3, 5)
+
+        return [tuple(key_value) for key_value in key_values]
+
+    def prepend_prompts(
+        self, inputs_embeds, attention_mask=None, task_ids=None, adapter_names=None
+    ):
+        # prompts are computed in fp32 also when the backbone runs under autocast
+        with torch.autocast(inputs_embeds.device.type, enabled=False):
+            return self._prepend_prompts(
+                inputs_embeds, attention_mask, task_ids, adapter_names
+            )
+
+    def _prepend_prompts(self, inputs_embeds, attention_mask, task_ids, adapter_names):
+        batch_size = inputs_embeds.shape[0]
+
+        if adapter_names is not None and len(set(adapter_names)) == 1:
+            adapter_names, adapter_name = None, adapter_names[0]
+        else:
+            adapter_name = self.active_adapter
+
+        if hasattr(self, "prefix_hooks"):
+            self.prefix_hooks.clear()
+
+        # a prefix goes into the encoder layers, the inputs stay as they are
+        if (
+            adapter_names is None
+            and self.peft_config[adapter_name].peft_type == "prefix_tuning"
+        ):
+            self.prefix_hooks.set(
+                self.get_prefix_key_values(inputs_embeds, task_ids, adapter_name)
+            )
+            return inputs_embeds, attention_mask
+
+        if adapter_names is None:
+            prompts = self.get_adapter_prompts(inputs_embeds, task_ids, adapter_name)
+
+            if attention_mask is not None:
+                prefix_attention_mask = self.get_prefix_attention_mask(
+                    batch_size, attention_mask, prompts.shape[1]
+                )
+                attention_mask = torch.cat(
+                    (prefix_attention_mask, attention_mask), dim=1
+                )
+        else:
+            prompts, prefix_attention_mask = self.get_mixed_prompts(
+                inputs_embeds, task_ids, adapter_names
+            )
+
+            if attention_mask is None:
+                attention_mask = torch.ones(
+                    inputs_embeds.shape[:2],
+                    dtype=torch.long,
+                    device=inputs_embeds.device,
+                )
+            attention_mask = torch.cat(
+                (prefix_attention_mask.to(attention_mask.dtype), attention_mask), dim=1
+            )
+
+        inputs_embeds = torch.cat((prompts, inputs_embeds), dim=1)
+
+        return inputs_embeds, attention_mask
+
+    def get_mixed_prompts(self, inputs_embeds, task_ids, adapter_names):
+        # every row gets the prompt of its own adapter, prompts shorter than the longest one
+        # are left padded and masked, so their distance to the input stays the same
+        if len(adapter_names) != inputs_embeds.shape[0]:
+            raise ValueError("One adapter name has to be provided for every row.")
+
+        device = inputs_embeds.device
+        groups = {}
+        for row, adapter_name in enumerate(adapter_names):
+            groups.setdefault(adapter_name, []).append(row)
+
+        if any(
+            self.peft_config[adapter_name].peft_type == "prefix_tuning"
+            for adapter_name in groups
+        ):
+            raise ValueError("Prefix tuning adapters cannot be mixed in one batch.")
+
+        max_tokens = max(
+            self.peft_config[adapter_name].num_virtual_tokens for adapter_name in groups
+        )
+
+        if task_ids is not None:
+            task_ids = torch.as_tensor(task_ids, device=device)
+
+        prompts, prefix_attention_masks, order = [], [], []
+        for adapter_name, rows in groups.items():
+            rows = torch.tensor(rows, device=device)
+
+            adapter_prompts = self.get_adapter_prompts(
+                inputs_embeds[rows],
+                None if task_ids is None else task_ids[rows],
+                adapter_name,
+            )
+            padding = max_tokens - adapter_prompts.shape[1]
+
+            prompts.append(torch.nn.functional.pad(adapter_prompts, (0, 0, padding, 0)))
+            prefix_attention_masks.append(
+                (torch.arange(max_tokens, device=device) >= padding).expand(
+                    len(rows), -1
+                )
+            )
+            order.append(rows)
+
+        inverse_order = torch.argsort(torch.cat(order))
+        prompts = torch.cat(prompts)[inverse_order]
+        prefix_attention_mask = torch.cat(prefix_attention_masks)[inverse_order]
+
+        return prompts, prefix_attention_mask
+
+    @_clears_prefix
+    def encode(
+        self,
+        input_ids=None,
+        attention_mask=None,
+        inputs_embeds=None,
+        task_ids=None,
+        adapter_names=None,
+    ):
+        # prompted inputs through the encoder of an encoder-decoder model
+        if inputs_embeds is None:
+            inputs_embeds = self.word_embeddings(input_ids)
+
+        if attention_mask is None:
+            attention_mask = torch.ones(
+                inputs_embeds.shape[:2], dtype=torch.long, device=inputs_embeds.device
+            )
+
+        inputs_embeds, attention_mask = self.prepend_prompts(
+            inputs_embeds, attention_mask, task_ids, adapter_names
+        )
+
+        encoder_outputs = self.base_model.get_encoder()(
+            inputs_embeds=inputs_embeds, attention_mask=attention_mask, return_dict=True
+        )
+
+        return encoder_outputs, attention_mask
+
+    def _setup_attention_module(self, adapter_name, init_prompts=True):
         config = self.peft_config[adapter_name]
 
         if not hasattr(self, "attention_module"):
@@ -255,18 +674,84 @@ class PeftModel(PushToHubMixin, torch.nn.Module):
 
         if config.attn_method == "sub":
             attention_module = AttemptSubModule(config)
+        elif config.attn_method == "sub_topk":
+            attention_module = AttemptSparseSubModule(config)
+        else:
+            raise ValueError(f"Unknown attention method {config.attn_method}.")
+
+        # a source prefix holds the keys and values of all layers and is mixed as a whole
+        # with one score, so the mixture is num_transformer_submodules (2 * layers) times
+        # the tokens per layer, see PrefixTuningConfig
+        if config.peft_type == "prefix_tuning":
+            attention_module.num_virtual_tokens = (
+                config.num_virtual_tokens * config.num_transformer_submodules
+            )
 
         attention_module = attention_module.to(self.device)
         self.attention_module.update(
             torch.nn.ModuleDict({adapter_name: attention_module})
         )
 
-    def _setup_prompt_encoder(self, adapter_name):
+        if init_prompts:
+            self._load_source_prompts(adapter_name)
+
+    def _load_source_prompts(self, adapter_name):
+        config = self.peft_config[adapter_name]
+        attention_module = self.attention_module[adapter_name]
+
+        prefix_embeddings = load_prompts(
+            config.prompt_embedding_paths, config.prompt_bank
+        )
+
+        # prompt files referenced by a saved adapter must not have changed since
+        if config.source_prompts_sha256 is not None:
+            changed = [
+                path
+                for path, prompt, sha256 in zip(
+                    config.prompt_embedding_paths,
+                    prefix_embeddings,
+                    config.source_prompts_sha256,
+                )
+                if get_prompt_sha256(prompt) != sha256
+            ]
+            if changed or len(prefix_embeddings) != len(config.source_prompts_sha256):
+                raise ValueError(
+                    f"Source prompts of {adapter_name} differ from the saved ones: {changed}."
+                )
+
+        if prefix_embeddings.shape[1] < attention_module.num_virtual_tokens:
+            raise ValueError(
+                f"Source prompts of {adapter_name} have {prefix_embeddings.shape[1]} tokens, "
+                f"{attention_module.num_virtual_tokens} are mixed."
+            )
+
+        # print(prefix_embeddings)
+        attention_module.store_prefix_weights(
+            prefix_embeddings.to(attention_module.mul_prefix_emb.device)
+        )
+
+    def _setup_prefix_hooks(self, adapter_name):
+        config = self.peft_config[adapter_name]
+
+        head_dim = getattr(self.base_model.config, "d_kv", None)
+        if head_dim is not None and head_dim * config.num_attention_heads != (
+            config.token_dim
+        ):
+            raise ValueError(
+                "Prefix tuning needs the attention inner dimension equal to d_model."
+            )
+
+        if not hasattr(self, "prefix_hooks"):
+            self.prefix_hooks = PrefixEncoderHooks(self.base_model)
+
+    def _setup_prompt_encoder(self, adapter_name, init_prompts=True):
         config = self.peft_config[adapter_name]
 
         if not hasattr(self, "prompt_encoder"):
             self.prompt_encoder = torch.nn.ModuleDict({})
-            self.prompt_tokens = {}
+            self._prompt_cache = {}
+            self._prompt_states = {}
+            self._prefix_attention_masks = OrderedDict()
 
         transformer_backbone = None
 
@@ -284,11 +769,14 @@ class PeftModel(PushToHubMixin, torch.nn.Module):
         if transformer_backbone is None:
             transformer_backbone = self.base_model
 
-        # set the number of modules
+        # set the number of modules, a prefix has keys and values of every encoder layer
         if config.num_transformer_submodules is None:
-            config.num_transformer_submodules = (
-                2 if config.task_type == "seq_2_seq_lm" else 1
-            )
+            if config.peft_type == "prefix_tuning":
+                config.num_transformer_submodules = 2 * config.num_layers
+            else:
+                config.num_transformer_submodules = (
+                    2 if config.task_type == "seq_2_seq_lm" else 1
+                )
 
         for named_param, value in list(transformer_backbone.named_parameters()):
             if value.shape[0] == self.base_model.config.vocab_size:
@@ -297,14 +785,13 @@ class PeftModel(PushToHubMixin, torch.nn.Module):
                 )
                 break
 
-        if config.peft_type == "prompt_tuning" or config.peft_type == "attempt":
-            prompt_encoder = PromptTuningEmbedding(config, self.word_embeddings)
+        if config.peft_type in ["prompt_tuning", "attempt", "prefix_tuning"]:
+            prompt_encoder = PromptTuningEmbedding(
+                config, self.word_embeddings, init_prompts=init_prompts
+            )
 
         prompt_encoder = prompt_encoder.to(self.device)
         self.prompt_encoder.update(torch.nn.ModuleDict({adapter_name: prompt_encoder}))
-        self.prompt_tokens[adapter_name] = torch.arange(
-            config.num_virtual_tokens * config.num_transformer_submodules
-        ).long()
 
     def __getattr__(self, name: str):
         try:
@@ -315,6 +802,47 @@ class PeftModel(PushToHubMixin, torch.nn.Module):
     def forward(self, *args: Any, **kwargs: Any):
         return self.get_base_model()(*args, **kwargs)
 
+    @torch.no_grad()
+    def eval_step(
+        self,
+        input_ids=None,
+        attention_mask=None,
+        labels=None,
+        task_ids=None,
+        adapter_names=None,
+        label_token_ids=None,
+        **kwargs,
+    ):
+        """Evaluation loss from forward and predictions from generate, returns (loss, preds).
+
+        Models that share the prompted inputs between the two override it. The labels
+        are passed to forward as they are, a causal LM needs them aligned with input_ids.
+        """
+        # labels are scored against the encoder output, see PeftModelForSeq2SeqLM
+        if label_token_ids is not None:
+            raise ValueError(
+                "Rank classification is only supported for seq_2_seq_lm models, "
+                f"use eval_mode generate for {type(self).__name__}."
+            )
+
+        loss = self(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            labels=labels,
+            task_ids=task_ids,
+            adapter_names=adapter_names,
+        ).loss
+
+        preds = self.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            task_ids=task_ids,
+            adapter_names=adapter_names,
+            **kwargs,
+        )
+
+        return loss, preds
+
 
 class PeftModelForSeq2SeqLM(PeftModel):
     def __init__(
@@ -322,16 +850,11 @@ class PeftModelForSeq2SeqLM(PeftModel):
         model: PreTrainedModel,
         peft_config: PeftConfig,
         adapter_name: str = "seq2seq_peft",
+        init_prompts: bool = True,
     ):
-        super().__init__(model, peft_config, adapter_name)
-
-        self.base_model_prepare_inputs_for_generation = (
-            self.base_model.prepare_inputs_for_generation
-        )
-        self.base_model_prepare_encoder_decoder_kwargs_for_generation = (
-            self.base_model._prepare_encoder_decoder_kwargs_for_generation
-        )
+        super().__init__(model, peft_config, adapter_name, init_prompts)
 
+    @_clears_prefix
     def forward(
         self,
         input_ids=None,
@@ -345,16 +868,23 @@ class PeftModelForSeq2SeqLM(PeftModel):
         output_hidden_states=None,
         return_dict=None,
         task_ids=None,
+        adapter_names=None,
         **kwargs,
     ):
-        peft_config = self.active_peft_config
-
         batch_size = _get_batch_size(input_ids, inputs_embeds)
 
+        if inputs_embeds is None:
+            inputs_embeds = self.word_embeddings(input_ids)
+
+        num_inputs = inputs_embeds.shape[1]
+        inputs_embeds, attention_mask = self.prepend_prompts(
+            inputs_embeds, attention_mask, task_ids, adapter_names
+        )
+
         if decoder_attention_mask is not None:
-            prefix_attention_mask = torch.ones(
-                batch_size, peft_config.num_virtual_tokens
-            ).to(decoder_attention_mask.device)
+            prefix_attention_mask = self.get_prefix_attention_mask(
+                batch_size, decoder_attention_mask, inputs_embeds.shape[1] - num_inputs
+            )
             decoder_attention_mask = torch.cat(
                 (prefix_attention_mask, decoder_attention_mask), dim=1
             )
@@ -370,70 +900,463 @@ class PeftModelForSeq2SeqLM(PeftModel):
             }
         )
 
+        return self.base_model(
+            inputs_embeds=inputs_embeds,
+            decoder_input_ids=decoder_input_ids,
+            decoder_inputs_embeds=decoder_inputs_embeds,
+            **kwargs,
+        )
+
+    @_clears_prefix
+    def generate(
+        self,
+        input_ids=None,
+        attention_mask=None,
+        inputs_embeds=None,
+        task_ids=None,
+        adapter_names=None,
+        **kwargs,
+    ):
+        # labels are passed by the trainer, generation does not use them
+        kwargs.pop("labels", None)
+
         if inputs_embeds is None:
             inputs_embeds = self.word_embeddings(input_ids)
 
-        if attention_mask is not None:
-            prefix_attention_mask = torch.ones(
-                batch_size, peft_config.num_virtual_tokens
-            ).to(attention_mask.device)
-            kwargs["attention_mask"] = torch.cat(
-                (prefix_attention_mask, attention_mask), dim=1
+        inputs_embeds, attention_mask = self.prepend_prompts(
+            inputs_embeds, attention_mask, task_ids, adapter_names
+        )
+
+        return generate(self.base_model, inputs_embeds, attention_mask, **kwargs)
+
+    def rank_classify(
+        self,
+        label_token_ids,
+        input_ids=None,
+        attention_mask=None,
+        inputs_embeds=None,
+        task_ids=None,
+        adapter_names=None,
+    ):
+        encoder_outputs, attention_mask = self.encode(
+            input_ids, attention_mask, inputs_embeds, task_ids, adapter_names
+        )
+
+        return rank_classification(
+            self.base_model,
+            encoder_outputs.last_hidden_state,
+            attention_mask,
+            label_token_ids,
+            self.base_model.config.decoder_start_token_id,
+            self.base_model.config.pad_token_id,
+        )
+
+    @torch.no_grad()
+    def eval_step(
+        self,
+        input_ids=None,
+        attention_mask=None,
+        labels=None,
+        inputs_embeds=None,
+        task_ids=None,
+        adapter_names=None,
+        label_token_ids=None,
+        **kwargs,
+    ):
+        """Evaluation loss and predictions from one encoder pass.
+
+        The prompts (with the ATTEMPT instance prompts) and the encoder output are
+        computed once and shared by the teacher-forced loss and by decoding, or by
+        rank classification when label_token_ids are given. Returns (loss, preds).
+        """
+        encoder_outputs, attention_mask = self.encode(
+            input_ids, attention_mask, inputs_embeds, task_ids, adapter_names
+        )
+
+        loss = self.base_model(
+            encoder_outputs=encoder_outputs,
+            attention_mask=attention_mask,
+            labels=labels,
+            return_dict=True,
+        ).loss
+
+        if label_token_ids is not None:
+            preds = rank_classification(
+                self.base_model,
+                encoder_outputs.last_hidden_state,
+                attention_mask,
+                label_token_ids,
+                self.base_model.config.decoder_start_token_id,
+                self.base_model.config.pad_token_id,
             )
+        else:
+            preds = decode(self.base_model, encoder_outputs, attention_mask, **kwargs)
 
-        prompts = self.get_prompt(batch_size=batch_size, task_ids=task_ids)
+        return loss, preds
 
-        if peft_config.peft_type == "attempt":
-            prompts = self.get_instance_prompt(inputs_embeds, prompts)
 
-        prompts = prompts.to(inputs_embeds.dtype)
-        # print(prompts[:, : peft_config.num_virtual_tokens].shape)
-        # print(inputs_embeds.shape)
+class PeftModelForSequenceClassification(PeftModel):
+    """Classifies with the encoder only, the decoder is never run.
+
+    The mean of the encoder output over the prompted input (which includes the
+    instance prompt of ATTEMPT) is scored by a trainable head over the labels of the
+    tasks. The loss maps the tokenized labels to classes and generate returns the
+    tokenized predicted labels, so postprocessors and metrics work unchanged.
+    """
 
-        inputs_embeds = torch.cat(
-            (prompts[:, : peft_config.num_virtual_tokens], inputs_embeds), dim=1
+    def __init__(
+        self,
+        model: PreTrainedModel,
+        peft_config: PeftConfig,
+        adapter_name: str = "peft",
+        init_prompts: bool = True,
+    ):
+        super().__init__(model, peft_config, adapter_name, init_prompts)
+
+    def add_adapter(
+        self, adapter_name: str, peft_config: PeftConfig, init_prompts: bool = True
+    ):
+        super().add_adapter(adapter_name, peft_config, init_prompts)
+
+        if not hasattr(self, "classification_head"):
+            self.classification_head = torch.nn.ModuleDict({})
+
+        classification_head = ClassificationHead(peft_config).to(self.device)
+        self.classification_head.update(
+            torch.nn.ModuleDict({adapter_name: classification_head})
         )
 
-        return self.base_model(
+    def forward(
+        self,
+        input_ids=None,
+        attention_mask=None,
+        inputs_embeds=None,
+        labels=None,
+        return_dict=None,
+        task_ids=None,
+        adapter_names=None,
+        **kwargs,
+    ):
+        adapter_name = self._get_single_adapter(adapter_names)
+        if adapter_name is None:
+            raise ValueError("Sequence classification needs one adapter per batch.")
+
+        encoder_outputs, attention_mask = self.encode(
+            input_ids, attention_mask, inputs_embeds, task_ids, adapter_names
+        )
+
+        classification_head = self.classification_head[adapter_name]
+        logits = classification_head(
+            _mean_pool(encoder_outputs.last_hidden_state, attention_mask), task_ids
+        )
+
+        loss = None
+        if labels is not None:
+            classes = classification_head.get_classes(
+                labels, self.base_model.config.pad_token_id
+            )
+            loss = torch.nn.functional.cross_entropy(logits, classes)
+
+        outputs = SequenceClassifierOutput(loss=loss, logits=logits)
+
+        if return_dict is False:
+            return outputs.to_tuple()
+
+        return outputs
+
+    def generate(
+        self,
+        input_ids=None,
+        attention_mask=None,
+        inputs_embeds=None,
+        task_ids=None,
+        adapter_names=None,
+        **kwargs,
+    ):
+        # generation settings (max_new_tokens, ...) do not apply to a single label
+        logits = self(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
             inputs_embeds=inputs_embeds,
-            decoder_input_ids=decoder_input_ids,
-            decoder_inputs_embeds=decoder_inputs_embeds,
+            task_ids=task_ids,
+            adapter_names=adapter_names,
+        ).logits
+
+        return self.get_label_predictions(logits, adapter_names)
+
+    @torch.no_grad()
+    def eval_step(
+        self,
+        input_ids=None,
+        attention_mask=None,
+        labels=None,
+        inputs_embeds=None,
+        task_ids=None,
+        adapter_names=None,
+        **kwargs,
+    ):
+        outputs = self(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            inputs_embeds=inputs_embeds,
+            labels=labels,
+            task_ids=task_ids,
+            adapter_names=adapter_names,
+        )
+
+        return outputs.loss, self.get_label_predictions(outputs.logits, adapter_names)
+
+    def get_label_predictions(self, logits, adapter_names=None):
+        adapter_name = self._get_single_adapter(adapter_names)
+        config = self.base_model.config
+        label_token_ids = self.classification_head[adapter_name].get_label_token_ids(
+            logits.argmax(dim=-1), config.pad_token_id
+        )
+
+        # same layout as the seq2seq generate, decoder start token first
+        decoder_start_token_ids = label_token_ids.new_full(
+            (label_token_ids.shape[0], 1), config.decoder_start_token_id
+        )
+
+        return torch.cat((decoder_start_token_ids, label_token_ids), dim=1)
+
+
+class PeftModelForCausalLM(PeftModel):
+    def __init__(
+        self,
+        model: PreTrainedModel,
+        peft_config: PeftConfig,
+        adapter_name: str = "causal_peft",
+        init_prompts: bool = True,
+    ):
+        super().__init__(model, peft_config, adapter_name, init_prompts)
+
+    def forward(
+        self,
+        input_ids=None,
+        attention_mask=None,
+        inputs_embeds=None,
+        labels=None,
+        output_attentions=None,
+        output_hidden_states=None,
+        return_dict=None,
+        task_ids=None,
+        adapter_names=None,
+        **kwargs,
+    ):
+        batch_size = _get_batch_size(input_ids, inputs_embeds)
+        adapter_name = self._get_single_adapter(adapter_names)
+
+        kwargs.update(
+            {
+                "output_attentions": output_attentions,
+                "output_hidden_states": output_hidden_states,
+                "return_dict": True,
+            }
+        )
+
+        if adapter_name is not None and self.use_prompt_states(task_ids, adapter_name):
+            past_key_values, prompt_logits = self.get_prompt_states(
+                batch_size, task_ids, adapter_name
+            )
+            attention_mask = self._prepend_prefix_attention_mask(
+                batch_size, attention_mask, past_key_values, input_ids, inputs_embeds
+            )
+
+            outputs = self.base_model(
+                input_ids=input_ids,
+                inputs_embeds=inputs_embeds,
+                attention_mask=attention_mask,
+                past_key_values=past_key_values,
+                **kwargs,
+            )
+
+            # the last prompt position predicts the first input token
+            if labels is not None:
+                logits = torch.cat(
+                    (prompt_logits.unsqueeze(1), outputs.logits[:, :-1]), dim=1
+                )
+                outputs.loss = torch.nn.functional.cross_entropy(
+                    logits.reshape(-1, logits.shape[-1]).float(),
+                    labels.reshape(-1).to(logits.device),
+                )
+
+            return outputs if return_dict is not False else outputs.to_tuple()
+
+        if inputs_embeds is None:
+            inputs_embeds = self.word_embeddings(input_ids)
+
+        num_inputs = inputs_embeds.shape[1]
+        inputs_embeds, attention_mask = self.prepend_prompts(
+            inputs_embeds, attention_mask, task_ids, adapter_names
+        )
+        num_virtual_tokens = inputs_embeds.shape[1] - num_inputs
+
+        # prompt positions are not predicted
+        if labels is not None:
+            prefix_labels = labels.new_full((batch_size, num_virtual_tokens), -100)
+            labels = torch.cat((prefix_labels, labels), dim=1)
+
+        outputs = self.base_model(
+            inputs_embeds=inputs_embeds,
+            attention_mask=attention_mask,
+            labels=labels,
             **kwargs,
         )
 
-    def generate(self, **kwargs):
-        peft_config = self.active_peft_config
-        self.base_model.prepare_inputs_for_generation = (
-            self.prepare_inputs_for_generation
+        # logits are aligned with the inputs, as with the cached prompt
+        outputs.logits = outputs.logits[:, num_virtual_tokens:]
+
+        return outputs if return_dict is not False else outputs.to_tuple()
+
+    def generate(
+        self,
+        input_ids=None,
+        attention_mask=None,
+        task_ids=None,
+        adapter_names=None,
+        **kwargs,
+    ):
+        # labels are passed by the trainer, generation does not use them
+        kwargs.pop("labels", None)
+
+        batch_size = input_ids.shape[0]
+        adapter_name = self._get_single_adapter(adapter_names)
+
+        generation_config, model_kwargs, greedy = prepare_generation_config(
+            self.base_model, kwargs
         )
-        self.base_model._prepare_encoder_decoder_kwargs_for_generation = (
-            self._prepare_encoder_decoder_kwargs_for_generation
+        max_new_tokens = get_max_new_tokens(generation_config, input_ids.shape[1])
+
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+
+        if (
+            greedy
+            and adapter_name is not None
+            and self.use_prompt_states(task_ids, adapter_name)
+        ):
+            past_key_values, _ = self.get_prompt_states(
+                batch_size, task_ids, adapter_name
+            )
+            attention_mask = self._prepend_prefix_attention_mask(
+                batch_size, attention_mask, past_key_values
+            )
+
+            return causal_greedy_search(
+                self.base_model,
+                input_ids,
+                attention_mask,
+                max_new_tokens,
+                generation_config.eos_token_id,
+                generation_config.pad_token_id,
+                past_key_values=past_key_values,
+            )
+
+        inputs_embeds, attention_mask = self.prepend_prompts(
+            self.word_embeddings(input_ids), attention_mask, task_ids, adapter_names
         )
 
-        kwargs = deepcopy(kwargs)
+        if greedy:
+            return causal_greedy_search(
+                self.base_model,
+                input_ids,
+                attention_mask,
+                max_new_tokens,
+                generation_config.eos_token_id,
+                generation_config.pad_token_id,
+                inputs_embeds=inputs_embeds,
+            )
 
-        input_ids = kwargs.pop("input_ids")
-        task_ids = kwargs.pop("task_ids")
-        inputs_embeds = self.word_embeddings(input_ids)
-        batch_size = inputs_embeds.shape[0]
-        prompts = self.get_prompt(batch_size=batch_size, task_ids=task_ids)
+        # input_ids are only returned, the first step runs the prompted embeddings
+        return self.base_model.generate(
+            input_ids=input_ids,
+            inputs_embeds=inputs_embeds,
+            attention_mask=attention_mask,
+            generation_config=generation_config,
+            **model_kwargs,
+        )
 
-        if peft_config.peft_type == "attempt":
-            prompts = self.get_instance_prompt(inputs_embeds, prompts)
+    def use_prompt_states(self, task_ids=None, adapter_name=None):
+        # a plain prompt at the start of a causal sequence does not depend on the inputs,
+        # its keys and values are reused whenever no gradient has to flow into the prompt
+        adapter_name = self.active_adapter if adapter_name is None else adapter_name
+        embedding = self.prompt_encoder[adapter_name].embedding
 
-        prompts = prompts.to(inputs_embeds.dtype)
+        if self.peft_config[adapter_name].peft_type != "prompt_tuning":
+            return False
+
+        if isinstance(embedding, PackedPromptEmbedding) and task_ids is None:
+            return False
+
+        return not self.base_model.training and not (
+            torch.is_grad_enabled() and embedding.weight.requires_grad
+        )
+
+    def get_prompt_states(self, batch_size, task_ids=None, adapter_name=None):
+        # keys and values of the prompt and the logits of its last position, computed once
+        # per prompt weights and broadcast to the batch
+        adapter_name = self.active_adapter if adapter_name is None else adapter_name
+        peft_config = self.peft_config[adapter_name]
+        embedding = self.prompt_encoder[adapter_name].embedding
+
+        weight = embedding.weight
+        dtype = self.word_embeddings.weight.dtype
+        key = (adapter_name, dtype, weight.device)
+        version = _weight_version(weight)
+
+        cached = self._prompt_states.get(key)
+        if cached is None or cached[0] != version:
+            # one row per target prompt
+            prompts = weight if weight.dim() == 3 else weight.unsqueeze(0)
+            prompts = prompts[:, : peft_config.num_virtual_tokens].to(dtype)
+
+            with torch.no_grad():
+                outputs = self.base_model(
+                    inputs_embeds=prompts, use_cache=True, return_dict=True
+                )
 
-        inputs_embeds = torch.cat(
-            (prompts[:, : peft_config.num_virtual_tokens], inputs_embeds), dim=1
+            cached = (version, outputs.past_key_values, outputs.logits[:, -1])
+            self._prompt_states[key] = cached
+
+        _, past_key_values, prompt_logits = cached
+
+        if isinstance(embedding, PackedPromptEmbedding):
+            task_ids = torch.as_tensor(task_ids, device=weight.device)
+            return (
+                tuple(
+                    tuple(past[task_ids] for past in layer_past)
+                    for layer_past in past_key_values
+                ),
+                prompt_logits[task_ids],
+            )
+
+        return (
+            tuple(
+                tuple(past.expand(batch_size, -1, -1, -1) for past in layer_past)
+                for layer_past in past_key_values
+            ),
+            prompt_logits.expand(batch_size, -1),
         )
-        kwargs["inputs_embeds"] = inputs_embeds
 
-        if "attention_mask" in kwargs:
-            prefix_attention_mask = torch.ones(
-                batch_size, peft_config.num_virtual_tokens
-            ).to(kwargs["attention_mask"].device)
-            kwargs["attention_mask"] = torch.cat(
-                (prefix_attention_mask, kwargs["attention_mask"]), dim=1
+    def _prepend_prefix_attention_mask(
+        self,
+        batch_size,
+        attention_mask,
+        past_key_values,
+        input_ids=None,
+        inputs_embeds=None,
+    ):
+        num_virtual_tokens = past_key_values[0][0].shape[-2]
+
+        if attention_mask is None:
+            inputs = input_ids if input_ids is not None else inputs_embeds
+            attention_mask = torch.ones(
+                inputs.shape[:2], dtype=torch.long, device=inputs.device
             )
 
-        return self.base_model.generate(**kwargs)
+        prefix_attention_mask = self.get_prefix_attention_mask(
+            batch_size, attention_mask, num_virtual_tokens
+        )
+
+        return torch.cat((prefix_attention_mask, attention_mask), dim=1)
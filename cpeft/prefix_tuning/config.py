@@ -0,0 +1,24 @@
+from dataclasses import dataclass
+
+from ..attempt.config import SourcePromptsConfig
+
+
+@dataclass
+class PrefixTuningConfig(SourcePromptsConfig):
+    """Prefix tuning of the encoder self-attention. Every layer gets num_virtual_tokens
+    learned keys and values, stored as a prompt of num_virtual_tokens * num_layers * 2
+    tokens, so they are not input positions of the encoder.
+
+    Source prefixes in prompt_embedding_paths are mixed per instance with the ATTEMPT
+    attention (attn_method, temperature, ...), without them the prefix is used as is.
+    Source prefixes are stored the same way and mixed as a whole, one attention score
+    per source prefix weights the keys and values of all layers, so every source
+    prefix needs num_virtual_tokens * num_layers * 2 tokens.
+    """
+
+    def __post_init__(self):
+        self.peft_type = "prefix_tuning"
+
+    @property
+    def mixes_source_prompts(self) -> bool:
+        return bool(self.prompt_embedding_paths)
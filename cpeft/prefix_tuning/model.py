@@ -0,0 +1,64 @@
+import contextlib
+import torch.nn.functional as F
+
+from functools import partial
+
+
+class PrefixEncoderHooks:
+    """Feeds per-layer prefix keys and values into the self-attention of a T5 encoder.
+
+    The prefix is passed to every T5Attention as its past_key_value, so the encoder
+    attends over num_virtual_tokens more keys while its inputs keep their length and
+    the decoder cross-attention keeps the original mask. A prefix stays set until it
+    is replaced or cleared, layers recomputed by activation checkpointing get the
+    prefix of their forward pass back through recompute_context.
+    """
+
+    def __init__(self, model):
+        encoder = model.get_encoder() if hasattr(model, "get_encoder") else None
+        if not hasattr(encoder, "block"):
+            raise ValueError("Prefix tuning is supported only for T5 models.")
+
+        self.key_values = None
+        self.handles = [
+            block.layer[0].SelfAttention.register_forward_pre_hook(
+                partial(self._inject_prefix, layer), with_kwargs=True
+            )
+            for layer, block in enumerate(encoder.block)
+        ]
+
+    def set(self, key_values):
+        self.key_values = key_values
+
+    def clear(self):
+        self.key_values = None
+
+    def recompute_context(self):
+        # context_fn of the torch checkpoint, the prefix is usually cleared before backward
+        return contextlib.nullcontext(), self._restore(self.key_values)
+
+    @contextlib.contextmanager
+    def _restore(self, key_values):
+        previous, self.key_values = self.key_values, key_values
+        try:
+            yield
+        finally:
+            self.key_values = previous
+
+    def remove(self):
+        for handle in self.handles:
+            handle.remove()
+
+    def _inject_prefix(self, layer, module, args, kwargs):
+        if self.key_values is None:
+            return None
+
+        key_value = self.key_values[layer]
+        kwargs["past_key_value"] = key_value
+
+        # prefix keys are always attended to, the first layer adds the mask to the
+        # position bias that the other layers reuse
+        if kwargs.get("mask", None) is not None:
+            kwargs["mask"] = F.pad(kwargs["mask"], (key_value[0].shape[2], 0))
+
+        return args, kwargs
@@ -0,0 +1,218 @@
+import os
+import json
+import argparse
+import threading
+import torch
+import numpy as np
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+MAGIC = b"CPEFTPB1"
+ALIGNMENT = 64
+
+# process level LRU caches, configs of one run keep reloading the same prompts
+MAX_PROMPT_BANKS = 4
+MAX_PROMPT_FILES = 1024
+
+_PROMPT_BANKS = OrderedDict()
+_PROMPT_FILES = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+
+class PromptBank:
+    """Packed prompt bank file, memory-mapped so prompts are views into the page cache.
+
+    Layout: magic, header size (8 bytes, little endian), json header with
+    name -> (offset, shape, dtype) index and one contiguous blob of all prompts.
+    Prompts are stored sorted by name, prompts read together should be packed next
+    to each other to get a single zero-copy view from stack.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a prompt bank file.")
+
+            header_size = int.from_bytes(f.read(8), "little")
+            header = json.loads(f.read(header_size))
+
+        self.entries = header["entries"]
+        self.names = sorted(self.entries, key=lambda name: self.entries[name]["offset"])
+
+        # copy on write, writes to a view never reach the file
+        self._buffer = torch.from_numpy(
+            np.memmap(path, dtype=np.uint8, mode="c", offset=header["data_offset"])
+        )
+
+    def __contains__(self, name):
+        return _normalize(name) in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, name):
+        entry = self.entries[_normalize(name)]
+        dtype = getattr(torch, entry["dtype"])
+        nbytes = int(np.prod(entry["shape"])) * _element_size(dtype)
+
+        tensor = self._buffer[entry["offset"] : entry["offset"] + nbytes]
+        return tensor.view(dtype).view(entry["shape"])
+
+    def stack(self, names: List[str]) -> torch.Tensor:
+        names = [_normalize(name) for name in names]
+        entries = [self.entries[name] for name in names]
+
+        if len({(tuple(e["shape"]), e["dtype"]) for e in entries}) == 1:
+            dtype = getattr(torch, entries[0]["dtype"])
+            shape = entries[0]["shape"]
+            nbytes = int(np.prod(shape)) * _element_size(dtype)
+            stride = _align(nbytes)
+
+            # consecutive entries of one shape are a single strided view of the blob
+            offsets = [e["offset"] for e in entries]
+            if stride % _element_size(dtype) == 0 and offsets == list(
+                range(offsets[0], offsets[0] + stride * len(offsets), stride)
+            ):
+                buffer = self._buffer[offsets[0] : offsets[0] + stride * len(offsets)]
+                buffer = buffer.view(dtype).view(len(offsets), -1)
+                return buffer[:, : nbytes // _element_size(dtype)].view(
+                    len(offsets), *shape
+                )
+
+        return torch.stack([self[name] for name in names])
+
+
+def build_prompt_bank(paths: List[str], output_path: str):
+    """Packs prompt files into one prompt bank, names are the paths as given."""
+    names = sorted({_normalize(path) for path in paths})
+    prompts = load_prompt_files(names)
+
+    entries, offset = {}, 0
+    for name, prompt in zip(names, prompts):
+        entries[name] = {
+            "offset": offset,
+            "shape": list(prompt.shape),
+            "dtype": str(prompt.dtype).replace("torch.", ""),
+        }
+        offset += _align(prompt.numel() * prompt.element_size())
+
+    # room for the data offset itself, the header is padded with spaces
+    header_size = len(json.dumps({"entries": entries}).encode()) + 64
+    data_offset = _align(len(MAGIC) + 8 + header_size)
+    header = json.dumps({"entries": entries, "data_offset": data_offset})
+    header = header.encode().ljust(header_size)
+
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, "little"))
+        f.write(header)
+        f.write(b"\0" * (data_offset - f.tell()))
+
+        for name, prompt in zip(names, prompts):
+            data = prompt.detach().cpu().contiguous().reshape(-1).view(torch.uint8)
+            f.write(data.numpy().tobytes())
+            f.write(b"\0" * (_align(data.numel()) - data.numel()))
+
+    os.replace(tmp_path, output_path)
+
+
+def load_prompt_bank(path: str) -> PromptBank:
+    key = (os.path.abspath(path), os.path.getmtime(path))
+    return _cached(_PROMPT_BANKS, key, MAX_PROMPT_BANKS, lambda: PromptBank(path))
+
+
+def clear_cache():
+    """Drops the cached prompt banks and prompt files, e.g. at the end of a run."""
+    with _CACHE_LOCK:
+        _PROMPT_BANKS.clear()
+        _PROMPT_FILES.clear()
+
+
+def load_prompt(path: str, prompt_bank: Optional[str] = None) -> torch.Tensor:
+    return load_prompts([path], prompt_bank)[0]
+
+
+def load_prompts(paths: List[str], prompt_bank: Optional[str] = None) -> torch.Tensor:
+    """Loads prompts as one [len(paths), tokens, dim] tensor. Returned tensors are shared, do not modify them."""
+    if prompt_bank is not None:
+        bank = load_prompt_bank(prompt_bank)
+
+        if all(path in bank for path in paths):
+            return bank.stack(paths)
+
+    return torch.stack(load_prompt_files(paths))
+
+
+def load_prompt_files(paths: List[str]) -> List[torch.Tensor]:
+    with ThreadPoolExecutor(max_workers=min(8, max(1, len(paths)))) as executor:
+        return list(executor.map(_load_prompt_file, paths))
+
+
+def _load_prompt_file(path):
+    key = (os.path.abspath(path), os.path.getmtime(path))
+    return _cached(_PROMPT_FILES, key, MAX_PROMPT_FILES, lambda: _read_prompt(path))
+
+
+def _read_prompt(path):
+    emb = torch.load(path, map_location="cpu")
+    # this is because of original attempt prompts are not dict
+    if type(emb) == dict:
+        emb = emb["prompt_embeddings"]
+
+    return emb.detach()
+
+
+def _cached(cache, key, max_size, load):
+    # prompt files are read from several threads, the cache is only touched under the lock
+    with _CACHE_LOCK:
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+
+    value = load()
+
+    with _CACHE_LOCK:
+        cache[key] = value
+        while len(cache) > max_size:
+            cache.popitem(last=False)
+
+    return value
+
+
+def _normalize(name):
+    return os.path.normpath(name)
+
+
+def _element_size(dtype):
+    return torch.empty((), dtype=dtype).element_size()
+
+
+def _align(nbytes):
+    return (nbytes + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _prompt_paths(directory):
+    paths = []
+    for root, _, files in os.walk(directory):
+        paths += [os.path.join(root, f) for f in files if f.endswith(".bin")]
+
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Prompt bank",
+        description="Pack all .bin soft prompts from a directory into one prompt bank file.",
+    )
+    parser.add_argument(
+        "directory", help="Directory with soft prompts, e.g. soft_prompts."
+    )
+    parser.add_argument("output", help="Output prompt bank file.")
+    args = parser.parse_args()
+
+    build_prompt_bank(_prompt_paths(args.directory), args.output)
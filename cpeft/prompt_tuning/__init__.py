@@ -1,2 +1,2 @@
 from .config import PromptTuningConfig
-from .model import PromptTuningEmbedding
+from .model import PromptTuningEmbedding, PackedPromptEmbedding
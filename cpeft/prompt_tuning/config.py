@@ -4,7 +4,7 @@ import json
 from ..config import PeftConfig
 
 from dataclasses import field, dataclass
-from typing import Optional
+from typing import List, Optional
 
 
 @dataclass
@@ -36,9 +36,20 @@ class PromptTuningConfig(PeftConfig):
         default=None, metadata={"help": "Number of target tasks."}
     )
 
+    label_token_ids: Optional[List[List[List[int]]]] = field(
+        default=None,
+        metadata={
+            "help": "Tokenized labels_list of every task, scored by the seq_cls head."
+        },
+    )
+
     def __post_init__(self):
         self.peft_type = "prompt_tuning"
 
     @property
     def is_prompt_learning(self) -> bool:
         return True
+
+    @property
+    def mixes_source_prompts(self) -> bool:
+        return False
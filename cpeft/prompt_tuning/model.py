@@ -1,17 +1,90 @@
 import torch
 import numpy as np
 
+from ..prompt_bank import load_prompt
+
+
+class _SparseRowGather(torch.autograd.Function):
+    # weight[rows] with a sparse gradient over the gathered rows only
+
+    @staticmethod
+    def forward(ctx, weight, rows):
+        ctx.save_for_backward(rows)
+        ctx.shape = weight.shape
+        return weight[rows]
+
+    @staticmethod
+    def backward(ctx, grad):
+        (rows,) = ctx.saved_tensors
+        grad = torch.sparse_coo_tensor(
+            rows.unsqueeze(0), grad, ctx.shape, check_invariants=False
+        )
+        return grad, None
+
+
+class PackedPromptEmbedding(torch.nn.Module):
+    """Bank of target prompts packed into one [n_targets, tokens, dim] parameter,
+    so that prompts for a whole batch are assembled with a single gather.
+    With sparse the gradient is a sparse tensor over the targets of the batch."""
+
+    def __init__(self, n_targets, num_embeddings, embedding_dim, sparse=False):
+        super().__init__()
+        self.n_targets = n_targets
+        self.num_embeddings = num_embeddings
+        self.embedding_dim = embedding_dim
+        self.sparse = sparse
+        self.weight = torch.nn.Parameter(
+            torch.empty((n_targets, num_embeddings, embedding_dim)).normal_()
+        )
+
+    def __len__(self):
+        return self.n_targets
+
+    def forward(self, indices, task_ids):
+        task_ids = torch.as_tensor(task_ids, device=self.weight.device)
+
+        if self.sparse:
+            return _SparseRowGather.apply(self.weight, task_ids)[:, indices]
+
+        return self.weight[task_ids.unsqueeze(-1), indices]
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # checkpoints saved before packing store one nn.Embedding per target
+        old_keys = [f"{prefix}{i}.weight" for i in range(self.n_targets)]
+        if old_keys[0] in state_dict:
+            state_dict[f"{prefix}weight"] = torch.stack(
+                [state_dict.pop(key) for key in old_keys]
+            )
+
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def extra_repr(self):
+        s = f"{self.n_targets}, {self.num_embeddings}, {self.embedding_dim}"
+        if self.sparse:
+            s += ", sparse=True"
+        return s
+
 
 class PromptTuningEmbedding(torch.nn.Module):
-    def __init__(self, config, word_embeddings):
+    def __init__(self, config, word_embeddings, init_prompts=True):
         super().__init__()
 
         total_virtual_tokens = (
             config.num_virtual_tokens * config.num_transformer_submodules
         )
         self.embedding = torch.nn.Embedding(total_virtual_tokens, config.token_dim)
+        self.register_buffer(
+            "prompt_tokens", torch.arange(total_virtual_tokens).long(), persistent=False
+        )
+
+        # weights are loaded right after, only the layout of the embedding is needed
+        if not init_prompts:
+            if config.prompt_init == "embedding_multi":
+                self.embedding = PackedPromptEmbedding(
+                    config.n_targets, total_virtual_tokens, config.token_dim
+                )
 
-        if config.prompt_init == "vocab":
+        elif config.prompt_init == "vocab":
             indices = np.random.permutation(range(5000))[:total_virtual_tokens]
 
             word_embedding_weights = (
@@ -22,34 +95,28 @@ class PromptTuningEmbedding(torch.nn.Module):
             self.embedding.weight = torch.nn.Parameter(word_embedding_weights)
 
         elif config.prompt_init == "embedding":
-            emb = torch.load(config.prompt_init_embedding)
-            if type(emb) == dict:
-                self.embedding.weight = torch.nn.Parameter(emb["prompt_embeddings"])
-            else:
-                self.embedding.weight = torch.nn.Parameter(emb)
+            emb = load_prompt(
+                config.prompt_init_embedding, getattr(config, "prompt_bank", None)
+            )
+            self.embedding.weight = torch.nn.Parameter(emb.clone())
 
         elif config.prompt_init == "embedding_multi":
-            emb = torch.load(config.prompt_init_embedding)
-            embeddings = [
-                torch.nn.Embedding(total_virtual_tokens, config.token_dim)
-                for _ in range(config.n_targets)
-            ]
-
-            for e in embeddings:
-                if type(emb) == dict:
-                    e.weight = torch.nn.Parameter(emb["prompt_embeddings"])
-                else:
-                    e.weight = torch.nn.Parameter(emb)
+            emb = load_prompt(
+                config.prompt_init_embedding, getattr(config, "prompt_bank", None)
+            )
 
-            self.embedding = torch.nn.ModuleList(embeddings)
+            self.embedding = PackedPromptEmbedding(
+                config.n_targets, total_virtual_tokens, config.token_dim
+            )
+            self.embedding.weight = torch.nn.Parameter(
+                emb.unsqueeze(0).repeat(config.n_targets, 1, 1)
+            )
 
     def forward(self, indices, task_ids=None):
         if task_ids is None:
             prompt_embeddings = self.embedding(indices)
         else:
-            prompt_embeddings = torch.stack(
-                [self.embedding[id](indices) for id in task_ids]
-            )
+            prompt_embeddings = self.embedding(indices, task_ids)
         # print("self.embedding:", list(self.embedding.named_parameters()))
         # print("pt_forward:", prompt_embeddings, task_ids)
         return prompt_embeddings
@@ -0,0 +1,133 @@
+import torch
+
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from .model import PeftModel
+from .utils import infer_device
+
+
+class AdapterRegistry:
+    """Serves many adapters on top of one frozen backbone.
+
+    Adapters are registered by name and directory and their weights are loaded lazily
+    on the first use. The most recently used adapters are kept on the compute device
+    while their size fits into memory_budget (bytes), the least recently used ones are
+    evicted to the cpu (offload="cpu") or dropped and later reloaded from their
+    directory (offload="disk").
+    """
+
+    def __init__(
+        self,
+        model: PeftModel,
+        device: Optional[str] = None,
+        memory_budget: Optional[int] = None,
+        offload: str = "cpu",
+    ):
+        if offload not in ["cpu", "disk"]:
+            raise ValueError(f"Unknown offload target {offload}.")
+
+        self.model = model
+        self.device = infer_device() if device is None else device
+        self.memory_budget = memory_budget
+        self.offload = offload
+
+        self.paths = {}
+        self.resident = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+
+        # adapters are placed one by one within the budget, the active one last
+        adapter_names = [
+            name for name in model.peft_config if name != model.active_adapter
+        ]
+        for adapter_name in adapter_names + [model.active_adapter]:
+            self._to_device(adapter_name, self.device)
+            self.resident[adapter_name] = self._adapter_size(adapter_name)
+            self._evict(keep=[adapter_name])
+
+    def register(self, adapter_name: str, model_id: str):
+        self.paths[adapter_name] = model_id
+
+    def activate(self, adapter_name: str) -> PeftModel:
+        # the previous active adapter is no longer protected from eviction
+        self._place([adapter_name])
+        self.model.set_adapter(adapter_name)
+        self._evict(keep=[adapter_name])
+
+        return self.model
+
+    def ensure(self, adapter_names: List[str]):
+        # adapters of one mixed batch have to be resident at the same time
+        adapter_names = list(OrderedDict.fromkeys(adapter_names))
+
+        self._place(adapter_names)
+        self._evict(keep=adapter_names)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "resident": len(self.resident),
+            "resident_bytes": sum(self.resident.values()),
+        }
+
+    def _place(self, adapter_names):
+        for adapter_name in adapter_names:
+            if adapter_name in self.resident:
+                self.hits += 1
+                self.resident.move_to_end(adapter_name)
+                continue
+
+            self.misses += 1
+
+            if adapter_name not in self.model.peft_config:
+                if adapter_name not in self.paths:
+                    raise ValueError(f"Adapter {adapter_name} is not registered.")
+
+                self.model.load_adapter(
+                    self.paths[adapter_name], adapter_name, device=self.device
+                )
+                self.loads += 1
+
+            self._to_device(adapter_name, self.device)
+            self.resident[adapter_name] = self._adapter_size(adapter_name)
+
+    def _evict(self, keep):
+        if self.memory_budget is None:
+            return
+
+        for adapter_name in list(self.resident):
+            if sum(self.resident.values()) <= self.memory_budget:
+                break
+
+            if adapter_name in keep or adapter_name == self.model.active_adapter:
+                continue
+
+            del self.resident[adapter_name]
+            self.evictions += 1
+
+            if self.offload == "disk" and adapter_name in self.paths:
+                self.model.delete_adapter(adapter_name)
+            else:
+                self._to_device(adapter_name, "cpu")
+
+    def _to_device(self, adapter_name, device):
+        for module in self.model.get_adapter_modules(adapter_name):
+            module.to(device)
+
+        # cached prompts would keep the tensors on the previous device alive
+        self.model._invalidate_prompt_cache(adapter_name)
+
+    def _adapter_size(self, adapter_name):
+        size = 0
+        for module in self.model.get_adapter_modules(adapter_name):
+            for tensor in list(module.parameters()) + list(module.buffers()):
+                size += tensor.numel() * tensor.element_size()
+
+        return size
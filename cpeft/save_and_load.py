@@ -1,10 +1,19 @@
 import os
 import torch
+import hashlib
 
+from collections.abc import Mapping
 from typing import Optional
 
+from safetensors import safe_open
+from safetensors.torch import save_file
+from torch.nn.modules.module import _IncompatibleKeys
+
 from .utils import infer_device
 
+SAFETENSORS_WEIGHTS_NAME = "adapter_model.safetensors"
+WEIGHTS_NAME = "adapter_model.bin"
+
 
 def get_peft_model_state_dict(model, state_dict=None, adapter_name="peft"):
     # state dict not used yet, but may be used when we would like to save additional peft layers
@@ -18,65 +27,111 @@ def get_peft_model_state_dict(model, state_dict=None, adapter_name="peft"):
         prompt_embeddings = model.get_prompt_embedding_to_save(adapter_name)
     to_return["prompt_embeddings"] = prompt_embeddings
 
-    if config.peft_type == "attempt":
-        to_return["attention_module"] = model.attention_module.state_dict()
+    # flat names, the adapter name is not part of the checkpoint
+    if config.mixes_source_prompts:
+        for k, v in model.attention_module[adapter_name].state_dict().items():
+            if k == "mul_prefix_emb":
+                if not config.save_source_prompts:
+                    continue
+
+                if config.deduplicate_source_prompts:
+                    v, ids = _deduplicate_prompts(v)
+                    to_return["attention_module.mul_prefix_ids"] = ids
+
+            to_return[f"attention_module.{k}"] = v
+
+    if hasattr(model, "classification_head"):
+        for k, v in model.classification_head[adapter_name].state_dict().items():
+            to_return[f"classification_head.{k}"] = v
 
-    to_return = {k.replace(f".{adapter_name}", ""): v for k, v in to_return.items()}
     return to_return
 
 
+def save_peft_weights(state_dict, save_directory, safe_serialization=True):
+    if safe_serialization:
+        # safetensors does not store views, every tensor gets its own storage
+        state_dict = {k: v.detach().contiguous() for k, v in state_dict.items()}
+        save_file(
+            state_dict,
+            os.path.join(save_directory, SAFETENSORS_WEIGHTS_NAME),
+            metadata={"format": "pt"},
+        )
+    else:
+        torch.save(state_dict, os.path.join(save_directory, WEIGHTS_NAME))
+
+
 def set_peft_model_state_dict(model, peft_state_dict, adapter_name="peft"):
     config = model.peft_config[adapter_name]
-    state_dict = peft_state_dict
 
-    peft_model_state_dict = state_dict
-    # print(peft_model_state_dict)
+    if isinstance(peft_state_dict.get("attention_module", None), dict):
+        peft_state_dict = _flatten_legacy_state_dict(peft_state_dict, adapter_name)
+
+    missing_keys, unexpected_keys = [], []
 
-    load_result = model.load_state_dict(peft_model_state_dict, strict=False)
     if config.is_prompt_learning:
-        if type(model.prompt_encoder[adapter_name].embedding) == torch.nn.ModuleList:
-            for i, emb in enumerate(peft_model_state_dict["prompt_embeddings"]):
-                # print(model.prompt_encoder[adapter_name].embedding)
-                model.prompt_encoder[adapter_name].embedding[i].weight = (
-                    torch.nn.Parameter(emb)
-                )
-
-            # print("after_loading:", list(model.prompt_encoder[adapter_name].embedding.named_parameters()))
-        else:
-            model.prompt_encoder[adapter_name].embedding.load_state_dict(
-                {"weight": peft_model_state_dict["prompt_embeddings"]}, strict=True
-            )
-
-        if config.peft_type == "attempt":
-
-            print(peft_model_state_dict["attention_module"].keys())
-
-            model.attention_module.peft.attn_W_down.load_state_dict(
-                {
-                    "weight": peft_model_state_dict["attention_module"][
-                        "peft.attn_W_down.weight"
+        prompt_embeddings = peft_state_dict["prompt_embeddings"]
+        if isinstance(prompt_embeddings, (list, tuple)):
+            prompt_embeddings = torch.stack(prompt_embeddings)
+
+        _copy_tensor(
+            model.prompt_encoder[adapter_name].embedding.weight,
+            prompt_embeddings,
+            "prompt_embeddings",
+        )
+
+        if config.mixes_source_prompts:
+            attention_module = model.attention_module[adapter_name]
+
+            for k, v in attention_module.state_dict(keep_vars=True).items():
+                # frozen source prompts are read only by modules built without them
+                if k == "mul_prefix_emb":
+                    if attention_module.prefix_loaded:
+                        continue
+
+                    if "attention_module.mul_prefix_emb" not in peft_state_dict:
+                        missing_keys.append("attention_module.mul_prefix_emb")
+                        continue
+
+                    prefix_embeddings = peft_state_dict[
+                        "attention_module.mul_prefix_emb"
                     ]
-                }
-            )
-            model.attention_module.peft.attn_W_up.load_state_dict(
-                {
-                    "weight": peft_model_state_dict["attention_module"][
-                        "peft.attn_W_up.weight"
-                    ]
-                }
-            )
-            model.attention_module.peft.layer_norm.load_state_dict(
-                {
-                    "weight": peft_model_state_dict["attention_module"][
-                        "peft.layer_norm.weight"
-                    ],
-                    "bias": peft_model_state_dict["attention_module"][
-                        "peft.layer_norm.bias"
-                    ],
-                }
-            )
-
-    return load_result
+                    if "attention_module.mul_prefix_ids" in peft_state_dict:
+                        ids = peft_state_dict["attention_module.mul_prefix_ids"]
+                        prefix_embeddings = prefix_embeddings[
+                            ids.to(prefix_embeddings.device)
+                        ]
+
+                    _check_size(v, prefix_embeddings, "attention_module.mul_prefix_emb")
+                    attention_module.store_prefix_weights(
+                        prefix_embeddings.to(v.device)
+                    )
+                    continue
+
+                key = f"attention_module.{k}"
+                if key not in peft_state_dict:
+                    missing_keys.append(key)
+                    continue
+
+                _copy_tensor(v, peft_state_dict[key], key)
+
+    if hasattr(model, "classification_head"):
+        classification_head = model.classification_head[adapter_name]
+
+        for k, v in classification_head.state_dict(keep_vars=True).items():
+            key = f"classification_head.{k}"
+            if key not in peft_state_dict:
+                missing_keys.append(key)
+                continue
+
+            _copy_tensor(v, peft_state_dict[key], key)
+
+    for key in peft_state_dict:
+        if key != "prompt_embeddings" and not key.startswith(
+            ("attention_module.", "classification_head.")
+        ):
+            unexpected_keys.append(key)
+
+    return _IncompatibleKeys(missing_keys, unexpected_keys)
 
 
 def load_peft_weights(model_id: str, device: Optional[str] = None):
@@ -85,7 +140,85 @@ def load_peft_weights(model_id: str, device: Optional[str] = None):
     if device is None:
         device = infer_device()
 
-    filename = os.path.join(path, "adapter_model.bin")
+    filename = os.path.join(path, SAFETENSORS_WEIGHTS_NAME)
+    if os.path.exists(filename):
+        return SafetensorsStateDict(filename, device=device)
+
+    filename = os.path.join(path, WEIGHTS_NAME)
     adapters_weights = torch.load(filename, map_location=torch.device(device))
 
     return adapters_weights
+
+
+class SafetensorsStateDict(Mapping):
+    """Read-only view of a safetensors file, tensors are read from the memory-mapped file on access."""
+
+    def __init__(self, filename: str, device: Optional[str] = None):
+        self.filename = filename
+        self._file = safe_open(filename, framework="pt", device=str(device or "cpu"))
+        self._keys = list(self._file.keys())
+
+    def __getitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+
+        return self._file.get_tensor(key)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+
+def _flatten_legacy_state_dict(state_dict, adapter_name):
+    # old .bin checkpoints nest the attention modules under "attention_module" with keys
+    # prefixed by the name of the adapter each module was saved from
+    saved_state_dict = state_dict["attention_module"]
+    saved_adapters = {k.split(".", 1)[0] for k in saved_state_dict}
+    if adapter_name in saved_adapters or len(saved_adapters) > 1:
+        saved_adapter = adapter_name
+    else:
+        saved_adapter = saved_adapters.pop()
+
+    flat_state_dict = {k: v for k, v in state_dict.items() if k != "attention_module"}
+    for k, v in saved_state_dict.items():
+        if k.startswith(f"{saved_adapter}."):
+            flat_state_dict[f"attention_module.{k.split('.', 1)[1]}"] = v
+
+    return flat_state_dict
+
+
+def _deduplicate_prompts(prompts):
+    # identical source prompts (e.g. the same file listed twice) are stored once
+    unique, ids, hashes = [], [], {}
+    for prompt in prompts:
+        key = get_prompt_sha256(prompt)
+        if key not in hashes:
+            hashes[key] = len(unique)
+            unique.append(prompt)
+        ids.append(hashes[key])
+
+    return torch.stack(unique), torch.tensor(ids, dtype=torch.long)
+
+
+def get_prompt_sha256(prompt):
+    data = prompt.detach().cpu().contiguous().reshape(-1).view(torch.uint8)
+    return hashlib.sha256(data.numpy().tobytes()).hexdigest()
+
+
+def _check_size(target, tensor, name):
+    if target.shape != tensor.shape:
+        raise ValueError(
+            f"Size mismatch for {name}: checkpoint has {tuple(tensor.shape)}, model has {tuple(target.shape)}."
+        )
+
+
+def _copy_tensor(target, tensor, name):
+    _check_size(target, tensor, name)
+
+    with torch.no_grad():
+        target.copy_(tensor)
@@ -5,10 +5,25 @@ from typing import Optional
 from cpeft import PeftConfig
 
 
+# names of the same model config attribute across architectures (t5, gpt2, llama, ...)
+MODEL_CONFIG_KEYS = {
+    "num_layers": ["num_layers", "n_layer", "num_hidden_layers"],
+    "token_dim": ["d_model", "n_embd", "hidden_size"],
+    "num_attention_heads": ["num_heads", "n_head", "num_attention_heads"],
+}
+
+
+def _get_model_config_value(model_config, name):
+    for key in MODEL_CONFIG_KEYS[name]:
+        if model_config.get(key, None) is not None:
+            return model_config[key]
+
+    raise ValueError(f"Model config does not define any of {MODEL_CONFIG_KEYS[name]}.")
+
+
 def _prepare_prompt_learning_config(peft_config: PeftConfig, model_config):
-    peft_config.num_layers = model_config["num_layers"]
-    peft_config.token_dim = model_config["d_model"]
-    peft_config.num_attention_heads = model_config["num_heads"]
+    for name in MODEL_CONFIG_KEYS:
+        setattr(peft_config, name, _get_model_config_value(model_config, name))
 
     if getattr(peft_config, "encoder_hidden_size", None) is None:
         setattr(peft_config, "encoder_hidden_size", peft_config.token_dim)
@@ -26,6 +41,11 @@ def _get_batch_size(
     return batch_size
 
 
+def _mean_pool(hidden_states: torch.Tensor, attention_mask: torch.Tensor):
+    mask = attention_mask.unsqueeze(-1).to(hidden_states.dtype)
+    return (hidden_states * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+
+
 def infer_device():
     if torch.cuda.is_available():
         torch_device = "cuda"
@@ -9,6 +9,7 @@ import torch
 # from peft import get_peft_model,PromptTuningConfig
 
 from cpeft import get_peft_model
+from cpeft.prompt_bank import clear_cache
 from transformers import (
     AutoTokenizer,
     AutoModelForSeq2SeqLM,
@@ -17,7 +18,9 @@ from torch.utils.data import DataLoader
 from datetime import datetime
 
 from tasks import AutoTask, TaskDataCollatorForSeq2Seq, ExtraDefaultDataCollator
+from tasks.cache import get_dataset, get_dataset_cache, tokenizer_fingerprint
 from trainer import Trainer
+from trainer.optim import build_optimizer
 
 
 class PeftEval:
@@ -81,90 +84,49 @@ class PeftEval:
             max_target_lengths,
         )
 
+        cache = get_dataset_cache(config)
+        tokenizer_id = None if cache is None else tokenizer_fingerprint(tokenizer)
+
         valid_datasets = {
-            dataset_name: AutoTask.get(dataset_name, config).get(
+            dataset_name: get_dataset(
+                config,
+                tokenizer,
+                dataset_name,
                 split="validation",
-                split_validation_test=config["split_validation_test"],
-                add_prefix=True,
                 n_obs=(
                     config["max_valid_samples"]
                     if "max_valid_samples" in config
                     else None
                 ),
+                max_target_length=max_target_lengths[i],
+                preprocess_function=self.preprocess_function,
+                task_id=i if config["shared_attn"] is True else None,
+                cols_to_remove=cols_to_remove,
+                cache=cache,
+                tokenizer_id=tokenizer_id,
             )
-            for dataset_name in config["datasets"]
+            for i, dataset_name in enumerate(config["datasets"])
         }
 
-        for i, name in enumerate(valid_datasets):
-            if config["shared_attn"] is True:
-                valid_datasets[name] = valid_datasets[name].map(
-                    functools.partial(
-                        self.preprocess_function,
-                        config=config,
-                        tokenizer=tokenizer,
-                        max_target_length=max_target_lengths[i],
-                        task_id=i,
-                    ),
-                    batched=True,
-                    load_from_cache_file=False,
-                    desc="Running preprocess_function on valid_dataset",
-                )
-            else:
-                valid_datasets[name] = valid_datasets[name].map(
-                    functools.partial(
-                        self.preprocess_function,
-                        config=config,
-                        tokenizer=tokenizer,
-                        max_target_length=max_target_lengths[i],
-                    ),
-                    batched=True,
-                    load_from_cache_file=False,
-                    desc="Running preprocess_function on valid_dataset",
-                )
-
-            valid_datasets[name] = valid_datasets[name].remove_columns(cols_to_remove)
-
         test_datasets = {
-            dataset_name: AutoTask.get(dataset_name, config).get(
+            dataset_name: get_dataset(
+                config,
+                tokenizer,
+                dataset_name,
                 split="test",
-                split_validation_test=config["split_validation_test"],
-                add_prefix=True,
                 n_obs=(
                     config["max_test_samples"] if "max_test_samples" in config else None
                 ),
+                max_target_length=max_target_lengths[i],
+                preprocess_function=self.preprocess_function,
+                task_id=i if config["shared_attn"] is True else None,
+                cols_to_remove=cols_to_remove,
+                cache=cache,
+                tokenizer_id=tokenizer_id,
             )
-            for dataset_name in config["datasets"]
+            for i, dataset_name in enumerate(config["datasets"])
         }
 
-        for i, name in enumerate(test_datasets):
-            if config["shared_attn"] is True:
-                test_datasets[name] = test_datasets[name].map(
-                    functools.partial(
-                        self.preprocess_function,
-                        config=config,
-                        tokenizer=tokenizer,
-                        max_target_length=max_target_lengths[i],
-                        task_id=i,
-                    ),
-                    batched=True,
-                    load_from_cache_file=False,
-                    desc="Running preprocess_function on test_dataset",
-                )
-            else:
-                test_datasets[name] = test_datasets[name].map(
-                    functools.partial(
-                        self.preprocess_function,
-                        config=config,
-                        tokenizer=tokenizer,
-                        max_target_length=max_target_lengths[i],
-                    ),
-                    batched=True,
-                    load_from_cache_file=False,
-                    desc="Running preprocess_function on test_dataset",
-                )
-
-            test_datasets[name] = test_datasets[name].remove_columns(cols_to_remove)
-
         if config["pad_to_max_length"]:
             data_collator = ExtraDefaultDataCollator(return_tensors="pt")
         else:
@@ -284,14 +246,43 @@ class PeftEval:
             if config["peft_type"] == "attempt":
                 peft_config.prompt_init_embedding = config["prompt_init_embedding"]
                 peft_config.prompt_embedding_paths = config["prompt_embedding_paths"]
+                peft_config.prompt_bank = config.get("prompt_bank", None)
                 peft_config.attn_method = config["attn_method"]
                 peft_config.prefix_num = config["prefix_num"]
                 peft_config.temperature = config["temperature"]
 
+                for key in ["save_source_prompts", "deduplicate_source_prompts"]:
+                    if key in config:
+                        setattr(peft_config, key, config[key])
+
+                if config["attn_method"] == "sub_topk":
+                    for key in [
+                        "top_k",
+                        "index_method",
+                        "exact_search_limit",
+                        "n_clusters",
+                        "n_probe",
+                    ]:
+                        if key in config:
+                            setattr(peft_config, key, config[key])
+
                 if config["shared_attn"]:
                     peft_config.shared_attn = config["shared_attn"]
                     peft_config.n_targets = len(config["datasets"])
 
+            # source prefixes are mixed only when prompt_embedding_paths are given
+            if config["peft_type"] == "prefix_tuning":
+                for key in [
+                    "prompt_init_embedding",
+                    "prompt_embedding_paths",
+                    "prompt_bank",
+                    "attn_method",
+                    "prefix_num",
+                    "temperature",
+                ]:
+                    if key in config:
+                        setattr(peft_config, key, config[key])
+
             model = AutoModelForSeq2SeqLM.from_pretrained(config["model_name_or_path"])
             
             tokenizer = AutoTokenizer.from_pretrained(
@@ -321,7 +312,7 @@ class PeftEval:
                         weights
                     )
 
-            if config["peft_type"] == "attempt":
+            if config["peft_type"] in ["attempt", "prefix_tuning"]:
                 from cpeft import PeftModel
 
                 model = PeftModel.from_pretrained(model, self.dir)
@@ -337,11 +328,7 @@ class PeftEval:
             model.to(config["device"])
             config["timestamp"] = datetime.now().strftime("%m%d%Y%H%M%S")
 
-            optimizer = torch.optim.AdamW(
-                model.parameters(),
-                lr=config["learning_rate"],
-                weight_decay=config.get("weight_decay", 0.01),
-            )
+            optimizer = build_optimizer(model, config)
 
             metrics_fn = self.build_compute_metrics_fn(tokenizer, config)
             # print(metrics_fn)
@@ -374,6 +361,10 @@ class PeftEval:
 
             run.finish()
 
+            # loaded splits, permutations and prompts are not kept across runs
+            AutoTask.clear()
+            clear_cache()
+
 
 import argparse
 import tomllib
@@ -0,0 +1,255 @@
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import inspect
+import datasets
+import functools
+
+from typing import Callable, Optional
+
+from .tasks import AutoTask
+
+
+class DatasetCache:
+    """Content-addressed on-disk cache of processed dataset splits.
+
+    An entry is a dataset saved with save_to_disk in a directory named by the hash of
+    its key, it is loaded back as memory-mapped Arrow. Writers save into a private
+    directory and rename it into place, the first finished writer wins. Once the cache
+    grows over max_size bytes the least recently used entries are removed.
+    """
+
+    def __init__(self, cache_dir: str, max_size: Optional[int] = None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_path(self, key: dict) -> str:
+        data = json.dumps(key, sort_keys=True, default=str).encode()
+        return os.path.join(self.cache_dir, hashlib.sha256(data).hexdigest())
+
+    def load(self, key: dict) -> Optional[datasets.Dataset]:
+        path = self.get_path(key)
+
+        # a missing, partial or concurrently evicted entry is a miss
+        try:
+            dataset = datasets.load_from_disk(path)
+            # the modification time orders entries for eviction
+            os.utime(path)
+        except (FileNotFoundError, OSError):
+            return None
+
+        return dataset
+
+    def save(self, key: dict, dataset: datasets.Dataset) -> datasets.Dataset:
+        path = self.get_path(key)
+        tmp_path = os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}")
+
+        dataset.save_to_disk(tmp_path)
+        with open(os.path.join(tmp_path, "cache_key.json"), "w") as f:
+            json.dump(key, f, sort_keys=True, default=str)
+
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # a broken entry is replaced, otherwise another writer stored it first
+            if self.load(key) is None:
+                shutil.rmtree(path, ignore_errors=True)
+                try:
+                    os.rename(tmp_path, path)
+                except OSError:
+                    pass
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        self.evict(keep=path)
+        return datasets.load_from_disk(path)
+
+    def get_or_build(
+        self, key: dict, build: Callable[[], datasets.Dataset]
+    ) -> datasets.Dataset:
+        dataset = self.load(key)
+        if dataset is None:
+            dataset = self.save(key, build())
+
+        return dataset
+
+    def evict(self, keep: Optional[str] = None):
+        if self.max_size is None:
+            return
+
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith(".tmp-") or not os.path.isdir(path):
+                continue
+
+            try:
+                entries.append((os.path.getmtime(path), _get_size(path), path))
+            except FileNotFoundError:
+                continue
+
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+
+            if path != keep:
+                shutil.rmtree(path, ignore_errors=True)
+                size -= entry_size
+
+
+def get_dataset_cache(config) -> Optional[DatasetCache]:
+    if config.get("dataset_cache_dir", None) is None:
+        return None
+
+    max_size = config.get("dataset_cache_max_gb", None)
+    if max_size is not None:
+        max_size = int(max_size * 2**30)
+
+    return DatasetCache(config["dataset_cache_dir"], max_size)
+
+
+def get_dataset(
+    config,
+    tokenizer,
+    dataset_name: str,
+    split: str,
+    n_obs: Optional[int],
+    max_target_length: int,
+    preprocess_function: Callable,
+    task_id: Optional[int] = None,
+    cols_to_remove=(),
+    cache: Optional[DatasetCache] = None,
+    tokenizer_id: Optional[str] = None,
+) -> datasets.Dataset:
+    """Split of a task tokenized by preprocess_function, loaded from the cache if given."""
+    task = AutoTask.get(dataset_name, config)
+
+    def build():
+        dataset = task.get(
+            split=split,
+            split_validation_test=config["split_validation_test"],
+            add_prefix=True,
+            n_obs=n_obs,
+        )
+        dataset = dataset.map(
+            functools.partial(
+                preprocess_function,
+                config=config,
+                tokenizer=tokenizer,
+                max_target_length=max_target_length,
+                task_id=task_id,
+            ),
+            batched=True,
+            num_proc=config.get("preprocessing_num_workers", None),
+            load_from_cache_file=False,
+            desc=f"Running preprocess_function on {split} dataset",
+        )
+
+        return dataset.remove_columns(list(cols_to_remove))
+
+    return get_or_build_split(
+        cache,
+        build,
+        task,
+        config,
+        split=split,
+        n_obs=n_obs,
+        max_target_length=max_target_length,
+        task_id=task_id,
+        cols_to_remove=cols_to_remove,
+        tokenizer_id=tokenizer_id,
+        preprocess_function=preprocess_function,
+    )
+
+
+def get_or_build_split(
+    cache: Optional[DatasetCache],
+    build: Callable[[], datasets.Dataset],
+    task,
+    config,
+    split: str,
+    n_obs: Optional[int],
+    max_target_length: int,
+    task_id: Optional[int],
+    cols_to_remove,
+    tokenizer_id: Optional[str],
+    preprocess_function: Callable,
+) -> datasets.Dataset:
+    """Loads a tokenized split of task from the cache, or builds and stores it.
+
+    The key holds everything the split depends on, the source code of the task and of
+    preprocess_function included. Without a cache the split is always built.
+    """
+    if cache is None:
+        return build()
+
+    key = {
+        "task": task.name,
+        "split": split,
+        "n_obs": n_obs,
+        "seed": task.seed,
+        "split_validation_test": config["split_validation_test"],
+        "task_type": config["task_type"],
+        "tokenizer": tokenizer_id,
+        "max_source_length": config["max_source_length"],
+        "max_target_length": max_target_length,
+        "pad_to_max_length": config["pad_to_max_length"],
+        "task_id": task_id,
+        "cols_to_remove": list(cols_to_remove),
+        "code": task_code_version(task) + code_version(preprocess_function),
+    }
+
+    return cache.get_or_build(key, build)
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    data = json.dumps(
+        [
+            type(tokenizer).__name__,
+            tokenizer.name_or_path,
+            sorted(tokenizer.get_vocab().items()),
+            tokenizer.special_tokens_map,
+        ],
+        default=str,
+    )
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def code_version(*objects) -> str:
+    # hash of the source code, cached entries are rebuilt when the preprocessing changes
+    sha = hashlib.sha256()
+    for obj in objects:
+        sha.update(inspect.getsource(obj).encode())
+
+    return sha.hexdigest()
+
+
+def task_code_version(task) -> str:
+    # source files of the task, its formater and the text helpers the task module
+    # imports (e.g. pad_punctuation), an edit in any of them rebuilds the entries
+    classes = [c for c in type(task).__mro__ if c is not object]
+    helpers = [
+        v
+        for c in classes
+        for v in vars(inspect.getmodule(c)).values()
+        if inspect.isfunction(v)
+    ]
+    paths = {inspect.getsourcefile(obj) for obj in [*classes, task.formater, *helpers]}
+
+    sha = hashlib.sha256()
+    for path in sorted(paths):
+        with open(path, "rb") as f:
+            sha.update(f.read())
+
+    return sha.hexdigest()
+
+
+def _get_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        size += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+
+    return size
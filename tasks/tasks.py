@@ -1,5 +1,6 @@
 # Some code is adapted from https://github.com/AkariAsai/ATTEMPT/blob/main/attempt/data/tasks.py
 
+import os
 import functools
 import datasets
 import numpy as np
@@ -25,6 +26,12 @@ from metrics import (
 
 from utils import pad_punctuation, round_stsb_target
 
+# patterns of the preprocessors, compiled once
+MARKUP_BREAK = re.compile("<br>")
+MARKUP_BOLD = re.compile("<(/)?b>")
+HIGHLIGHT_END = re.compile(r"(\.|\?|\!|\"|\')\n@highlight\n")
+HIGHLIGHT = re.compile(r"\n@highlight\n")
+
 
 class AbstractTask:
     name = NotImplemented
@@ -80,11 +87,21 @@ class AbstractTask:
         "sst5",
     ]
 
+    # config entries a task reads, tasks are shared by configs that agree on them
+    config_keys = [
+        "task_type",
+        "preprocessing_num_workers",
+        "permutation_dir",
+        "flatten_indices",
+    ]
+
     def __init__(self, config, seed=42):
         self.dataset_config_name = "en"
         self.config = config
         self.seed = seed
         self.formater = AutoType.get(self.config["task_type"]).formater
+        self.loaded_splits = {}
+        self.permutations = {}
 
     def postprocessor(
         self, preds, labels, tokenizer, ignore_pad_token_for_loss, data_info=None
@@ -112,10 +129,39 @@ class AbstractTask:
         return n_obs
 
     def shuffled_indices(self, dataset):
-        num_samples = len(dataset)
+        # one permutation per source split, shared by the views derived from it
+        key = (dataset._fingerprint, len(dataset))
+        if key not in self.permutations:
+            split = next(
+                (s for s, d in self.loaded_splits.items() if d is dataset), None
+            )
+            self.permutations[key] = self.load_permutation(len(dataset), split)
+
+        return self.permutations[key]
+
+    def load_permutation(self, num_samples, split=None):
+        # permutations of loaded splits are stored once as memory-mapped npy files
+        permutation_dir = self.config.get("permutation_dir", None)
+        if permutation_dir is None or split is None:
+            return self.permutation(num_samples)
+
+        path = os.path.join(
+            permutation_dir, f"{self.name}-{split}-{self.seed}-{num_samples}.npy"
+        )
+        if not os.path.exists(path):
+            os.makedirs(permutation_dir, exist_ok=True)
+
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, self.permutation(num_samples))
+            os.replace(tmp_path, path)
+
+        return np.load(path, mmap_mode="r")
+
+    def permutation(self, num_samples):
         generator = torch.Generator()
         generator.manual_seed(self.seed)
-        return torch.randperm(num_samples, generator=generator).tolist()
+        return torch.randperm(num_samples, generator=generator).numpy()
 
     def subsample(self, dataset, n_obs=None, indices=None):
         num_samples = len(dataset)
@@ -123,7 +169,15 @@ class AbstractTask:
         if indices is None:
             indices = self.shuffled_indices(dataset)
         indices = indices[:n_obs]
-        return dataset.select(indices)
+        dataset = dataset.select(indices)
+
+        # contiguous rows, later maps and reads do not go through the indices mapping
+        if self.config.get("flatten_indices", False):
+            dataset = dataset.flatten_indices(
+                num_proc=self.config.get("preprocessing_num_workers", None)
+            )
+
+        return dataset
 
     def get_split_indices(self, split, dataset, validation_size):
         indices = self.shuffled_indices(dataset)
@@ -133,8 +187,11 @@ class AbstractTask:
             return indices[validation_size:]
 
     def map_dataset(self, dataset, add_prefix):
+        # preprocessors take a batch of columns
         return dataset.map(
             functools.partial(self.preprocessor, add_prefix=add_prefix),
+            batched=True,
+            num_proc=self.config.get("preprocessing_num_workers", None),
             remove_columns=dataset.column_names,
             load_from_cache_file=False,
             desc=f"Running {self.name}_preprocessor on dataset",
@@ -145,6 +202,13 @@ class AbstractTask:
             self.name, self.dataset_config_name, split=split, script_version="master"
         )
 
+    def load_split(self, split):
+        # e.g. validation and train of large datasets are both cut from train
+        if split not in self.loaded_splits:
+            self.loaded_splits[split] = self.load_dataset(split=split)
+
+        return self.loaded_splits[split]
+
     def get(self, split, add_prefix=True, n_obs=None, split_validation_test=False):
         # to better uderstand this please see comments provided by authors https://github.com/AkariAsai/ATTEMPT/blob/main/attempt/data/tasks.py#L98
         if (
@@ -153,7 +217,7 @@ class AbstractTask:
             and split != "train"
         ):
             mapped_split = self.split_to_data_split["validation"]
-            dataset = self.load_dataset(split=mapped_split)
+            dataset = self.load_split(mapped_split)
             indices = self.get_split_indices(
                 split, dataset, validation_size=len(dataset) // 2
             )
@@ -164,13 +228,13 @@ class AbstractTask:
             and self.name in self.large_data_without_all_splits
             and split != "test"
         ):
-            dataset = self.load_dataset(split="train")
+            dataset = self.load_split("train")
             indices = self.get_split_indices(split, dataset, validation_size=1000)
             dataset = self.subsample(dataset, n_obs, indices)
 
         else:
             mapped_split = self.split_to_data_split[split]
-            dataset = self.load_dataset(split=mapped_split)
+            dataset = self.load_split(mapped_split)
 
             if n_obs is not None:
                 dataset = self.subsample(dataset, n_obs)
@@ -191,13 +255,15 @@ class Squad(AbstractTask):
     def load_dataset(self, split):
         return datasets.load_dataset(self.name, split=split)
 
-    def preprocessor(self, example, add_prefix):
-        answer = pad_punctuation(example["answers"]).split("\t")
-        question = pad_punctuation(example["question"])
-        context = pad_punctuation(example["context"])
+    def preprocessor(self, batch, add_prefix):
+        answers = [
+            " ".join(pad_punctuation(answer).split("\t")) for answer in batch["answers"]
+        ]
+        questions = [pad_punctuation(question) for question in batch["question"]]
+        contexts = [pad_punctuation(context) for context in batch["context"]]
 
-        input_texts = ["question:", question, "context:", context]
-        label_texts = [answer] if type(answer) == str else answer
+        input_texts = ["question:", questions, "context:", contexts]
+        label_texts = [answers]
 
         return self.formater(self.name, input_texts, label_texts, add_prefix)
 
@@ -216,14 +282,14 @@ class MRPC(AbstractTask):
     def load_dataset(self, split):
         return datasets.load_dataset("glue", self.name, split=split)
 
-    def preprocessor(self, example, add_prefix=True):
+    def preprocessor(self, batch, add_prefix=True):
         input_texts = [
             "sentence1:",
-            example["sentence1"],
+            batch["sentence1"],
             "sentence2:",
-            example["sentence2"],
+            batch["sentence2"],
         ]
-        label_texts = [str(example["label"])]
+        label_texts = [[str(label) for label in batch["label"]]]
 
         return self.formater(self.name, input_texts, label_texts, add_prefix)
 
@@ -242,9 +308,9 @@ class COLA(AbstractTask):
     def load_dataset(self, split):
         return datasets.load_dataset("glue", self.name, split=split)
 
-    def preprocessor(self, example, add_prefix=True):
-        input_texts = ["sentence:", example["sentence"]]
-        label_texts = [str(example["label"])]
+    def preprocessor(self, batch, add_prefix=True):
+        input_texts = ["sentence:", batch["sentence"]]
+        label_texts = [[str(label) for label in batch["label"]]]
         return self.formater(self.name, input_texts, label_texts, add_prefix)
 
 
@@ -262,9 +328,9 @@ class SST2(AbstractTask):
     def load_dataset(self, split):
         return datasets.load_dataset("glue", self.name, split=split)
 
-    def preprocessor(self, example, add_prefix=True):
-        input_texts = ["sentence", example["sentence"]]
-        label_texts = [str(example["label"])]
+    def preprocessor(self, batch, add_prefix=True):
+        input_texts = ["sentence", batch["sentence"]]
+        label_texts = [[str(label) for label in batch["label"]]]
 
         return self.formater(self.name, input_texts, label_texts, add_prefix)
 
@@ -283,14 +349,14 @@ class QNLI(AbstractTask):
     def load_dataset(self, split):
         return datasets.load_dataset("glue", self.name, split=split)
 
-    def preprocessor(self, example, add_prefix=True):
+    def preprocessor(self, batch, add_prefix=True):
         input_texts = [
             "question:",
-            example["question"],
+            batch["question"],
             "sentence:",
-            example["sentence"],
+            batch["sentence"],
         ]
-        label_texts = [str(example["label"])]
+        label_texts = [[str(label) for label in batch["label"]]]
 
         return self.formater(self.name, input_texts, label_texts, add_prefix)
 
@@ -309,14 +375,14 @@ class RTE(AbstractTask):
     def load_dataset(self, split):
         return datasets.load_dataset("glue", self.name, split=split)
 
-    def preprocessor(self, example, add_prefix=True):
+    def preprocessor(self, batch, add_prefix=True):
         input_texts = [
             "sentence1:",
-            example["sentence1"],
+            batch["sentence1"],
             "sentence2:",
-            example["sentence2"],
+            batch["sentence2"],
         ]
-        label_texts = [str(example["label"])]
+        label_texts = [[str(label) for label in batch["label"]]]
         return self.formater(self.name, input_texts, label_texts, add_prefix)
 
 
@@ -334,14 +400,14 @@ class MNLI(AbstractTask):
     def load_dataset(self, split):
         return datasets.load_dataset("glue", self.name, split=split)
 
-    def preprocessor(self, example, add_prefix=True):
+    def preprocessor(self, batch, add_prefix=True):
         input_texts = [
             "premise:",
-            example["premise"],
+            batch["premise"],
             "hypothesis:",
-            example["hypothesis"],
+            batch["hypothesis"],
         ]
-        label_texts = [str(example["label"])]
+        label_texts = [[str(label) for label in batch["label"]]]
 
         return self.formater(self.name, input_texts, label_texts, add_prefix)
 
@@ -362,14 +428,14 @@ class MNLITXT(AbstractTask):
     def load_dataset(self, split):
         return datasets.load_dataset("glue", self.name, split=split)
 
-    def preprocessor(self, example, add_prefix=True):
+    def preprocessor(self, batch, add_prefix=True):
         input_texts = [
             "premise:",
-            example["premise"],
+            batch["premise"],
             "hypothesis:",
-            example["hypothesis"],
+            batch["hypothesis"],
         ]
-        label_texts = [str(self.label_names[example["label"]])]
+        label_texts = [[str(self.label_names[label]) for label in batch["label"]]]
 
         return self.formater(self.name, input_texts, label_texts, add_prefix)
 
@@ -388,14 +454,14 @@ class QQP(AbstractTask):
     def load_dataset(self, split):
         return datasets.load_dataset("glue", self.name, split=split)
 
-    def preprocessor(self, example, add_prefix=True):
+    def preprocessor(self, batch, add_prefix=True):
         input_texts = [
             "question1:",
-            example["question1"],
+            batch["question1"],
             "question2:",
-            example["question2"],
+            batch["question2"],
         ]
-        label_texts = [str(example["label"])]
+        label_texts = [[str(label) for label in batch["label"]]]
 
         return self.formater(self.name, input_texts, label_texts, add_prefix)
 
@@ -415,15 +481,15 @@ class STSB(AbstractTask):
     def load_dataset(self, split):
         return datasets.load_dataset("glue", self.name, split=split)
 
-    def preprocessor(self, example, add_prefix=True):
+    def preprocessor(self, batch, add_prefix=True):
         input_texts = [
             "sentence1:",
-            example["sentence1"],
+            batch["sentence1"],
             "sentence2:",
-            example["sentence2"],
+            batch["sentence2"],
         ]
 
-        label_texts = [str(round_stsb_target(example["label"]))]
+        label_texts = [[str(round_stsb_target(label)) for label in batch["label"]]]
         return self.formater(self.name, input_texts, label_texts, add_prefix)
 
 
@@ -441,9 +507,9 @@ class SuperGLUEBoolQ(AbstractTask):
     def load_dataset(self, split):
         return datasets.load_dataset("super_glue", "boolq", split=split)
 
-    def preprocessor(self, example, add_prefix=True):
-        input_texts = ["question:", example["question"], "passage:", example["passage"]]
-        label_texts = [str(example["label"])]
+    def preprocessor(self, batch, add_prefix=True):
+        input_texts = ["question:", batch["question"], "passage:", batch["passage"]]
+        label_texts = [[str(label) for label in batch["label"]]]
 
         return self.formater(self.name, input_texts, label_texts, add_prefix)
 
@@ -462,14 +528,14 @@ class SuperGLUECB(AbstractTask):
     def load_dataset(self, split):
         return datasets.load_dataset("super_glue", "cb", split=split)
 
-    def preprocessor(self, example, add_prefix=True):
+    def preprocessor(self, batch, add_prefix=True):
         input_texts = [
             "premise:",
-            example["premise"],
+            batch["premise"],
             "hypothesis:",
-            example["hypothesis"],
+            batch["hypothesis"],
         ]
-        label_texts = [str(example["label"])]
+        label_texts = [[str(label) for label in batch["label"]]]
 
         return self.formater(self.name, input_texts, label_texts, add_prefix)
 
@@ -493,8 +559,8 @@ class SuperGLUEMultiRC(AbstractTask):
 
     def remove_markup(self, text):
         """Removes the HTML markup."""
-        text = re.sub("<br>", " ", text)
-        text = re.sub("<(/)?b>", "", text)
+        text = MARKUP_BREAK.sub(" ", text)
+        text = MARKUP_BOLD.sub("", text)
         return text
 
     def postprocessor(
@@ -513,26 +579,26 @@ class SuperGLUEMultiRC(AbstractTask):
         ]
         return preds, labels
 
-    def preprocessor(self, example, add_prefix=True):
-        group = example["idx"]["question"]
+    def preprocessor(self, batch, add_prefix=True):
+        groups = [idx["question"] for idx in batch["idx"]]
         # T5 applies remove_markup to the joined string, but this should not make
         # any difference as well.
         # https://github.com/google-research/text-to-text-transfer-transformer/blob/a1352e625db7ec114062f99d99b0565b9e45c155/t5/data/preprocessors.py#L797
         input_texts = [
             "question:",
-            self.remove_markup(example["question"]),
+            [self.remove_markup(text) for text in batch["question"]],
             "answer:",
-            self.remove_markup(example["answer"]),
+            [self.remove_markup(text) for text in batch["answer"]],
             "paragraph:",
-            self.remove_markup(example["paragraph"]),
+            [self.remove_markup(text) for text in batch["paragraph"]],
         ]
-        label_texts = [str(example["label"])]
+        label_texts = [[str(label) for label in batch["label"]]]
         return self.formater(
             self.name,
             input_texts,
             label_texts,
             add_prefix,
-            extra_fields={"group": group},
+            extra_fields=[{"group": group} for group in groups],
         )
 
 
@@ -550,16 +616,16 @@ class SuperGLUEWIC(AbstractTask):
     def load_dataset(self, split):
         return datasets.load_dataset("super_glue", "wic", split=split)
 
-    def preprocessor(self, example, add_prefix=True):
+    def preprocessor(self, batch, add_prefix=True):
         input_texts = [
             "sentence1:",
-            example["sentence1"],
+            batch["sentence1"],
             "sentence2:",
-            example["sentence2"],
+            batch["sentence2"],
             "word:",
-            example["word"],
+            batch["word"],
         ]
-        label_texts = [str(example["label"])]
+        label_texts = [[str(label) for label in batch["label"]]]
         return self.formater(self.name, input_texts, label_texts, add_prefix)
 
 
@@ -604,17 +670,23 @@ class SuperGLUEWSCFixed(AbstractTask):
         pattern = re.sub("W", span_str, pattern)
         return re.sub(pattern, r"\1{0} \2 {0}".format(mark), text)
 
-    def preprocessor(self, example, add_prefix=True):
+    def preprocessor(self, batch, add_prefix=True):
         # converts text as done in T5.
-        text = example["text"]
-        text = self._mark_span(text, example["span1_text"], example["span1_index"], "*")
-        # Compensate for 2 added "words" added in previous step.
-        span2_index = example["span2_index"] + 2 * int(
-            example["span1_index"] < example["span2_index"]
-        )
-        text = self._mark_span(text, example["span2_text"], span2_index, "#")
-        input_texts = ["text:", text]
-        label_texts = [str(example["label"])]
+        texts = []
+        for text, span1_text, span1_index, span2_text, span2_index in zip(
+            batch["text"],
+            batch["span1_text"],
+            batch["span1_index"],
+            batch["span2_text"],
+            batch["span2_index"],
+        ):
+            text = self._mark_span(text, span1_text, span1_index, "*")
+            # Compensate for 2 added "words" added in previous step.
+            span2_index = span2_index + 2 * int(span1_index < span2_index)
+            texts.append(self._mark_span(text, span2_text, span2_index, "#"))
+
+        input_texts = ["text:", texts]
+        label_texts = [[str(label) for label in batch["label"]]]
         return self.formater(self.name, input_texts, label_texts, add_prefix)
 
 
@@ -638,8 +710,8 @@ class SuperGLUERecord(AbstractTask):
             ex = {k: v for k, v in zip(keys, values)}
             # updates the passage.
             passage = ex["passage"]
-            passage = re.sub(r"(\.|\?|\!|\"|\')\n@highlight\n", r"\1 ", passage)
-            passage = re.sub(r"\n@highlight\n", ". ", passage)
+            passage = HIGHLIGHT_END.sub(r"\1 ", passage)
+            passage = HIGHLIGHT.sub(". ", passage)
             inputs = f"record query: {ex['query']} entities: {', '.join(ex['entities'])} passage: {passage}"
             if add_prefix:
                 inputs = self.name + " " + inputs
@@ -665,13 +737,6 @@ class SuperGLUERecord(AbstractTask):
         labels = [info["answers"] for info in data_info]
         return preds, labels
 
-    def map_dataset(self, dataset, add_prefix=True):
-        return dataset.map(
-            functools.partial(self.preprocessor, add_prefix=add_prefix),
-            batched=True,
-            remove_columns=dataset.column_names,
-        )
-
 
 class WinoGrande(AbstractTask):
     name = "winogrande"
@@ -687,16 +752,16 @@ class WinoGrande(AbstractTask):
     def load_dataset(self, split):
         return datasets.load_dataset("winogrande", "winogrande_xl", split=split)
 
-    def preprocessor(self, example, add_prefix=True):
+    def preprocessor(self, batch, add_prefix=True):
         input_texts = [
             "sentence:",
-            example["sentence"],
+            batch["sentence"],
             "option0:",
-            example["option1"],
+            batch["option1"],
             "option1:",
-            example["option1"],
+            batch["option1"],
         ]
-        label_texts = [str(int(example["answer"]) - 1)]
+        label_texts = [[str(int(answer) - 1) for answer in batch["answer"]]]
 
         return self.formater(self.name, input_texts, label_texts, add_prefix)
 
@@ -711,15 +776,15 @@ class SciTail(AbstractTask):
     def load_dataset(self, split):
         return datasets.load_dataset("scitail", "snli_format", split=split)
 
-    def preprocessor(self, example, add_prefix=True):
+    def preprocessor(self, batch, add_prefix=True):
         label2id = {"entailment": "0", "neutral": "1"}
         input_texts = [
             "premise:",
-            example["sentence1"],
+            batch["sentence1"],
             "hypothesis:",
-            example["sentence2"],
+            batch["sentence2"],
         ]
-        label_texts = [label2id[example["gold_label"]]]
+        label_texts = [[label2id[label] for label in batch["gold_label"]]]
         return self.formater(self.name, input_texts, label_texts, add_prefix)
 
 
@@ -733,9 +798,9 @@ class YelpPolarity(AbstractTask):
     def load_dataset(self, split):
         return datasets.load_dataset("yelp_polarity")[split]
 
-    def preprocessor(self, example, add_prefix=True):
-        input_texts = ["sentence:", example["text"]]
-        label_texts = [str(example["label"])]
+    def preprocessor(self, batch, add_prefix=True):
+        input_texts = ["sentence:", batch["text"]]
+        label_texts = [[str(label) for label in batch["label"]]]
         return self.formater(self.name, input_texts, label_texts, add_prefix)
 
 
@@ -749,14 +814,14 @@ class PAWS(AbstractTask):
     def load_dataset(self, split):
         return datasets.load_dataset("paws", "labeled_final", split=split)
 
-    def preprocessor(self, example, add_prefix=True):
+    def preprocessor(self, batch, add_prefix=True):
         input_texts = [
             "sentence1:",
-            example["sentence1"],
+            batch["sentence1"],
             "sentence2:",
-            example["sentence2"],
+            batch["sentence2"],
         ]
-        label_texts = [str(example["label"])]
+        label_texts = [[str(label) for label in batch["label"]]]
         return self.formater(self.name, input_texts, label_texts, add_prefix)
     
 class SNLI(AbstractTask):
@@ -772,14 +837,14 @@ class SNLI(AbstractTask):
             lambda x: x["label"] != -1
         )
 
-    def preprocessor(self, example, add_prefix=True):
+    def preprocessor(self, batch, add_prefix=True):
         input_texts = [
             "premise:",
-            example["premise"],
+            batch["premise"],
             "hypothesis:",
-            example["hypothesis"],
+            batch["hypothesis"],
         ]
-        label_texts = [str(example[self.label_column_name])]
+        label_texts = [[str(label) for label in batch[self.label_column_name]]]
 
         return self.formater(
             self.name.replace("_text", ""), input_texts, label_texts, add_prefix
@@ -796,12 +861,12 @@ class AGNews(AbstractTask):
     def load_dataset(self, split):
         return datasets.load_dataset("ag_news", split=split)
 
-    def preprocessor(self, example, add_prefix=True):
+    def preprocessor(self, batch, add_prefix=True):
         input_texts = [
             "What is the category for following text:",
-            example["text"],
+            batch["text"],
         ]
-        label_texts = [str(example[self.label_column_name])]
+        label_texts = [[str(label) for label in batch[self.label_column_name]]]
 
         return self.formater(
             self.name.replace("_text", ""), input_texts, label_texts, add_prefix
@@ -818,16 +883,16 @@ class Yahoo(AbstractTask):
     def load_dataset(self, split):
         return datasets.load_dataset("yahoo_answers_topics", split=split)
 
-    def preprocessor(self, example, add_prefix=True):
+    def preprocessor(self, batch, add_prefix=True):
         input_texts = [
             "What is the category for following text: title:",
-            example["question_title"],
+            batch["question_title"],
             "content:",
-            example["question_content"],
+            batch["question_content"],
             "answer:",
-            example["best_answer"],
+            batch["best_answer"],
         ]
-        label_texts = [str(example[self.label_column_name])]
+        label_texts = [[str(label) for label in batch[self.label_column_name]]]
 
         return self.formater(
             self.name.replace("_text", ""), input_texts, label_texts, add_prefix
@@ -845,9 +910,9 @@ class IMDB(AbstractTask):
     def load_dataset(self, split):
         return datasets.load_dataset("imdb")[split]
 
-    def preprocessor(self, example, add_prefix=True):
-        input_texts = ["sentence:", example["text"]]
-        label_texts = [str(example[self.label_column_name])]
+    def preprocessor(self, batch, add_prefix=True):
+        input_texts = ["sentence:", batch["text"]]
+        label_texts = [[str(label) for label in batch[self.label_column_name]]]
         return self.formater(
             self.name.replace("_text", ""), input_texts, label_texts, add_prefix
         )
@@ -867,9 +932,9 @@ class SST5(AbstractTask):
     def load_dataset(self, split):
         return datasets.load_dataset("SetFit/sst5", split=split)
 
-    def preprocessor(self, example, add_prefix=True):
-        input_texts = ["sentence", example["text"]]
-        label_texts = [str(example[self.label_column_name])]
+    def preprocessor(self, batch, add_prefix=True):
+        input_texts = ["sentence", batch["text"]]
+        label_texts = [[str(label) for label in batch[self.label_column_name]]]
 
         return self.formater(
             self.name.replace("_text", ""), input_texts, label_texts, add_prefix
@@ -913,11 +978,22 @@ TASK_MAPPING = OrderedDict(
 )
 
 
+# tasks by (name, seed, config entries), kept until AutoTask.clear
+_TASKS = {}
+
+
 class AutoTask:
     @classmethod
     def get(self, task, config, seed=42):
         if task in TASK_MAPPING:
-            return TASK_MAPPING[task](config, seed)
+            task_class = TASK_MAPPING[task]
+            config = {key: config.get(key, None) for key in task_class.config_keys}
+
+            key = (task, seed, tuple(config.items()))
+            if key not in _TASKS:
+                _TASKS[key] = task_class(config, seed)
+
+            return _TASKS[key]
 
         raise ValueError(
             f"Unrecognized task {task} for AutoTask Model: {config['model_name_or_path']}.\n"
@@ -925,3 +1001,8 @@ class AutoTask:
                 ", ".join(c for c in TASK_MAPPING.keys())
             )
         )
+
+    @classmethod
+    def clear(self):
+        # drops the tasks with their loaded splits and permutations
+        _TASKS.clear()
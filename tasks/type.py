@@ -10,19 +10,34 @@ class Seq2SeqLM(AbstractTaskType):
     name = "seq_2_seq_lm"
 
     def formater(
-        self, task_name, inputs, labels, add_prefix, prefix=None, extra_fields={}
+        self, task_name, inputs, labels, add_prefix, prefix=None, extra_fields=None
     ):
+        # formats a batch, inputs and labels are columns or strings shared by all rows
         input_prefix = task_name if prefix is None else prefix
         inputs = [input_prefix] + inputs if add_prefix else inputs
+        num_rows = len(next(c for c in inputs + labels if not isinstance(c, str)))
+
         return {
-            "source": " ".join(inputs),
-            "target": " ".join(labels),
-            "task": task_name,
-            "extra_fields": extra_fields,
+            "source": _join_columns(inputs, num_rows),
+            "target": _join_columns(labels, num_rows),
+            "task": [task_name] * num_rows,
+            "extra_fields": ([{}] * num_rows if extra_fields is None else extra_fields),
         }
 
 
-TYPE_MAPPING = OrderedDict([("seq_2_seq_lm", Seq2SeqLM)])
+class SequenceClassification(Seq2SeqLM):
+    # targets stay label strings, the model maps them to classes
+    name = "seq_cls"
+
+
+def _join_columns(columns, num_rows):
+    columns = [[c] * num_rows if isinstance(c, str) else c for c in columns]
+    return [" ".join(row) for row in zip(*columns)]
+
+
+TYPE_MAPPING = OrderedDict(
+    [("seq_2_seq_lm", Seq2SeqLM), ("seq_cls", SequenceClassification)]
+)
 
 
 class AutoType:
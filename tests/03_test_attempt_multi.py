@@ -37,8 +37,8 @@ cpeft_config = AttemptConfig(
 model = AutoModelForSeq2SeqLM.from_pretrained("t5-base")
 model = get_peft_model(model, cpeft_config).to("cuda")
 weights = [
-    model.prompt_encoder["peft"].embedding[i].weight
-    for i, _ in enumerate(model.prompt_encoder["peft"].embedding)
+    model.prompt_encoder["peft"].embedding.weight[i]
+    for i in range(len(model.prompt_encoder["peft"].embedding))
 ]
 
 model.print_trainable_parameters()
@@ -49,8 +49,8 @@ model.save_pretrained(cpeft_save)
 new_model = AutoModelForSeq2SeqLM.from_pretrained("t5-base")
 new_model = PeftModel.from_pretrained(new_model, cpeft_save).to("cuda")
 new_weights = [
-    new_model.prompt_encoder["peft"].embedding[i].weight
-    for i, _ in enumerate(model.prompt_encoder["peft"].embedding)
+    new_model.prompt_encoder["peft"].embedding.weight[i]
+    for i in range(len(model.prompt_encoder["peft"].embedding))
 ]
 
 # print(str(new_model._peft_config) == str(model._peft_config))
@@ -58,10 +58,9 @@ new_weights = [
 
 assert str(model) == str(new_model), "Model is not the same after saving and loading."
 
-for i, _ in enumerate(model.prompt_encoder["peft"].embedding):
+for weight, new_weight in zip(weights, new_weights):
     assert (
-        model.prompt_encoder["peft"].embedding[i].weight
-        == new_model.prompt_encoder["peft"].embedding[i].weight
+        weight == new_weight
     ).all(), "Prompt embeddings must be the same after save and load."
 
 new_params = list(new_model.named_parameters())
@@ -0,0 +1,93 @@
+import sys
+import os
+
+import utils
+
+import torch
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+utils.start(__file__)
+
+from torch.profiler import profile
+from transformers import T5Config, T5ForConditionalGeneration
+from cpeft import PromptTuningConfig, get_peft_model
+from cpeft.model import MAX_PREFIX_ATTENTION_MASKS
+
+# tiny randomly initialized T5, no pretrained weights are needed to count allocations
+model_config = T5Config(
+    vocab_size=100,
+    d_model=32,
+    d_kv=8,
+    d_ff=64,
+    num_layers=2,
+    num_heads=4,
+    decoder_start_token_id=0,
+)
+cpeft_config = PromptTuningConfig(task_type="seq_2_seq_lm", num_virtual_tokens=10)
+
+model = T5ForConditionalGeneration(model_config)
+model = get_peft_model(model, cpeft_config)
+model.peft_config["peft"].inference_mode = True
+model.eval()
+
+batch_size = 4
+input_ids = torch.randint(2, 100, (batch_size, 7))
+attention_mask = torch.ones_like(input_ids)
+
+
+def assemble_prompt():
+    prompts = model.get_prompt(batch_size, task_ids=None, dtype=torch.float32)
+    prefix_attention_mask = model.get_prefix_attention_mask(batch_size, attention_mask)
+    return prompts, prefix_attention_mask
+
+
+with torch.no_grad():
+    first = assemble_prompt()
+
+    with profile(profile_memory=True) as prof:
+        second = assemble_prompt()
+
+    allocations = [e for e in prof.events() if e.cpu_memory_usage > 0]
+
+    assert (
+        len(allocations) == 0
+    ), f"Steady state prompt assembly must not allocate, got {[e.name for e in allocations]}."
+    assert first[0] is second[0], "Expanded prompt must be reused in inference mode."
+    assert first[1] is second[1], "Prefix attention mask must be reused."
+
+    # updating the prompt weights in place invalidates the cached prompt
+    model.prompt_encoder["peft"].embedding.weight.add_(1.0)
+    third = assemble_prompt()
+
+    assert third[0] is not second[0], "Cached prompt must follow weight updates."
+    assert torch.equal(
+        third[0][0], model.prompt_encoder["peft"].embedding.weight
+    ), "Cached prompt must match the prompt weights."
+
+    # swapping the storage of the prompt weights invalidates the cached prompt as well
+    weight = model.prompt_encoder["peft"].embedding.weight
+    weight.data = torch.randn_like(weight)
+    fourth = assemble_prompt()
+
+    assert fourth[0] is not third[0], "Cached prompt must follow swapped weights."
+    assert torch.equal(
+        fourth[0][0], weight
+    ), "Cached prompt must match the prompt weights."
+
+    # masks of only the most recent batch sizes are kept
+    for size in range(1, 20):
+        model.get_prefix_attention_mask(size, attention_mask)
+    assert len(model._prefix_attention_masks) == MAX_PREFIX_ATTENTION_MASKS
+    assert model.get_prefix_attention_mask(19, attention_mask).shape == (19, 10)
+
+    outputs = model(
+        input_ids=input_ids,
+        attention_mask=attention_mask,
+        labels=input_ids,
+    )
+    assert outputs.logits.shape[:2] == input_ids.shape
+
+utils.passed(__file__)
@@ -0,0 +1,119 @@
+import sys
+import os
+import tempfile
+
+import utils
+
+import torch
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+utils.start(__file__)
+
+from transformers import T5Config, T5ForConditionalGeneration
+from cpeft import AdapterRegistry, PromptTuningConfig, get_peft_model
+
+model_config = T5Config(
+    vocab_size=100,
+    d_model=32,
+    d_kv=8,
+    d_ff=64,
+    num_layers=2,
+    num_heads=4,
+    decoder_start_token_id=0,
+)
+
+
+def build(num_virtual_tokens):
+    cpeft_config = PromptTuningConfig(
+        task_type="seq_2_seq_lm",
+        num_virtual_tokens=num_virtual_tokens,
+        inference_mode=True,
+    )
+    return get_peft_model(T5ForConditionalGeneration(model_config), cpeft_config)
+
+
+model = build(10).eval()
+
+directory = tempfile.mkdtemp()
+for i in range(3):
+    build(10).save_pretrained(f"{directory}/adapter_{i}")
+
+# room for the active adapter and one more
+registry = AdapterRegistry(model, device="cpu", memory_budget=None, offload="disk")
+adapter_size = registry.stats()["resident_bytes"]
+registry.memory_budget = 2 * adapter_size
+for i in range(3):
+    registry.register(f"adapter_{i}", f"{directory}/adapter_{i}")
+
+input_ids = torch.randint(2, 100, (4, 7))
+attention_mask = torch.ones_like(input_ids)
+labels = torch.randint(2, 100, (4, 3))
+
+for adapter_name in ["adapter_0", "adapter_1", "adapter_0", "adapter_2"]:
+    registry.activate(adapter_name)
+    assert model.active_adapter == adapter_name
+    model(input_ids=input_ids, attention_mask=attention_mask, labels=labels)
+
+stats = registry.stats()
+assert stats["loads"] == 3 and stats["hits"] == 1, stats
+assert stats["resident_bytes"] <= 2 * adapter_size, stats
+# adapter_1 was dropped, the unregistered default adapter was offloaded to the cpu
+assert set(model.peft_config) == {"peft", "adapter_0", "adapter_2"}
+
+# mixed batch keeps all of its adapters resident
+registry.ensure(["adapter_1", "adapter_2"])
+model(
+    input_ids=input_ids,
+    attention_mask=attention_mask,
+    labels=labels,
+    adapter_names=["adapter_1", "adapter_2", "adapter_1", "adapter_2"],
+)
+assert registry.stats()["hits"] == 2
+
+# with room for one adapter the previous active adapter is evicted on a switch
+registry = AdapterRegistry(
+    build(10), device="cpu", memory_budget=adapter_size, offload="cpu"
+)
+for i in range(3):
+    registry.register(f"adapter_{i}", f"{directory}/adapter_{i}")
+
+
+def cached_storages(model):
+    tensors = [prompts for _, prompts in model._prompt_cache.values()]
+    for _, past_key_values, logits in model._prompt_states.values():
+        tensors += [logits] + [past for layer in past_key_values for past in layer]
+
+    return {tensor.untyped_storage().data_ptr() for tensor in tensors}
+
+
+for adapter_name in ["adapter_0", "adapter_1"]:
+    registry.activate(adapter_name)
+    assert list(registry.resident) == [adapter_name]
+    assert registry.stats()["resident_bytes"] <= adapter_size
+
+    with torch.no_grad():
+        registry.model(
+            input_ids=input_ids, attention_mask=attention_mask, labels=labels
+        )
+
+    weight = registry.model.prompt_encoder[adapter_name].embedding.weight
+    assert weight.untyped_storage().data_ptr() in cached_storages(registry.model)
+
+# the offloaded adapter_0 leaves no cached views of its weights behind
+weight = registry.model.prompt_encoder["adapter_0"].embedding.weight
+assert weight.untyped_storage().data_ptr() not in cached_storages(registry.model)
+assert all(key[0] != "adapter_0" for key in registry.model._prompt_cache)
+
+# adapters already in the model are placed within the budget as well
+model = build(10)
+for i in range(2):
+    model.load_adapter(f"{directory}/adapter_{i}", f"adapter_{i}")
+model.set_adapter("adapter_0")
+registry = AdapterRegistry(model, device="cpu", memory_budget=adapter_size)
+assert list(registry.resident) == ["adapter_0"]
+assert registry.stats()["evictions"] == 2
+
+utils.passed(__file__)
@@ -0,0 +1,104 @@
+import sys
+import os
+import tempfile
+
+import utils
+
+import torch
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+utils.start(__file__)
+
+from transformers import T5Config, T5ForConditionalGeneration
+from cpeft import AttemptConfig, PeftModel, PromptTuningConfig, get_peft_model
+from cpeft.save_and_load import load_peft_weights
+
+model_config = T5Config(
+    vocab_size=100,
+    d_model=32,
+    d_kv=8,
+    d_ff=64,
+    num_layers=2,
+    num_heads=4,
+    decoder_start_token_id=0,
+)
+cpeft_config = PromptTuningConfig(task_type="seq_2_seq_lm", num_virtual_tokens=10)
+
+model = get_peft_model(T5ForConditionalGeneration(model_config), cpeft_config)
+weight = model.get_prompt_embedding_to_save("peft")
+
+for safe_serialization, filename in [
+    (True, "adapter_model.safetensors"),
+    (False, "adapter_model.bin"),
+]:
+    directory = tempfile.mkdtemp()
+    model.save_pretrained(directory, safe_serialization=safe_serialization)
+    assert os.path.exists(os.path.join(directory, filename))
+
+    loaded = PeftModel.from_pretrained(
+        T5ForConditionalGeneration(model_config), directory
+    )
+    assert torch.equal(
+        loaded.prompt_encoder["peft"].embedding.weight.cpu(), weight
+    ), filename
+
+# attempt bundle with deduplicated source prompts loads without the prompt files
+directory = tempfile.mkdtemp()
+prompt_paths = []
+for i in range(2):
+    prompt_paths.append(os.path.join(directory, f"source_{i}.bin"))
+    torch.save(torch.randn(20, 32), prompt_paths[-1])
+
+cpeft_config = AttemptConfig(
+    task_type="seq_2_seq_lm",
+    num_virtual_tokens=10,
+    prompt_init="embedding",
+    prompt_init_embedding=prompt_paths[0],
+    prompt_embedding_paths=prompt_paths + prompt_paths[:1],
+    prefix_num=3,
+    save_source_prompts=True,
+    deduplicate_source_prompts=True,
+)
+model = get_peft_model(T5ForConditionalGeneration(model_config), cpeft_config)
+model.save_pretrained(os.path.join(directory, "attempt"))
+
+# by default the bundle only references the source prompts by their paths and sha256
+cpeft_config.save_source_prompts = False
+model.save_pretrained(os.path.join(directory, "reference"))
+assert "attention_module.mul_prefix_emb" not in load_peft_weights(
+    os.path.join(directory, "reference"), device="cpu"
+)
+
+reference = PeftModel.from_pretrained(
+    T5ForConditionalGeneration(model_config), os.path.join(directory, "reference")
+)
+assert torch.equal(
+    reference.attention_module["peft"].mul_prefix_emb,
+    model.attention_module["peft"].mul_prefix_emb,
+)
+
+# changed prompt files are not silently mixed into the loaded adapter
+torch.save(torch.randn(20, 32), prompt_paths[1])
+try:
+    PeftModel.from_pretrained(
+        T5ForConditionalGeneration(model_config), os.path.join(directory, "reference")
+    )
+    assert False, "Changed source prompts must fail to load."
+except ValueError as e:
+    assert prompt_paths[1] in str(e)
+
+for path in prompt_paths:
+    os.remove(path)
+
+loaded = PeftModel.from_pretrained(
+    T5ForConditionalGeneration(model_config), os.path.join(directory, "attempt")
+)
+assert torch.equal(
+    loaded.attention_module["peft"].mul_prefix_emb.cpu(),
+    model.attention_module["peft"].mul_prefix_emb.cpu(),
+)
+
+utils.passed(__file__)
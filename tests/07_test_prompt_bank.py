@@ -0,0 +1,52 @@
+import sys
+import os
+import tempfile
+
+import utils
+
+import torch
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+utils.start(__file__)
+
+from cpeft import prompt_bank
+from cpeft.prompt_bank import build_prompt_bank, load_prompt_bank, load_prompts
+
+directory = tempfile.mkdtemp()
+paths = []
+for i in range(4):
+    path = os.path.join(directory, f"task_{i}.bin")
+    prompt = torch.randn(20, 32)
+    # both formats of saved soft prompts
+    torch.save({"prompt_embeddings": prompt} if i % 2 == 0 else prompt, path)
+    paths.append(path)
+
+bank_path = os.path.join(directory, "prompts.pbank")
+build_prompt_bank(paths, bank_path)
+bank = load_prompt_bank(bank_path)
+
+assert len(bank) == 4
+assert load_prompt_bank(bank_path) is bank
+
+prompts = load_prompts(paths, bank_path)
+assert torch.equal(prompts, load_prompts(paths))
+
+# consecutive prompts are a view into the memory-mapped file
+storage = bank._buffer.untyped_storage().data_ptr()
+assert prompts.untyped_storage().data_ptr() == storage
+assert torch.equal(load_prompts(paths[::-1], bank_path), prompts.flip(0))
+
+# the caches are dropped by clear_cache and bounded
+assert len(prompt_bank._PROMPT_FILES) == 4
+prompt_bank.clear_cache()
+assert not prompt_bank._PROMPT_BANKS and not prompt_bank._PROMPT_FILES
+assert load_prompt_bank(bank_path) is not bank
+
+prompt_bank.MAX_PROMPT_FILES = 2
+assert torch.equal(load_prompts(paths), prompts)
+assert len(prompt_bank._PROMPT_FILES) == 2
+
+utils.passed(__file__)
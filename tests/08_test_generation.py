@@ -0,0 +1,143 @@
+import sys
+import os
+
+import utils
+
+import torch
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+utils.start(__file__)
+
+from transformers import T5Config, T5ForConditionalGeneration
+from transformers import BartConfig, BartForConditionalGeneration
+from transformers import LogitsProcessorList
+from cpeft import PromptTuningConfig, get_peft_model
+from cpeft.generation import (
+    VocabularyLogitsProcessor,
+    build_generation_config,
+    decode,
+    prepare_generation_config,
+)
+
+model_config = T5Config(
+    vocab_size=100,
+    d_model=32,
+    d_kv=8,
+    d_ff=64,
+    num_layers=2,
+    num_heads=4,
+    decoder_start_token_id=0,
+)
+cpeft_config = PromptTuningConfig(
+    task_type="seq_2_seq_lm", num_virtual_tokens=10, inference_mode=True
+)
+
+torch.manual_seed(0)
+model = get_peft_model(T5ForConditionalGeneration(model_config), cpeft_config)
+model.eval()
+
+input_ids = torch.randint(2, 100, (16, 9))
+attention_mask = torch.ones_like(input_ids)
+attention_mask[4:, -3:] = 0
+
+finished_early = 0
+for scale in [1.0, 2.0, 3.0, 4.0]:
+    # make EOS more likely, so rows finish at different steps
+    with torch.no_grad():
+        model.base_model.lm_head.weight[1] *= scale
+
+    for kwargs in [{"max_new_tokens": 8}, {"max_new_tokens": 4, "num_beams": 2}]:
+        preds = model.generate(
+            input_ids=input_ids, attention_mask=attention_mask, **kwargs
+        )
+
+        inputs_embeds, prompt_attention_mask = model.prepend_prompts(
+            model.word_embeddings(input_ids), attention_mask, None, None
+        )
+        expected = model.base_model.generate(
+            inputs_embeds=inputs_embeds, attention_mask=prompt_attention_mask, **kwargs
+        )
+
+        assert torch.equal(preds, expected), kwargs
+        finished_early += (preds == 1).sum().item()
+
+assert finished_early > 0
+
+# a restricted LM head gives the same tokens as masking the full vocabulary
+vocab_ids = torch.tensor([1, 5, 17, 42, 0])
+for kwargs in [{"max_new_tokens": 6}, {"max_new_tokens": 4, "num_beams": 2}]:
+    preds = model.generate(
+        input_ids=input_ids,
+        attention_mask=attention_mask,
+        vocab_ids=vocab_ids,
+        **kwargs,
+    )
+
+    inputs_embeds, prompt_attention_mask = model.prepend_prompts(
+        model.word_embeddings(input_ids), attention_mask, None, None
+    )
+    expected = model.base_model.generate(
+        inputs_embeds=inputs_embeds,
+        attention_mask=prompt_attention_mask,
+        logits_processor=LogitsProcessorList([VocabularyLogitsProcessor(vocab_ids)]),
+        **kwargs,
+    )
+
+    assert torch.equal(preds, expected), kwargs
+    assert torch.isin(preds, vocab_ids).all()
+
+# other models keep their own head (BART adds final_logits_bias, no T5 rescaling)
+bart = BartForConditionalGeneration(
+    BartConfig(
+        vocab_size=100,
+        d_model=32,
+        encoder_layers=1,
+        decoder_layers=1,
+        encoder_attention_heads=4,
+        decoder_attention_heads=4,
+        encoder_ffn_dim=64,
+        decoder_ffn_dim=64,
+        max_position_embeddings=64,
+        forced_eos_token_id=None,
+    )
+).eval()
+with torch.no_grad():
+    bart.final_logits_bias[0, 17] = 100.0
+    encoder_outputs = bart.get_encoder()(
+        input_ids=input_ids, attention_mask=attention_mask, return_dict=True
+    )
+    preds = decode(
+        bart, encoder_outputs, attention_mask, vocab_ids=vocab_ids, max_new_tokens=6
+    )
+    expected = bart.generate(
+        input_ids=input_ids,
+        attention_mask=attention_mask,
+        logits_processor=LogitsProcessorList([VocabularyLogitsProcessor(vocab_ids)]),
+        max_new_tokens=6,
+    )
+
+assert torch.equal(preds, expected)
+assert (preds[:, 1:] == 17).all()
+
+# a generation config built once is used as is
+generation_config = build_generation_config(model, max_new_tokens=6)
+assert prepare_generation_config(model, {"generation_config": generation_config}) == (
+    generation_config,
+    {},
+    True,
+)
+assert torch.equal(
+    model.generate(
+        input_ids=input_ids,
+        attention_mask=attention_mask,
+        generation_config=generation_config,
+    ),
+    model.generate(
+        input_ids=input_ids, attention_mask=attention_mask, max_new_tokens=6
+    ),
+)
+
+utils.passed(__file__)
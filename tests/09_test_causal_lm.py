@@ -0,0 +1,112 @@
+import sys
+import os
+
+import utils
+
+import torch
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+utils.start(__file__)
+
+from transformers import GPT2Config, GPT2LMHeadModel
+from cpeft import PeftModelForCausalLM, PromptTuningConfig, get_peft_model
+from trainer import Trainer
+
+model_config = GPT2Config(
+    vocab_size=100, n_embd=32, n_layer=2, n_head=4, n_positions=64, eos_token_id=1
+)
+cpeft_config = PromptTuningConfig(
+    task_type="causal_lm", num_virtual_tokens=10, inference_mode=True
+)
+
+torch.manual_seed(0)
+base_model = GPT2LMHeadModel(model_config)
+model = get_peft_model(base_model, cpeft_config)
+model.eval()
+
+assert isinstance(model, PeftModelForCausalLM)
+assert model.peft_config["peft"].token_dim == 32
+
+input_ids = torch.randint(2, 100, (4, 9))
+attention_mask = torch.ones_like(input_ids)
+attention_mask[0, -3:] = 0
+labels = input_ids.masked_fill(attention_mask == 0, -100)
+
+# cached prompt keys and values give the same outputs as the prepended prompt
+with torch.no_grad():
+    assert model.use_prompt_states()
+    cached = model(input_ids=input_ids, attention_mask=attention_mask, labels=labels)
+
+prepended = model(input_ids=input_ids, attention_mask=attention_mask, labels=labels)
+
+assert torch.allclose(cached.logits, prepended.logits, atol=1e-5)
+assert torch.allclose(cached.loss, prepended.loss, atol=1e-5)
+
+# left padded greedy generation matches the HF generate over prompted embeddings
+input_ids[0, :3] = 1
+attention_mask = torch.ones_like(input_ids)
+attention_mask[0, :3] = 0
+
+with torch.no_grad():
+    base_model.lm_head.weight[1] *= 4
+    preds = model.generate(
+        input_ids=input_ids, attention_mask=attention_mask, max_new_tokens=8
+    )
+
+    inputs_embeds, prompt_attention_mask = model.prepend_prompts(
+        model.word_embeddings(input_ids), attention_mask
+    )
+    expected = base_model.generate(
+        input_ids=input_ids,
+        inputs_embeds=inputs_embeds,
+        attention_mask=prompt_attention_mask,
+        max_new_tokens=8,
+        pad_token_id=1,
+    )
+
+assert torch.equal(preds, expected)
+
+# the trainer evaluates a causal LM through forward and generate
+trainer = Trainer(
+    model,
+    {"device": "cpu", "max_train_samples": 0},
+    (None, {}, {}),
+    None,
+    None,
+    None,
+    wandb=False,
+)
+trainer.max_new_tokens["task"] = 8
+labels = input_ids.masked_fill(attention_mask == 0, -100)
+
+loss, preds = trainer.eval_step(
+    model,
+    {"input_ids": input_ids, "attention_mask": attention_mask, "labels": labels},
+    "task",
+)
+
+with torch.no_grad():
+    expected_loss = model(
+        input_ids=input_ids, attention_mask=attention_mask, labels=labels
+    ).loss
+
+assert torch.allclose(loss, expected_loss)
+assert torch.equal(preds, expected)
+
+# rank classification scores labels with the encoder-decoder only
+trainer.config["eval_mode"] = "rank_classification"
+trainer.label_token_ids["task"] = torch.tensor([[3, 1], [4, 1]])
+try:
+    trainer.eval_step(
+        model,
+        {"input_ids": input_ids, "attention_mask": attention_mask, "labels": labels},
+        "task",
+    )
+    assert False, "Rank classification of a causal LM must fail."
+except ValueError as e:
+    assert "seq_2_seq_lm" in str(e)
+
+utils.passed(__file__)
@@ -0,0 +1,124 @@
+import sys
+import os
+import tempfile
+
+import utils
+
+import torch
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+utils.start(__file__)
+
+from transformers import T5Config, T5ForConditionalGeneration
+from cpeft import AttemptConfig, PeftModel, PrefixTuningConfig, get_peft_model
+
+model_config = T5Config(
+    vocab_size=100,
+    d_model=32,
+    d_kv=8,
+    d_ff=64,
+    num_layers=2,
+    num_heads=4,
+    decoder_start_token_id=0,
+)
+cpeft_config = PrefixTuningConfig(task_type="seq_2_seq_lm", num_virtual_tokens=5)
+
+torch.manual_seed(0)
+base_model = T5ForConditionalGeneration(model_config)
+model = get_peft_model(base_model, cpeft_config)
+
+# keys and values of both encoder layers
+assert model.prompt_encoder["peft"].embedding.weight.shape == (5 * 2 * 2, 32)
+
+input_ids = torch.randint(2, 100, (3, 7))
+attention_mask = torch.ones_like(input_ids)
+attention_mask[0, -2:] = 0
+labels = torch.randint(2, 100, (3, 4))
+
+# the prefix does not lengthen the encoder inputs
+outputs = model(input_ids=input_ids, attention_mask=attention_mask, labels=labels)
+assert outputs.encoder_last_hidden_state.shape[:2] == input_ids.shape
+
+# the prefix and its graph are not kept after the forward pass
+assert model.prefix_hooks.key_values is None
+
+outputs.loss.backward()
+assert model.prompt_encoder["peft"].embedding.weight.grad.abs().sum() > 0
+
+# without the prefix the outputs differ
+with torch.no_grad():
+    plain = base_model(
+        input_ids=input_ids, attention_mask=attention_mask, labels=labels
+    )
+    assert not torch.allclose(plain.logits, outputs.logits)
+
+model.eval()
+with torch.no_grad():
+    preds = model.generate(
+        input_ids=input_ids, attention_mask=attention_mask, max_new_tokens=5
+    )
+    assert model.prefix_hooks.key_values is None
+
+# saved prefix loads into a new model with the same outputs
+with tempfile.TemporaryDirectory() as tmp:
+    model.save_pretrained(tmp)
+
+    torch.manual_seed(0)
+    loaded = PeftModel.from_pretrained(T5ForConditionalGeneration(model_config), tmp)
+    loaded.eval()
+
+    with torch.no_grad():
+        loaded_preds = loaded.generate(
+            input_ids=input_ids, attention_mask=attention_mask, max_new_tokens=5
+        )
+        assert torch.equal(preds, loaded_preds)
+
+        expected = model(
+            input_ids=input_ids, attention_mask=attention_mask, labels=labels
+        )
+        actual = loaded(
+            input_ids=input_ids, attention_mask=attention_mask, labels=labels
+        )
+        assert torch.allclose(expected.logits, actual.logits, atol=1e-5)
+
+# prefixes mixed from source prefixes
+with tempfile.TemporaryDirectory() as tmp:
+    paths = []
+    for i in range(2):
+        paths.append(os.path.join(tmp, f"prefix_{i}.bin"))
+        torch.save({"prompt_embeddings": torch.randn(20, 32)}, paths[-1])
+
+    cpeft_config = PrefixTuningConfig(
+        task_type="seq_2_seq_lm",
+        num_virtual_tokens=5,
+        prompt_embedding_paths=paths,
+        prompt_init="embedding",
+        prompt_init_embedding=paths[0],
+    )
+    model = get_peft_model(T5ForConditionalGeneration(model_config), cpeft_config)
+    assert model.peft_config["peft"].mixes_source_prompts
+    assert not isinstance(cpeft_config, AttemptConfig)
+
+    # source prefixes hold the keys and values of all layers, 5 * 2 * 2 tokens
+    assert model.attention_module["peft"].mul_prefix_emb.shape == (2, 20, 32)
+    try:
+        get_peft_model(
+            T5ForConditionalGeneration(model_config),
+            PrefixTuningConfig(
+                task_type="seq_2_seq_lm",
+                num_virtual_tokens=6,
+                prompt_embedding_paths=paths,
+            ),
+        )
+        assert False, "Too short source prefixes must fail."
+    except ValueError as e:
+        assert "24 are mixed" in str(e)
+
+    outputs = model(input_ids=input_ids, attention_mask=attention_mask, labels=labels)
+    assert outputs.encoder_last_hidden_state.shape[:2] == input_ids.shape
+    outputs.loss.backward()
+
+utils.passed(__file__)
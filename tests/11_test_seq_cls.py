@@ -0,0 +1,121 @@
+import sys
+import os
+import tempfile
+
+import utils
+
+import torch
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+utils.start(__file__)
+
+from transformers import T5Config, T5ForConditionalGeneration
+from cpeft import (
+    AttemptConfig,
+    PeftModel,
+    PeftModelForSequenceClassification,
+    PromptTuningConfig,
+    get_peft_model,
+)
+
+model_config = T5Config(
+    vocab_size=100,
+    d_model=32,
+    d_kv=8,
+    d_ff=64,
+    num_layers=2,
+    num_heads=4,
+    decoder_start_token_id=0,
+)
+
+# two tasks, labels "0" / "1" are shared and the second task has a third label
+label_token_ids = [[[3, 10, 1], [11, 1]], [[3, 10, 1], [11, 1], [12, 13, 1]]]
+cpeft_config = PromptTuningConfig(
+    task_type="seq_cls", num_virtual_tokens=5, label_token_ids=label_token_ids
+)
+
+torch.manual_seed(0)
+base_model = T5ForConditionalGeneration(model_config)
+model = get_peft_model(base_model, cpeft_config)
+assert isinstance(model, PeftModelForSequenceClassification)
+
+input_ids = torch.randint(2, 100, (3, 7))
+attention_mask = torch.ones_like(input_ids)
+attention_mask[0, -2:] = 0
+labels = torch.tensor([[11, 1, -100], [12, 13, 1], [3, 10, 1]])
+task_ids = torch.tensor([0, 1, 1])
+
+outputs = model(
+    input_ids=input_ids, attention_mask=attention_mask, labels=labels, task_ids=task_ids
+)
+assert outputs.logits.shape == (3, 3)
+assert torch.isclose(
+    outputs.loss,
+    torch.nn.functional.cross_entropy(outputs.logits, torch.tensor([1, 2, 0])),
+)
+
+outputs.loss.backward()
+assert model.prompt_encoder["peft"].embedding.weight.grad is not None
+assert model.classification_head["peft"].dense.weight.grad is not None
+
+# the decoder is not run
+for param in base_model.decoder.parameters():
+    assert param.grad is None
+
+# predictions are the tokenized labels, the first task never predicts its third class
+model.eval()
+with torch.no_grad():
+    model.classification_head["peft"].dense.bias[2] = 100
+    preds = model.generate(
+        input_ids=input_ids, attention_mask=attention_mask, task_ids=task_ids
+    )
+
+assert preds.shape == (3, 4)
+assert torch.equal(preds[1:], torch.tensor([[0, 12, 13, 1]] * 2))
+assert preds[0, 1:].tolist() in [[3, 10, 1], [11, 1, 0]]
+
+# the head is saved with the prompt
+with tempfile.TemporaryDirectory() as tmp:
+    model.save_pretrained(tmp)
+
+    loaded = PeftModel.from_pretrained(T5ForConditionalGeneration(model_config), tmp)
+    assert isinstance(loaded, PeftModelForSequenceClassification)
+
+    loaded.base_model.load_state_dict(base_model.state_dict())
+    with torch.no_grad():
+        loaded_preds = loaded.generate(
+            input_ids=input_ids, attention_mask=attention_mask, task_ids=task_ids
+        )
+
+    assert torch.equal(preds, loaded_preds)
+
+# the pooled output includes the ATTEMPT instance prompt
+with tempfile.TemporaryDirectory() as tmp:
+    paths = []
+    for i in range(2):
+        paths.append(os.path.join(tmp, f"prompt_{i}.bin"))
+        torch.save({"prompt_embeddings": torch.randn(5, 32)}, paths[-1])
+
+    cpeft_config = AttemptConfig(
+        task_type="seq_cls",
+        num_virtual_tokens=5,
+        prompt_init="embedding",
+        prompt_init_embedding=paths[0],
+        prompt_embedding_paths=paths,
+        prefix_num=2,
+        label_token_ids=label_token_ids[:1],
+    )
+    model = get_peft_model(T5ForConditionalGeneration(model_config), cpeft_config)
+
+    outputs = model(
+        input_ids=input_ids,
+        attention_mask=attention_mask,
+        labels=labels[:1].expand(3, -1),
+    )
+    outputs.loss.backward()
+    assert model.attention_module["peft"].attn_W_down.weight.grad is not None
+
+utils.passed(__file__)
@@ -0,0 +1,59 @@
+import sys
+import os
+
+import utils
+
+import torch
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+utils.start(__file__)
+
+from transformers import T5Config, T5ForConditionalGeneration
+from cpeft import PromptTuningConfig, get_peft_model
+
+model_config = T5Config(
+    vocab_size=100,
+    d_model=32,
+    d_kv=8,
+    d_ff=64,
+    num_layers=2,
+    num_heads=4,
+    decoder_start_token_id=0,
+)
+cpeft_config = PromptTuningConfig(task_type="seq_2_seq_lm", num_virtual_tokens=5)
+
+torch.manual_seed(0)
+model = get_peft_model(T5ForConditionalGeneration(model_config), cpeft_config)
+model.eval()
+
+input_ids = torch.randint(2, 100, (4, 7))
+attention_mask = torch.ones_like(input_ids)
+attention_mask[0, -2:] = 0
+
+label_token_ids = torch.tensor([[3, 10, 1], [11, 1, -100], [12, 13, 1]])
+
+with torch.no_grad():
+    preds = model.rank_classify(
+        label_token_ids, input_ids=input_ids, attention_mask=attention_mask
+    )
+
+    # summed label log-likelihood of every candidate, one forward per label
+    scores = []
+    for labels in label_token_ids:
+        labels = labels.repeat(4, 1)
+        logits = model(
+            input_ids=input_ids, attention_mask=attention_mask, labels=labels
+        ).logits
+        log_probs = logits.log_softmax(dim=-1)
+        log_probs = log_probs.gather(-1, labels.clamp(min=0).unsqueeze(-1))
+        scores.append(log_probs.squeeze(-1).masked_fill(labels == -100, 0).sum(-1))
+
+expected = label_token_ids[torch.stack(scores, dim=1).argmax(dim=1)]
+expected = torch.cat((torch.zeros(4, 1, dtype=torch.long), expected), dim=1)
+
+assert torch.equal(preds, expected.masked_fill(expected == -100, 0))
+
+utils.passed(__file__)
@@ -0,0 +1,73 @@
+import sys
+import os
+
+import utils
+
+import torch
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+utils.start(__file__)
+
+from transformers import T5Config, T5ForConditionalGeneration
+from cpeft import PromptTuningConfig, get_peft_model
+from cpeft.generation import LabelTrie
+
+model_config = T5Config(
+    vocab_size=100,
+    d_model=32,
+    d_kv=8,
+    d_ff=64,
+    num_layers=2,
+    num_heads=4,
+    decoder_start_token_id=0,
+)
+cpeft_config = PromptTuningConfig(
+    task_type="seq_2_seq_lm", num_virtual_tokens=10, inference_mode=True
+)
+
+torch.manual_seed(0)
+model = get_peft_model(T5ForConditionalGeneration(model_config), cpeft_config)
+model.eval()
+
+input_ids = torch.randint(2, 100, (16, 9))
+attention_mask = torch.ones_like(input_ids)
+attention_mask[4:, -3:] = 0
+
+label_token_ids = torch.tensor([[3, 10, 1], [3, 11, 1], [11, 1, -100], [12, 13, 1]])
+labels = [[0] + [t for t in label if t != -100] for label in label_token_ids.tolist()]
+label_trie = LabelTrie(label_token_ids)
+
+inputs_embeds, prompt_attention_mask = model.prepend_prompts(
+    model.word_embeddings(input_ids), attention_mask, None, None
+)
+
+for kwargs in [
+    {"max_new_tokens": 8},
+    {"max_new_tokens": 8, "vocab_ids": torch.tensor([0, 1, 3, 10, 11, 12, 13])},
+    {"max_new_tokens": 8, "num_beams": 2},
+]:
+    preds = model.generate(
+        input_ids=input_ids,
+        attention_mask=attention_mask,
+        label_trie=label_trie,
+        **kwargs,
+    )
+
+    kwargs.pop("vocab_ids", None)
+    expected = model.base_model.generate(
+        inputs_embeds=inputs_embeds,
+        attention_mask=prompt_attention_mask,
+        prefix_allowed_tokens_fn=label_trie.allowed_tokens,
+        **kwargs,
+    )
+
+    # every row is a complete label, decoding stops after the longest one
+    assert torch.equal(preds, expected), kwargs
+    assert preds.shape[1] <= 4
+    for pred in preds.tolist():
+        assert pred[: len(pred) - pred[::-1].index(1)] in labels
+
+utils.passed(__file__)
@@ -0,0 +1,88 @@
+import sys
+import os
+import tempfile
+
+import utils
+
+import torch
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+utils.start(__file__)
+
+from transformers import T5Config, T5ForConditionalGeneration
+from cpeft import AttemptConfig, get_peft_model
+
+model_config = T5Config(
+    vocab_size=100,
+    d_model=32,
+    d_kv=8,
+    d_ff=64,
+    num_layers=2,
+    num_heads=4,
+    decoder_start_token_id=0,
+)
+
+with tempfile.TemporaryDirectory() as tmp:
+    paths = []
+    for i in range(3):
+        paths.append(os.path.join(tmp, f"prompt_{i}.bin"))
+        torch.save({"prompt_embeddings": torch.randn(10, 32)}, paths[-1])
+
+    cpeft_config = AttemptConfig(
+        task_type="seq_2_seq_lm",
+        num_virtual_tokens=5,
+        prompt_init="embedding",
+        prompt_init_embedding=paths[0],
+        prompt_embedding_paths=paths,
+        prefix_num=3,
+    )
+
+    torch.manual_seed(0)
+    model = get_peft_model(T5ForConditionalGeneration(model_config), cpeft_config)
+    model.eval()
+
+encoder_calls = []
+model.base_model.get_encoder().register_forward_hook(
+    lambda *args: encoder_calls.append(1)
+)
+
+input_ids = torch.randint(2, 100, (6, 9))
+attention_mask = torch.ones_like(input_ids)
+attention_mask[2:, -3:] = 0
+labels = torch.randint(2, 100, (6, 3))
+label_token_ids = torch.tensor([[3, 10, 1], [11, 1, -100]])
+
+with torch.no_grad():
+    loss = model(input_ids=input_ids, attention_mask=attention_mask, labels=labels).loss
+    preds = model.generate(
+        input_ids=input_ids, attention_mask=attention_mask, max_new_tokens=5
+    )
+    rank_preds = model.rank_classify(
+        label_token_ids, input_ids=input_ids, attention_mask=attention_mask
+    )
+
+    encoder_calls.clear()
+    fused_loss, fused_preds = model.eval_step(
+        input_ids=input_ids,
+        attention_mask=attention_mask,
+        labels=labels,
+        max_new_tokens=5,
+    )
+    assert len(encoder_calls) == 1
+
+    fused_rank_loss, fused_rank_preds = model.eval_step(
+        input_ids=input_ids,
+        attention_mask=attention_mask,
+        labels=labels,
+        label_token_ids=label_token_ids,
+    )
+
+assert torch.allclose(loss, fused_loss, atol=1e-6)
+assert torch.allclose(loss, fused_rank_loss, atol=1e-6)
+assert torch.equal(preds, fused_preds)
+assert torch.equal(rank_preds, fused_rank_preds)
+
+utils.passed(__file__)
@@ -0,0 +1,89 @@
+import sys
+import os
+
+import utils
+
+import torch
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+utils.start(__file__)
+
+from transformers import T5Config, T5ForConditionalGeneration
+from cpeft import PromptTuningConfig, get_peft_model
+from trainer import Trainer
+from trainer.utils import split_batch
+
+model_config = T5Config(
+    vocab_size=100,
+    d_model=32,
+    d_kv=8,
+    d_ff=64,
+    num_layers=2,
+    num_heads=4,
+    decoder_start_token_id=0,
+    dropout_rate=0.0,
+)
+
+torch.manual_seed(0)
+input_ids = torch.randint(2, 100, (8, 12))
+attention_mask = torch.ones_like(input_ids)
+labels = torch.randint(2, 100, (8, 4))
+for row, length in enumerate([12, 3, 7, 12, 5, 2, 9, 4]):
+    attention_mask[row, length:] = 0
+    input_ids[row, length:] = 0
+    labels[row, 1 + row % 3 :] = -100
+
+batch = {
+    "input_ids": input_ids,
+    "attention_mask": attention_mask,
+    "labels": labels,
+    "extra_fields": [{} for _ in range(8)],
+}
+
+micro_batches = split_batch(batch, max_micro_batch_tokens=24)
+assert sum(len(b["input_ids"]) for b in micro_batches) == 8
+assert all(
+    b["input_ids"].numel() <= 24 or len(b["input_ids"]) == 1 for b in micro_batches
+)
+assert [len(b["extra_fields"]) for b in micro_batches] == [
+    len(b["input_ids"]) for b in micro_batches
+]
+
+
+def train_step(**config):
+    torch.manual_seed(0)
+    model = get_peft_model(
+        T5ForConditionalGeneration(model_config),
+        PromptTuningConfig(task_type="seq_2_seq_lm", num_virtual_tokens=5),
+    )
+    optimizer = torch.optim.SGD(model.parameters(), lr=1.0)
+
+    config.update(
+        {
+            "device": "cpu",
+            "task_type": "seq_2_seq_lm",
+            "max_train_samples": 8,
+            "warmup_steps": 0,
+            "num_epochs": 1,
+        }
+    )
+    trainer = Trainer(
+        model, config, ([batch], {}, {}), optimizer, None, None, wandb=False
+    )
+    metrics = trainer.train()
+
+    return metrics["train_loss"], model.prompt_encoder["peft"].embedding.weight
+
+
+loss, weight = train_step()
+for config in [{"micro_batch_size": 3}, {"max_micro_batch_tokens": 24}]:
+    micro_loss, micro_weight = train_step(**config)
+
+    # the same loss and the same update as the whole batch
+    assert torch.allclose(loss, micro_loss, atol=1e-5), config
+    assert torch.allclose(weight, micro_weight, atol=1e-5), config
+
+utils.passed(__file__)
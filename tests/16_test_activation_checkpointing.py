@@ -0,0 +1,69 @@
+import sys
+import os
+
+import utils
+
+import torch
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+utils.start(__file__)
+
+from transformers import T5Config, T5ForConditionalGeneration
+from cpeft import PrefixTuningConfig, PromptTuningConfig, get_peft_model
+
+model_config = T5Config(
+    vocab_size=100,
+    d_model=32,
+    d_kv=8,
+    d_ff=64,
+    num_layers=3,
+    num_heads=4,
+    decoder_start_token_id=0,
+)
+
+input_ids = torch.randint(2, 100, (4, 9))
+attention_mask = torch.ones_like(input_ids)
+attention_mask[0, -3:] = 0
+labels = torch.randint(2, 100, (4, 3))
+
+
+def gradient(model):
+    # dropout is on, checkpointed blocks recompute with the same masks
+    torch.manual_seed(1)
+    model.train()
+    loss = model(input_ids=input_ids, attention_mask=attention_mask, labels=labels).loss
+    loss.backward()
+
+    weight = model.prompt_encoder["peft"].embedding.weight
+    grad, weight.grad = weight.grad, None
+    return loss.detach(), grad
+
+
+for config_class in [PromptTuningConfig, PrefixTuningConfig]:
+    torch.manual_seed(0)
+    model = get_peft_model(
+        T5ForConditionalGeneration(model_config),
+        config_class(task_type="seq_2_seq_lm", num_virtual_tokens=5),
+    )
+    loss, grad = gradient(model)
+
+    for stacks, every in [("all", 1), ("encoder", 1), ("decoder", 2)]:
+        model.enable_activation_checkpointing(stacks, every)
+        checkpointed_loss, checkpointed_grad = gradient(model)
+
+        assert torch.allclose(loss, checkpointed_loss), (config_class, stacks)
+        assert torch.allclose(grad, checkpointed_grad, atol=1e-6), (
+            config_class,
+            stacks,
+        )
+
+    blocks = list(model.base_model.encoder.block) + list(model.base_model.decoder.block)
+    assert all("forward" in block.__dict__ for block in blocks[3::2])
+
+    model.disable_activation_checkpointing()
+    assert not any("forward" in block.__dict__ for block in blocks)
+
+utils.passed(__file__)
@@ -0,0 +1,121 @@
+import sys
+import os
+
+import utils
+
+import torch
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+utils.start(__file__)
+
+from transformers import T5Config, T5ForConditionalGeneration
+from cpeft import PrefixTuningConfig, PromptTuningConfig, get_peft_model
+from trainer import Trainer
+
+model_config = T5Config(
+    vocab_size=100,
+    d_model=32,
+    d_kv=8,
+    d_ff=64,
+    num_layers=2,
+    num_heads=4,
+    decoder_start_token_id=0,
+    dropout_rate=0.0,
+)
+
+torch.manual_seed(0)
+input_ids = torch.randint(2, 100, (4, 10))
+attention_mask = torch.ones_like(input_ids)
+attention_mask[1, 6:] = 0
+labels = torch.randint(2, 100, (4, 3))
+
+batch = {
+    "input_ids": input_ids,
+    "attention_mask": attention_mask,
+    "labels": labels,
+    "extra_fields": [{} for _ in range(4)],
+}
+
+
+def run(config_class, precision):
+    torch.manual_seed(0)
+    model = get_peft_model(
+        T5ForConditionalGeneration(model_config),
+        config_class(task_type="seq_2_seq_lm", num_virtual_tokens=5),
+    )
+    optimizer = torch.optim.AdamW(
+        [p for p in model.parameters() if p.requires_grad], lr=1e-2
+    )
+    config = {
+        "device": "cpu",
+        "task_type": "seq_2_seq_lm",
+        "max_train_samples": 4,
+        "warmup_steps": 0,
+        "num_epochs": 1,
+        "max_target_length": 3,
+        "precision": precision,
+    }
+    trainer = Trainer(
+        model, config, ([batch], {}, {}), optimizer, None, None, wandb=False
+    )
+    train_loss = trainer.train()["train_loss"]
+
+    model.eval()
+    with torch.no_grad(), trainer.autocast():
+        logits = model(**{k: batch[k] for k in ["input_ids", "labels"]}).logits
+        eval_loss, _ = model.eval_step(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            labels=labels,
+            max_new_tokens=3,
+        )
+
+    weight = model.prompt_encoder["peft"].embedding.weight
+    state = optimizer.state[weight]
+
+    # the trainable parameters and the optimizer state stay fp32
+    assert weight.dtype == torch.float32
+    assert state["exp_avg"].dtype == state["exp_avg_sq"].dtype == torch.float32
+
+    return train_loss, eval_loss.float(), weight.detach(), logits.dtype
+
+
+for config_class in [PromptTuningConfig, PrefixTuningConfig]:
+    train_loss, eval_loss, weight, dtype = run(config_class, "fp32")
+    bf16_train_loss, bf16_eval_loss, bf16_weight, bf16_dtype = run(config_class, "bf16")
+
+    # the backbone ran in bf16, the losses agree with fp32
+    assert dtype == torch.float32 and bf16_dtype == torch.bfloat16
+    assert torch.allclose(train_loss, bf16_train_loss, rtol=2e-2), config_class
+    assert torch.allclose(eval_loss, bf16_eval_loss, rtol=2e-2), config_class
+    assert torch.allclose(weight, bf16_weight, atol=2e-2), config_class
+
+# prompts are computed in fp32 also under autocast
+model = get_peft_model(
+    T5ForConditionalGeneration(model_config),
+    PromptTuningConfig(task_type="seq_2_seq_lm", num_virtual_tokens=5),
+)
+with torch.autocast("cpu", dtype=torch.bfloat16):
+    inputs_embeds, _ = model.prepend_prompts(
+        model.word_embeddings(input_ids), attention_mask
+    )
+assert inputs_embeds.dtype == torch.float32
+
+try:
+    Trainer(
+        model,
+        {"device": "cpu", "precision": "fp8", "max_train_samples": 0},
+        ([], {}, {}),
+        None,
+        None,
+        None,
+        wandb=False,
+    ).autocast()
+    assert False
+except ValueError:
+    pass
+
+utils.passed(__file__)
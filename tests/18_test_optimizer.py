@@ -0,0 +1,145 @@
+import sys
+import os
+import tempfile
+
+import utils
+
+import torch
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+utils.start(__file__)
+
+from transformers import T5Config, T5ForConditionalGeneration
+from cpeft import AttemptConfig, get_peft_model
+from cpeft.prompt_tuning import PackedPromptEmbedding
+from trainer import Trainer
+from trainer.optim import LazyAdamW, build_optimizer, get_trainable_parameters
+
+
+def run(optimizer_class, rows_per_step, sparse, **kwargs):
+    torch.manual_seed(0)
+    param = torch.nn.Parameter(torch.randn(6, 3, 4))
+    optimizer = optimizer_class([param], lr=1e-2, weight_decay=0.1, **kwargs)
+
+    for rows in rows_per_step:
+        grad = torch.zeros_like(param)
+        grad[rows] = torch.randn(len(rows), 3, 4)
+        param.grad = grad.to_sparse(1) if sparse else grad
+        optimizer.step()
+
+    return param.detach()
+
+
+# with all rows in every step the same as AdamW
+all_rows = [list(range(6))] * 3
+adamw = run(torch.optim.AdamW, all_rows, False, foreach=False)
+assert torch.allclose(adamw, run(LazyAdamW, all_rows, False), atol=1e-6)
+assert torch.allclose(adamw, run(LazyAdamW, all_rows, True), atol=1e-6)
+
+# rows without gradient are not touched, the others see AdamW over their own steps
+torch.manual_seed(0)
+initial = torch.randn(6, 3, 4)
+lazy = run(LazyAdamW, [[0, 2], [2], [0, 2]], True)
+assert torch.equal(lazy[[1, 3, 4, 5]], initial[[1, 3, 4, 5]])
+assert not torch.equal(lazy[0], initial[0])
+
+param = torch.nn.Parameter(initial[2].clone())
+optimizer = torch.optim.AdamW([param], lr=1e-2, weight_decay=0.1, foreach=False)
+torch.manual_seed(0)
+torch.randn(6, 3, 4)
+for rows in [[0, 2], [2], [0, 2]]:
+    grads = torch.randn(len(rows), 3, 4)
+    param.grad = grads[rows.index(2)]
+    optimizer.step()
+assert torch.allclose(lazy[2], param.detach(), atol=1e-6)
+
+# sparse packed prompts give the same prompts and gradients
+embedding = PackedPromptEmbedding(5, 4, 3)
+indices, task_ids = torch.arange(4), torch.tensor([3, 1, 3])
+embedding(indices, task_ids).pow(2).sum().backward()
+dense_grad, embedding.weight.grad = embedding.weight.grad, None
+embedding.sparse = True
+prompts = embedding(indices, task_ids)
+prompts.pow(2).sum().backward()
+assert embedding.weight.grad.is_sparse
+assert torch.equal(prompts, embedding.weight[task_ids])
+assert torch.allclose(embedding.weight.grad.to_dense(), dense_grad)
+
+# a multi-target bank trained with the lazy optimizer updates only its batch targets
+model_config = T5Config(
+    vocab_size=100,
+    d_model=32,
+    d_kv=8,
+    d_ff=64,
+    num_layers=2,
+    num_heads=4,
+    decoder_start_token_id=0,
+)
+
+with tempfile.TemporaryDirectory() as tmp:
+    path = os.path.join(tmp, "prompt.bin")
+    torch.save(torch.randn(10, 32), path)
+    cpeft_config = AttemptConfig(
+        task_type="seq_2_seq_lm",
+        num_virtual_tokens=5,
+        prompt_init="embedding_multi",
+        prompt_init_embedding=path,
+        prompt_embedding_paths=[path, path],
+        prefix_num=2,
+        n_targets=4,
+    )
+    model = get_peft_model(T5ForConditionalGeneration(model_config), cpeft_config)
+
+config = {
+    "device": "cpu",
+    "task_type": "seq_2_seq_lm",
+    "max_train_samples": 4,
+    "warmup_steps": 0,
+    "num_epochs": 1,
+    "learning_rate": 1e-2,
+}
+
+batch = {
+    "input_ids": torch.randint(2, 100, (4, 8)),
+    "attention_mask": torch.ones(4, 8, dtype=torch.long),
+    "labels": torch.randint(2, 100, (4, 3)),
+    "task_ids": torch.tensor([0, 2, 2, 0]),
+    "extra_fields": [{} for _ in range(4)],
+}
+
+optimizer = build_optimizer(model, config)
+assert isinstance(optimizer, torch.optim.AdamW)
+assert optimizer.param_groups[0]["params"] == get_trainable_parameters(model)
+assert len(optimizer.param_groups[0]["params"]) < 20
+
+# the fused kernel is requested for cuda parameters only, cpu falls back to foreach
+optimizer = build_optimizer(model, dict(config, fused_optimizer=True))
+assert not optimizer.defaults["fused"] and optimizer.defaults["foreach"]
+model(**{k: v for k, v in batch.items() if k != "extra_fields"}).loss.backward()
+optimizer.step()
+optimizer.zero_grad()
+
+optimizer = build_optimizer(model, dict(config, optimizer="lazy_adamw"))
+assert isinstance(optimizer, LazyAdamW)
+assert model.prompt_encoder["peft"].embedding.sparse
+
+weight = model.prompt_encoder["peft"].embedding.weight
+initial = weight.detach().clone()
+
+trainer = Trainer(model, config, ([batch], {}, {}), optimizer, None, None, wandb=False)
+trainer.train()
+
+assert torch.equal(weight[[1, 3]], initial[[1, 3]])
+assert not torch.equal(weight[0], initial[0])
+assert not torch.equal(weight[2], initial[2])
+
+try:
+    build_optimizer(model, dict(config, optimizer="sgd"))
+    assert False
+except ValueError:
+    pass
+
+utils.passed(__file__)
@@ -0,0 +1,207 @@
+import sys
+import os
+import tempfile
+import multiprocessing
+import importlib.util
+
+import utils
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+utils.start(__file__)
+
+import datasets
+
+tasks = utils.import_tasks()
+from tasks import tasks as task_module
+from tasks.cache import (
+    DatasetCache,
+    code_version,
+    get_dataset,
+    get_dataset_cache,
+    get_or_build_split,
+    task_code_version,
+)
+
+
+def build(n=100):
+    return datasets.Dataset.from_dict(
+        {
+            "input_ids": [[i, i + 1, 1] for i in range(n)],
+            "labels": [[i] for i in range(n)],
+        }
+    )
+
+
+def write(cache_dir, key):
+    DatasetCache(cache_dir).save(key, build())
+
+
+with tempfile.TemporaryDirectory() as tmp:
+    cache = DatasetCache(tmp)
+    key = {"task": "sst2", "split": "train", "n_obs": 100, "seed": 42}
+
+    calls = []
+    dataset = cache.get_or_build(key, lambda: calls.append(1) or build())
+    assert calls == [1]
+
+    # a hit loads the memory-mapped entry without building
+    cached = cache.get_or_build(key, lambda: calls.append(1) or build())
+    assert calls == [1]
+    assert cached.cache_files and cached.cache_files[0]["filename"].startswith(tmp)
+    assert cached["input_ids"] == build()["input_ids"] == dataset["input_ids"]
+
+    # any part of the key makes a new entry, key order does not
+    assert cache.get_path(dict(reversed(key.items()))) == cache.get_path(key)
+    assert cache.get_path(dict(key, seed=0)) != cache.get_path(key)
+
+    # concurrent writers of one entry, one of them is kept
+    key = dict(key, split="validation")
+    processes = [
+        multiprocessing.Process(target=write, args=(tmp, key)) for _ in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    assert cache.load(key)["labels"] == build()["labels"]
+    assert not [name for name in os.listdir(tmp) if name.startswith(".tmp-")]
+    assert len(os.listdir(tmp)) == 2
+
+    # a partial entry is a miss and gets rebuilt
+    key = dict(key, split="test")
+    os.makedirs(cache.get_path(key))
+    with open(os.path.join(cache.get_path(key), "state.json"), "w") as f:
+        f.write("{}")
+    assert cache.load(key) is None
+    assert cache.get_or_build(key, build)["labels"] == build()["labels"]
+
+with tempfile.TemporaryDirectory() as tmp:
+    cache = DatasetCache(tmp)
+    for n_obs in range(3):
+        cache.save({"n_obs": n_obs}, build(1000))
+        os.utime(cache.get_path({"n_obs": n_obs}), (n_obs, n_obs))
+
+    # the least recently used entries go first, loading refreshes an entry
+    cache.load({"n_obs": 0})
+    cache.max_size = int(
+        2.5
+        * sum(
+            os.path.getsize(os.path.join(root, f))
+            for root, _, files in os.walk(cache.get_path({"n_obs": 0}))
+            for f in files
+        )
+    )
+    cache.save({"n_obs": 3}, build(1000))
+
+    assert cache.load({"n_obs": 1}) is None
+    assert cache.load({"n_obs": 2}) is None
+    assert cache.load({"n_obs": 0}) is not None
+    assert cache.load({"n_obs": 3}) is not None
+
+assert get_dataset_cache({}) is None
+assert (
+    get_dataset_cache({"dataset_cache_dir": tmp, "dataset_cache_max_gb": 1}).max_size
+    == 2**30
+)
+assert code_version(build) == code_version(build) != code_version(write)
+
+# the scripts key their tokenized splits on the task, the config and the preprocessing
+config = {
+    "task_type": "seq_2_seq_lm",
+    "split_validation_test": True,
+    "max_source_length": 256,
+    "pad_to_max_length": False,
+}
+task = tasks.AutoTask.get("sst2", config)
+split = dict(
+    split="train",
+    n_obs=100,
+    max_target_length=8,
+    task_id=None,
+    cols_to_remove=["source", "target"],
+    tokenizer_id="t5",
+    preprocess_function=write,
+)
+
+calls = []
+counted_build = lambda: calls.append(1) or build()
+with tempfile.TemporaryDirectory() as tmp:
+    cache = DatasetCache(tmp)
+    get_or_build_split(None, counted_build, task, config, **split)
+    get_or_build_split(cache, counted_build, task, config, **split)
+    get_or_build_split(cache, counted_build, task, config, **split)
+    assert calls == [1, 1]
+
+    get_or_build_split(cache, counted_build, task, config, **dict(split, n_obs=10))
+    get_or_build_split(
+        cache, counted_build, task, dict(config, max_source_length=8), **split
+    )
+    assert calls == [1, 1, 1, 1]
+    assert len(os.listdir(tmp)) == 3
+
+
+class LocalSST2(task_module.SST2):
+    def load_dataset(self, split):
+        return datasets.Dataset.from_dict(
+            {
+                "sentence": [f"sentence {i}" for i in range(50)],
+                "label": [i % 2 for i in range(50)],
+            }
+        )
+
+
+def preprocess_function(examples, config, tokenizer, max_target_length, task_id):
+    builds.append(1)
+    return {"input_ids": [[len(source)] for source in examples["source"]]}
+
+
+# the helper of the scripts builds a tokenized split once, then loads it
+builds = []
+task_module.TASK_MAPPING["local_sst2"] = LocalSST2
+config = dict(config, split_validation_test=False)
+split = dict(
+    split="train",
+    n_obs=None,
+    max_target_length=8,
+    preprocess_function=preprocess_function,
+    cols_to_remove=["source", "target"],
+    tokenizer_id="t5",
+)
+with tempfile.TemporaryDirectory() as tmp:
+    cache = DatasetCache(tmp)
+    dataset = get_dataset(config, None, "local_sst2", **split)
+    assert "source" not in dataset.column_names and len(dataset) == 50
+
+    for _ in range(2):
+        cached = get_dataset(config, None, "local_sst2", cache=cache, **split)
+    assert (
+        cached["input_ids"]
+        == get_dataset(config, None, "local_sst2", **split)["input_ids"]
+    )
+    assert len(builds) == 3 and len(os.listdir(tmp)) == 1
+del task_module.TASK_MAPPING["local_sst2"]
+
+# edits of a helper module the task module imports give a new code version
+with tempfile.TemporaryDirectory() as tmp:
+    path = os.path.join(tmp, "helpers.py")
+    with open(path, "w") as f:
+        f.write("def pad_text(text):\n    return text\n")
+    spec = importlib.util.spec_from_file_location("helpers", path)
+    helpers = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(helpers)
+    pad_text = helpers.pad_text
+
+    task = LocalSST2(dict(config), 42)
+    version = task_code_version(task)
+    assert task_code_version(task) == version
+
+    with open(path, "w") as f:
+        f.write("def pad_text(text):\n    return text + ' '\n")
+    assert task_code_version(task) != version
+
+utils.passed(__file__)
@@ -0,0 +1,47 @@
+import sys
+import os
+import json
+
+import utils
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+utils.start(__file__)
+
+import datasets
+
+tasks = utils.import_tasks()
+from tasks.tasks import TASK_MAPPING
+
+# outputs of the per-example preprocessors, the batched ones have to match them exactly
+with open(os.path.join(current, "fixtures", "preprocessed_tasks.json")) as f:
+    golden = json.load(f)
+
+assert set(golden) == set(TASK_MAPPING)
+
+for name, expected in golden.items():
+    task = tasks.AutoTask.get(name, {"task_type": "seq_2_seq_lm"})
+    dataset = datasets.Dataset.from_dict(expected["inputs"])
+
+    for add_prefix in [True, False]:
+        output = task.map_dataset(dataset, add_prefix)
+        expected_output = expected[f"add_prefix={add_prefix}"]
+
+        assert str(output.features) == expected_output["features"], name
+        assert output.to_dict() == expected_output["rows"], (name, add_prefix)
+
+# worker processes give the same rows in the same order
+for name in ["squad", "superglue-multirc", "superglue-record"]:
+    config = {"task_type": "seq_2_seq_lm", "preprocessing_num_workers": 2}
+    task = tasks.AutoTask.get(name, config)
+    dataset = datasets.concatenate_datasets(
+        [datasets.Dataset.from_dict(golden[name]["inputs"])] * 8
+    )
+
+    rows = task.map_dataset(dataset, True).to_dict()
+    expected_rows = golden[name]["add_prefix=True"]["rows"]
+    assert rows == {k: v * 8 for k, v in expected_rows.items()}, name
+
+utils.passed(__file__)
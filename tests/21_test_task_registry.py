@@ -0,0 +1,72 @@
+import sys
+import os
+
+import utils
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+utils.start(__file__)
+
+import datasets
+
+tasks = utils.import_tasks()
+from tasks import tasks as task_module
+
+loads = []
+
+
+class CountingQQP(task_module.QQP):
+    def load_dataset(self, split):
+        loads.append(split)
+        return datasets.Dataset.from_dict(
+            {
+                "question1": [f"q{i}" for i in range(1500)],
+                "question2": [f"p{i}" for i in range(1500)],
+                "label": [i % 2 for i in range(1500)],
+            }
+        )
+
+
+task_module.TASK_MAPPING["counting_qqp"] = CountingQQP
+
+config = {"task_type": "seq_2_seq_lm", "model_name_or_path": "t5-base"}
+task = tasks.AutoTask.get("counting_qqp", config)
+
+# configs that differ only in entries the task does not read share the task
+assert task is tasks.AutoTask.get("counting_qqp", dict(config, learning_rate=0.3))
+assert task is not tasks.AutoTask.get("counting_qqp", config, seed=0)
+assert task is not tasks.AutoTask.get("counting_qqp", dict(config, task_type="seq_cls"))
+assert list(task.config) == CountingQQP.config_keys
+assert task.config["task_type"] == "seq_2_seq_lm"
+
+# validation and train of a large dataset are cut from one loaded split and permutation
+randperms = []
+randperm = task_module.torch.randperm
+task_module.torch.randperm = lambda *args, **kwargs: randperms.append(1) or randperm(
+    *args, **kwargs
+)
+
+validation = task.get("validation", split_validation_test=True)
+train = task.get("train", split_validation_test=True)
+train_subset = task.get("train", split_validation_test=True, n_obs=100)
+
+task_module.torch.randperm = randperm
+
+assert loads == ["train"]
+assert len(randperms) == 1
+assert len(validation) == 1000 and len(train) == 500
+assert not set(validation["source"]) & set(train["source"])
+assert train_subset["source"] == train["source"][:100]
+
+# a cleared memo builds the task again, with nothing loaded
+tasks.AutoTask.clear()
+cleared = tasks.AutoTask.get("counting_qqp", config)
+assert cleared is not task and not cleared.loaded_splits
+cleared.get("train", split_validation_test=True)
+assert loads == ["train", "train"]
+
+del task_module.TASK_MAPPING["counting_qqp"]
+
+utils.passed(__file__)
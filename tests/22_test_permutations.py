@@ -0,0 +1,78 @@
+import sys
+import os
+import tempfile
+
+import utils
+
+import numpy as np
+import torch
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+utils.start(__file__)
+
+import datasets
+
+tasks = utils.import_tasks()
+from tasks import tasks as task_module
+
+
+class SyntheticYelp(task_module.YelpPolarity):
+    def load_dataset(self, split):
+        return datasets.Dataset.from_dict(
+            {
+                "text": [f"review {i}" for i in range(3000)],
+                "label": [i % 2 for i in range(3000)],
+            }
+        )
+
+
+generator = torch.Generator()
+generator.manual_seed(42)
+expected = torch.randperm(3000, generator=generator).tolist()
+
+with tempfile.TemporaryDirectory() as tmp:
+    config = {"task_type": "seq_2_seq_lm", "permutation_dir": tmp}
+    task = SyntheticYelp(config)
+
+    validation = task.get("validation", split_validation_test=True)
+    train = task.get("train", split_validation_test=True, n_obs=500)
+
+    # the same rows as the permutation of torch, stored once per (task, split, seed, length)
+    assert os.listdir(tmp) == ["yelp_polarity-train-42-3000.npy"]
+    assert validation["source"] == [
+        f"yelp_polarity sentence: review {i}" for i in expected[:1000]
+    ]
+    assert train["source"] == [
+        f"yelp_polarity sentence: review {i}" for i in expected[1000:1500]
+    ]
+
+    # a new task reads the stored permutation without computing it
+    randperm = task_module.torch.randperm
+    task_module.torch.randperm = None
+
+    task = SyntheticYelp(config)
+    indices = task.shuffled_indices(task.load_split("train"))
+    assert isinstance(indices, np.memmap)
+    assert indices.tolist() == expected
+    assert (
+        task.get("validation", split_validation_test=True)["source"]
+        == validation["source"]
+    )
+
+    task_module.torch.randperm = randperm
+
+    # flattened subsets have contiguous rows and the same content
+    task = SyntheticYelp(dict(config, flatten_indices=True))
+    subset = task.subsample(task.load_split("train"), n_obs=200)
+    assert subset._indices is None
+    assert subset["text"] == [f"review {i}" for i in expected[:200]]
+
+    # datasets that are not loaded splits of the task are shuffled in memory
+    other = datasets.Dataset.from_dict({"text": ["a", "b", "c"]})
+    assert sorted(task.shuffled_indices(other).tolist()) == [0, 1, 2]
+    assert len(os.listdir(tmp)) == 1
+
+utils.passed(__file__)
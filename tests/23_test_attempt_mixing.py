@@ -0,0 +1,106 @@
+import sys
+import os
+
+import utils
+
+import torch
+import torch.nn.functional as F
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+utils.start(__file__)
+
+from cpeft.attempt import AttemptConfig, AttemptSubModule
+
+torch.manual_seed(0)
+
+config = AttemptConfig(
+    task_type="seq_2_seq_lm",
+    num_virtual_tokens=5,
+    num_transformer_submodules=2,
+    token_dim=32,
+    prefix_num=6,
+    temperature=2,
+)
+
+
+def repeat_forward(module, inputs_embeds, prefix_emb):
+    # formulation before the broadcast mixing, every row gets a copy of the source prompts
+    avg_inputs_embeds, _ = torch.max(inputs_embeds, 1)
+
+    mul_prefix_emb_added = torch.cat(
+        (
+            module.mul_prefix_emb.repeat(inputs_embeds.shape[0], 1, 1, 1),
+            prefix_emb.unsqueeze(1),
+        ),
+        dim=1,
+    )
+    avg_mul_prefix_emb, _ = torch.max(mul_prefix_emb_added, 2)
+
+    x = module.attn_W_down(avg_inputs_embeds)
+    x = module.attn_non_linear(x)
+    x = module.attn_W_up(x)
+    x = module.layer_norm(x)
+    x = x.unsqueeze(-1)
+
+    attn_scores = avg_mul_prefix_emb.bmm(x).squeeze(-1) / module.temperature
+    normalized_attn_scores = F.softmax(attn_scores, -1)
+    soft_prompts = torch.einsum(
+        "bp, bpld -> bld", normalized_attn_scores, mul_prefix_emb_added
+    )
+
+    soft_prompts = soft_prompts + prefix_emb.unsqueeze(0)
+
+    return soft_prompts.squeeze(0)
+
+
+module = AttemptSubModule(config)
+module.store_prefix_weights([torch.randn(10, 32) for _ in range(config.prefix_num)])
+
+inputs_embeds = torch.randn(4, 7, 32)
+prefix_emb = torch.randn(4, 10, 32)
+
+
+def run(forward):
+    module.zero_grad()
+    inputs = inputs_embeds.clone().requires_grad_()
+    prompts = prefix_emb.clone().requires_grad_()
+
+    # only the first num_virtual_tokens of the mixture are prepended to the input
+    output = forward(inputs, prompts)[:, : config.num_virtual_tokens]
+    output.pow(2).mean().backward()
+
+    gradients = {
+        name: p.grad.clone() for name, p in module.named_parameters() if p.requires_grad
+    }
+    return output.detach(), inputs.grad, prompts.grad, gradients
+
+
+output, inputs_grad, prompts_grad, gradients = run(module)
+old_output, old_inputs_grad, old_prompts_grad, old_gradients = run(
+    lambda inputs, prompts: repeat_forward(module, inputs, prompts)
+)
+
+# the sums run in another order than in the repeat formulation (p sources and the
+# target separately instead of one contraction over p + 1 prompts, scores by matmul
+# instead of bmm), so results agree up to float32 rounding, a few ulps of the values.
+# Bit-identical results would need the [batch, p + 1, tokens, dim] copy that is removed.
+tolerance = dict(rtol=1e-6, atol=1e-6)
+
+assert output.shape == (4, config.num_virtual_tokens, 32)
+assert torch.allclose(output, old_output, **tolerance)
+assert torch.allclose(inputs_grad, old_inputs_grad, **tolerance)
+assert torch.allclose(prompts_grad, old_prompts_grad, **tolerance)
+assert gradients.keys() == old_gradients.keys() and gradients
+for name in gradients:
+    assert torch.allclose(gradients[name], old_gradients[name], **tolerance), name
+
+# the keys follow the source prompts after load_state_dict
+state_dict = module.state_dict()
+state_dict["mul_prefix_emb"] = torch.randn_like(state_dict["mul_prefix_emb"])
+module.load_state_dict(state_dict)
+assert torch.equal(module.mul_prefix_keys, state_dict["mul_prefix_emb"].max(1)[0])
+
+utils.passed(__file__)
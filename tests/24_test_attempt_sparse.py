@@ -0,0 +1,101 @@
+import sys
+import os
+
+import utils
+
+import torch
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+utils.start(__file__)
+
+from cpeft.attempt import AttemptConfig, AttemptSparseSubModule, AttemptSubModule
+
+torch.manual_seed(0)
+
+
+def build_config(**kwargs):
+    return AttemptConfig(
+        task_type="seq_2_seq_lm",
+        num_virtual_tokens=5,
+        num_transformer_submodules=2,
+        token_dim=32,
+        prefix_num=6,
+        temperature=2,
+        **kwargs,
+    )
+
+
+dense = AttemptSubModule(build_config())
+dense.store_prefix_weights([torch.randn(10, 32) for _ in range(6)])
+
+inputs_embeds = torch.randn(4, 7, 32)
+prefix_emb = torch.randn(4, 10, 32)
+
+# with every source prompt retrieved the mixture is the dense one
+for kwargs in [
+    dict(top_k=6, index_method="exact"),
+    dict(top_k=8, index_method="exact"),
+    dict(top_k=6, index_method="ivf", n_clusters=2, n_probe=2),
+]:
+    sparse = AttemptSparseSubModule(build_config(**kwargs))
+    sparse.load_state_dict(dense.state_dict())
+
+    assert torch.allclose(
+        sparse(inputs_embeds, prefix_emb), dense(inputs_embeds, prefix_emb), atol=1e-5
+    ), kwargs
+
+# five prompts around one key and a single prompt far away make uneven clusters
+direction = torch.zeros(32)
+direction[0] = 10
+keys = [direction + 0.1 * torch.randn(32) for _ in range(5)] + [-direction]
+sparse = AttemptSparseSubModule(
+    build_config(top_k=3, index_method="ivf", n_clusters=2, n_probe=1)
+)
+sparse.store_prefix_weights([key.expand(10, 32) for key in keys])
+
+members = sparse.cluster_members
+assert members.shape == (2, 5)
+assert sorted(members[members >= 0].tolist()) == list(range(6))
+assert sorted((members >= 0).sum(-1).tolist()) == [1, 5]
+
+# the small cluster is padded with -1, the padding is returned but never mixed
+query = -direction.expand(4, 32)
+assert sparse.retrieve(query).tolist() == [[5, -1, -1]] * 4
+assert sparse.retrieve(-query)[:, :3].ge(0).all()
+
+sparse.get_query = lambda inputs_embeds: query
+single = AttemptSparseSubModule(build_config(top_k=1, index_method="exact"))
+single.load_state_dict(sparse.state_dict())
+single.get_query = sparse.get_query
+
+output = sparse(inputs_embeds, prefix_emb)
+assert torch.isfinite(output).all()
+assert torch.allclose(output, single(inputs_embeds, prefix_emb), atol=1e-6)
+
+# gradients reach the query and the keys of the retrieved prompts only
+sparse = AttemptSparseSubModule(build_config(top_k=2, index_method="exact"))
+sparse.load_state_dict(dense.state_dict())
+sparse.mul_prefix_keys.requires_grad_()
+
+sparse(inputs_embeds, prefix_emb).pow(2).mean().backward()
+
+for name in ["attn_W_down", "attn_W_up", "layer_norm"]:
+    assert getattr(sparse, name).weight.grad.abs().sum() > 0, name
+
+retrieved = set(sparse.retrieve(sparse.get_query(inputs_embeds)).flatten().tolist())
+assert len(retrieved) < 6
+assert {
+    i for i, row in enumerate(sparse.mul_prefix_keys.grad) if row.abs().sum() > 0
+} == retrieved
+
+# auto searches exactly up to exact_search_limit source prompts
+for exact_search_limit, index_method in [(6, "exact"), (5, "ivf")]:
+    sparse = AttemptSparseSubModule(
+        build_config(index_method="auto", exact_search_limit=exact_search_limit)
+    )
+    assert sparse.index_method == index_method
+
+utils.passed(__file__)
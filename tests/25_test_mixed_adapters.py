@@ -0,0 +1,130 @@
+import sys
+import os
+import tempfile
+
+import utils
+
+import torch
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+utils.start(__file__)
+
+from transformers import T5Config, T5ForConditionalGeneration
+from cpeft import PromptTuningConfig, get_peft_model
+from cpeft.attempt import AttemptConfig
+
+model_config = T5Config(
+    vocab_size=100,
+    d_model=32,
+    d_kv=8,
+    d_ff=64,
+    num_layers=2,
+    num_heads=4,
+    decoder_start_token_id=0,
+    # the tiny model with a tied head generates only padding
+    tie_word_embeddings=False,
+)
+
+torch.manual_seed(0)
+
+prompt_path = os.path.join(tempfile.mkdtemp(), "prompt.bin")
+torch.save(torch.randn(10, 32), prompt_path)
+
+model = get_peft_model(
+    T5ForConditionalGeneration(model_config),
+    PromptTuningConfig(task_type="seq_2_seq_lm", num_virtual_tokens=3),
+    adapter_name="short",
+)
+model.add_adapter(
+    "long", PromptTuningConfig(task_type="seq_2_seq_lm", num_virtual_tokens=8)
+)
+model.add_adapter(
+    "attempt",
+    AttemptConfig(
+        task_type="seq_2_seq_lm",
+        num_virtual_tokens=5,
+        prompt_init="embedding",
+        prompt_init_embedding=prompt_path,
+        prompt_embedding_paths=[prompt_path, prompt_path],
+        prefix_num=2,
+        temperature=2,
+    ),
+)
+model.eval()
+
+input_ids = torch.randint(2, 100, (6, 9))
+attention_mask = torch.ones_like(input_ids)
+attention_mask[1:, -3:] = 0
+decoder_input_ids = torch.randint(2, 100, (6, 4))
+adapter_names = ["short", "long", "attempt", "attempt", "short", "long"]
+
+
+def rows_of(adapter_name):
+    return torch.tensor(
+        [row for row, name in enumerate(adapter_names) if name == adapter_name]
+    )
+
+
+# shorter prompts are left padded and masked, every row sees only its own adapter
+with torch.no_grad():
+    logits = model(
+        input_ids=input_ids,
+        attention_mask=attention_mask,
+        decoder_input_ids=decoder_input_ids,
+        adapter_names=adapter_names,
+    ).logits
+
+    for adapter_name in ["short", "long", "attempt"]:
+        rows = rows_of(adapter_name)
+        expected = model(
+            input_ids=input_ids[rows],
+            attention_mask=attention_mask[rows],
+            decoder_input_ids=decoder_input_ids[rows],
+            adapter_names=[adapter_name] * len(rows),
+        ).logits
+
+        assert torch.allclose(logits[rows], expected, atol=1e-5), adapter_name
+
+# generation of a mixed batch is the generation of every adapter on its own rows
+for kwargs in [{"max_new_tokens": 6}, {"max_new_tokens": 4, "num_beams": 2}]:
+    preds = model.generate(
+        input_ids=input_ids,
+        attention_mask=attention_mask,
+        task_ids=None,
+        adapter_names=adapter_names,
+        **kwargs,
+    )
+
+    for adapter_name in ["short", "long", "attempt"]:
+        rows = rows_of(adapter_name)
+        expected = model.generate(
+            input_ids=input_ids[rows],
+            attention_mask=attention_mask[rows],
+            task_ids=None,
+            adapter_names=[adapter_name] * len(rows),
+            **kwargs,
+        )
+
+        assert torch.equal(preds[rows, : expected.shape[1]], expected), kwargs
+        assert (preds[rows, expected.shape[1] :] == model_config.pad_token_id).all()
+
+# a batch of one adapter is the plain single adapter path
+model.set_adapter("long")
+with torch.no_grad():
+    expected = model(
+        input_ids=input_ids,
+        attention_mask=attention_mask,
+        decoder_input_ids=decoder_input_ids,
+    ).logits
+    logits = model(
+        input_ids=input_ids,
+        attention_mask=attention_mask,
+        decoder_input_ids=decoder_input_ids,
+        adapter_names=["long"] * 6,
+    ).logits
+assert torch.equal(logits, expected)
+
+utils.passed(__file__)
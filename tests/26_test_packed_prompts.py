@@ -0,0 +1,111 @@
+import sys
+import os
+import tempfile
+
+import utils
+
+import torch
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+utils.start(__file__)
+
+from transformers import T5Config, T5ForConditionalGeneration
+from cpeft import AttemptConfig, PeftModel, get_peft_model
+from cpeft.prompt_tuning import PackedPromptEmbedding
+
+model_config = T5Config(
+    vocab_size=100,
+    d_model=32,
+    d_kv=8,
+    d_ff=64,
+    num_layers=2,
+    num_heads=4,
+    decoder_start_token_id=0,
+)
+
+torch.manual_seed(0)
+
+directory = tempfile.mkdtemp()
+prompt_path = os.path.join(directory, "prompt.bin")
+torch.save(torch.randn(10, 32), prompt_path)
+
+cpeft_config = AttemptConfig(
+    task_type="seq_2_seq_lm",
+    num_virtual_tokens=5,
+    prompt_init="embedding_multi",
+    prompt_init_embedding=prompt_path,
+    prompt_embedding_paths=[prompt_path, prompt_path],
+    prefix_num=2,
+    n_targets=4,
+    temperature=2,
+)
+model = get_peft_model(T5ForConditionalGeneration(model_config), cpeft_config)
+
+embedding = model.prompt_encoder["peft"].embedding
+assert isinstance(embedding, PackedPromptEmbedding)
+with torch.no_grad():
+    embedding.weight.normal_()
+weight = embedding.weight.detach().clone()
+
+input_ids = torch.randint(2, 100, (4, 7))
+decoder_input_ids = torch.randint(2, 100, (4, 3))
+task_ids = torch.tensor([3, 0, 1, 3])
+
+
+def logits(model):
+    model.eval()
+    with torch.no_grad():
+        return model(
+            input_ids=input_ids, decoder_input_ids=decoder_input_ids, task_ids=task_ids
+        ).logits
+
+
+expected = logits(model)
+
+# the packed bank round trips through both formats
+for safe_serialization in [True, False]:
+    path = os.path.join(directory, f"packed_{safe_serialization}")
+    model.save_pretrained(path, safe_serialization=safe_serialization)
+
+    loaded = PeftModel.from_pretrained(T5ForConditionalGeneration(model_config), path)
+    loaded.base_model.load_state_dict(model.base_model.state_dict())
+
+    assert torch.equal(loaded.prompt_encoder["peft"].embedding.weight.cpu(), weight)
+    assert torch.equal(logits(loaded), expected)
+
+# module state dicts saved before packing hold one embedding per target
+packed = PackedPromptEmbedding(4, 10, 32)
+packed.load_state_dict({f"{i}.weight": weight[i] for i in range(4)})
+assert torch.equal(packed.weight, weight)
+
+prompt_encoder = model.prompt_encoder["peft"]
+prompt_encoder.load_state_dict(
+    {f"embedding.{i}.weight": torch.zeros(10, 32) for i in range(4)}
+)
+assert not prompt_encoder.embedding.weight.any()
+prompt_encoder.load_state_dict({f"embedding.{i}.weight": weight[i] for i in range(4)})
+assert torch.equal(prompt_encoder.embedding.weight, weight)
+
+# legacy .bin bundles keep a list of prompts and nested attention module keys
+path = os.path.join(directory, "legacy")
+model.save_pretrained(path, safe_serialization=False)
+
+state_dict = torch.load(os.path.join(path, "adapter_model.bin"))
+legacy_state_dict = {
+    "prompt_embeddings": list(state_dict.pop("prompt_embeddings").unbind()),
+    "attention_module": {
+        f"old_name.{k.split('.', 1)[1]}": v for k, v in state_dict.items()
+    },
+}
+torch.save(legacy_state_dict, os.path.join(path, "adapter_model.bin"))
+
+loaded = PeftModel.from_pretrained(T5ForConditionalGeneration(model_config), path)
+loaded.base_model.load_state_dict(model.base_model.state_dict())
+
+assert torch.equal(loaded.prompt_encoder["peft"].embedding.weight.cpu(), weight)
+assert torch.equal(logits(loaded), expected)
+
+utils.passed(__file__)
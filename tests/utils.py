@@ -16,3 +16,23 @@ def start(f):
 
 def passed(f):
     print(bold(green(f"Test {f.split('/')[-1].split('.')[0]} passed.")))
+
+
+def import_tasks():
+    # tasks import the utils module of the repository, which this module shadows
+    import os
+    import sys
+    import importlib.util
+
+    path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "utils.py")
+    spec = importlib.util.spec_from_file_location("utils", path)
+    repo_utils = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(repo_utils)
+
+    test_utils, sys.modules["utils"] = sys.modules["utils"], repo_utils
+    try:
+        import tasks
+    finally:
+        sys.modules["utils"] = test_utils
+
+    return tasks
@@ -0,0 +1,126 @@
+import torch
+
+from cpeft.prompt_tuning import PackedPromptEmbedding
+
+
+def get_trainable_parameters(model):
+    return [p for p in model.parameters() if p.requires_grad]
+
+
+def build_optimizer(model, config):
+    """AdamW over the trainable parameters only, the frozen backbone is never visited.
+
+    optimizer "adamw" uses the foreach AdamW of torch, or with fused_optimizer the fused one
+    when all parameters are on cuda, other devices fall back to foreach.
+    "lazy_adamw" gives packed target banks sparse gradients and updates only the targets
+    present in a step.
+    """
+    name = config.get("optimizer", "adamw")
+    params = get_trainable_parameters(model)
+    lr = config["learning_rate"]
+    weight_decay = config.get("weight_decay", 0.01)
+
+    if name == "adamw":
+        fused = config.get("fused_optimizer", False) and all(p.is_cuda for p in params)
+        return torch.optim.AdamW(
+            params,
+            lr=lr,
+            weight_decay=weight_decay,
+            foreach=None if fused else True,
+            fused=fused or None,
+        )
+
+    if name == "lazy_adamw":
+        for module in model.modules():
+            if isinstance(module, PackedPromptEmbedding):
+                module.sparse = True
+
+        return LazyAdamW(params, lr=lr, weight_decay=weight_decay)
+
+    raise ValueError(f"Unknown optimizer {name}, use adamw or lazy_adamw.")
+
+
+class LazyAdamW(torch.optim.Optimizer):
+    """AdamW that updates only the rows of a parameter that have a gradient.
+
+    Parameters with a sparse gradient keep moments and a step count per row, rows
+    without gradient are not touched, weight decay included. Dense gradients get the
+    usual AdamW update. With every row present in every step it is the same as AdamW.
+    """
+
+    def __init__(
+        self, params, lr=1e-3, betas=(0.9, 0.999), eps=1e-8, weight_decay=1e-2
+    ):
+        if lr < 0.0:
+            raise ValueError(f"Invalid learning rate {lr}.")
+
+        defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay)
+        super().__init__(params, defaults)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.param_groups:
+            for p in group["params"]:
+                if p.grad is None:
+                    continue
+
+                state = self.state[p]
+                if len(state) == 0:
+                    state["exp_avg"] = torch.zeros_like(p)
+                    state["exp_avg_sq"] = torch.zeros_like(p)
+                    state["step"] = torch.zeros(
+                        p.shape[0] if p.grad.is_sparse else (),
+                        dtype=torch.float32,
+                        device=p.device,
+                    )
+
+                if not p.grad.is_sparse:
+                    state["step"] += 1
+                    _adamw_update(
+                        p,
+                        p.grad,
+                        state["exp_avg"],
+                        state["exp_avg_sq"],
+                        state["step"],
+                        group,
+                    )
+                    continue
+
+                # repeated rows of the batch are summed by coalesce
+                grad = p.grad.coalesce()
+                rows, values = grad.indices()[0], grad.values().view(-1, *p.shape[1:])
+
+                param = p[rows]
+                exp_avg = state["exp_avg"][rows]
+                exp_avg_sq = state["exp_avg_sq"][rows]
+                step = state["step"][rows] + 1
+
+                _adamw_update(param, values, exp_avg, exp_avg_sq, step, group)
+
+                p.index_copy_(0, rows, param)
+                state["exp_avg"].index_copy_(0, rows, exp_avg)
+                state["exp_avg_sq"].index_copy_(0, rows, exp_avg_sq)
+                state["step"].index_copy_(0, rows, step)
+
+        return loss
+
+
+def _adamw_update(param, grad, exp_avg, exp_avg_sq, step, group):
+    # step is a scalar or one count per row of param
+    beta1, beta2 = group["betas"]
+    step = step.view(-1, *[1] * (param.dim() - 1)) if step.dim() else step
+
+    param.mul_(1 - group["lr"] * group["weight_decay"])
+    exp_avg.lerp_(grad, 1 - beta1)
+    exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+
+    bias_correction1 = 1 - beta1**step
+    bias_correction2 = 1 - beta2**step
+
+    denom = (exp_avg_sq.sqrt() / bias_correction2.sqrt()).add_(group["eps"])
+    param.addcdiv_(exp_avg, denom * bias_correction1, value=-group["lr"])
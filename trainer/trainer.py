@@ -8,12 +8,13 @@ from transformers import (
 )
 
 from cpeft import PeftModel
+from cpeft.generation import LabelTrie, build_generation_config
 
 # from peft import PeftModel
 
 from tqdm import tqdm
 
-from .utils import EvalPrediction
+from .utils import EvalPrediction, split_batch
 
 
 class Trainer:
@@ -40,6 +41,10 @@ class Trainer:
         self.metrics_fn = metrics_fn
         self.metrics = {}
         self.wandb = wandb
+        self.label_token_ids = {}
+        self.label_tries = {}
+        self.max_new_tokens = {}
+        self.generation_configs = {}
 
         if self.config["max_train_samples"] > 0:
             self.lr_scheduler = get_linear_schedule_with_warmup(
@@ -77,6 +82,137 @@ class Trainer:
         # print(s / count)
         return {f"avg_{keyword}": s / count}
 
+    def get_task_ids(self, batch):
+        task_ids = batch.get("task_ids", None)
+        if task_ids is not None:
+            task_ids = task_ids.to(self.config["device"])
+
+        return task_ids
+
+    def get_task_setting(self, key, task_name, default=None):
+        # one value for all tasks or a table of values per task
+        value = self.config.get(key, default)
+        if isinstance(value, dict):
+            value = value.get(task_name, default)
+
+        return value
+
+    def get_eval_mode(self, task_name):
+        eval_mode = self.get_task_setting("eval_mode", task_name, "generate")
+
+        if eval_mode not in ["generate", "rank_classification"]:
+            raise ValueError(f"Unknown eval mode {eval_mode} for {task_name}.")
+
+        return eval_mode
+
+    def get_task(self, task_name):
+        # tasks are needed only by label-set evaluation settings
+        from tasks import AutoTask
+
+        return AutoTask.get(task_name, self.config)
+
+    def get_label_token_ids(self, task_name):
+        if task_name not in self.label_token_ids:
+            labels_list = self.get_task(task_name).labels_list
+            if labels_list is None:
+                raise ValueError(
+                    f"Rank classification needs the labels_list of {task_name}."
+                )
+
+            token_ids = [self.tokenizer(label).input_ids for label in labels_list]
+            label_token_ids = torch.full(
+                (len(token_ids), max(len(ids) for ids in token_ids)),
+                -100,
+                dtype=torch.long,
+            )
+            for i, ids in enumerate(token_ids):
+                label_token_ids[i, : len(ids)] = torch.tensor(ids)
+
+            self.label_token_ids[task_name] = label_token_ids.to(self.config["device"])
+
+        return self.label_token_ids[task_name]
+
+    def get_vocab_ids(self, task_name):
+        # tokens of the labels and the tokens that end a label
+        label_token_ids = self.get_label_token_ids(task_name)
+        special_token_ids = torch.tensor(
+            [self.tokenizer.eos_token_id, self.tokenizer.pad_token_id],
+            device=label_token_ids.device,
+        )
+
+        return torch.unique(
+            torch.cat((label_token_ids[label_token_ids != -100], special_token_ids))
+        )
+
+    def get_label_trie(self, task_name):
+        if task_name not in self.label_tries:
+            self.label_tries[task_name] = LabelTrie(self.get_label_token_ids(task_name))
+
+        return self.label_tries[task_name]
+
+    def get_max_new_tokens(self, task_name):
+        # label-set tasks need only as many tokens as their longest label
+        if task_name not in self.max_new_tokens:
+            self.max_new_tokens[task_name] = self.get_task(
+                task_name
+            ).get_max_target_length(
+                self.tokenizer, default_max_length=self.config["max_target_length"]
+            )
+
+        return self.max_new_tokens[task_name]
+
+    def get_generation_config(self, model, task_name):
+        # built once per task, decoding uses it without copying
+        if task_name not in self.generation_configs:
+            self.generation_configs[task_name] = build_generation_config(
+                model, max_new_tokens=self.get_max_new_tokens(task_name)
+            )
+
+        return self.generation_configs[task_name]
+
+    def eval_step(self, model, batch, task_name):
+        # the loss and the predictions share one encoder pass
+        inputs = {
+            "input_ids": batch["input_ids"].to(self.config["device"]),
+            "labels": batch["labels"].to(self.config["device"]),
+            "attention_mask": batch["attention_mask"].to(self.config["device"]),
+            "task_ids": self.get_task_ids(batch),
+        }
+
+        if self.get_eval_mode(task_name) == "rank_classification":
+            inputs["label_token_ids"] = self.get_label_token_ids(task_name)
+            return model.eval_step(**inputs)
+
+        if self.get_task_setting("restrict_vocab", task_name, False):
+            inputs["vocab_ids"] = self.get_vocab_ids(task_name)
+
+        if self.get_task_setting("constrained_decoding", task_name, False):
+            inputs["label_trie"] = self.get_label_trie(task_name)
+
+        return model.eval_step(
+            generation_config=self.get_generation_config(model, task_name), **inputs
+        )
+
+    def autocast(self):
+        # bf16 runs the frozen backbone under autocast, the trainable parameters,
+        # their gradients and the optimizer state stay fp32
+        precision = self.config.get("precision", "fp32")
+        if precision not in ["fp32", "bf16"]:
+            raise ValueError(f"Unknown precision {precision}, use fp32 or bf16.")
+
+        return torch.autocast(
+            torch.device(self.config["device"]).type,
+            dtype=torch.bfloat16,
+            enabled=precision == "bf16",
+        )
+
+    def get_num_targets(self, labels):
+        # the seq_cls loss is a mean over rows, the seq2seq loss over label tokens
+        if self.config["task_type"] == "seq_cls":
+            return labels.shape[0]
+
+        return (labels != -100).sum().item()
+
     def train(self):
         self.model.train()
         train_loss = 0
@@ -84,17 +220,34 @@ class Trainer:
         metric_key_prefix = "train"
 
         for i, batch in enumerate(tqdm(self.train_dataloader)):
-            outputs = self.model(
-                input_ids=batch["input_ids"].to(self.config["device"]),
-                labels=batch["labels"].to(self.config["device"]),
-                attention_mask=batch["attention_mask"].to(self.config["device"]),
-                task_ids=batch.get("task_ids", None),
+            # a batch is one optimizer step, micro-batches bound the activation memory
+            micro_batches = split_batch(
+                batch,
+                self.config.get("micro_batch_size", None),
+                self.config.get("max_micro_batch_tokens", None),
             )
+            num_targets = self.get_num_targets(batch["labels"])
+
+            for micro_batch in micro_batches:
+                with self.autocast():
+                    outputs = self.model(
+                        input_ids=micro_batch["input_ids"].to(self.config["device"]),
+                        labels=micro_batch["labels"].to(self.config["device"]),
+                        attention_mask=micro_batch["attention_mask"].to(
+                            self.config["device"]
+                        ),
+                        task_ids=self.get_task_ids(micro_batch),
+                    )
+
+                loss = outputs.loss
+                if len(micro_batches) > 1:
+                    loss = (
+                        loss * self.get_num_targets(micro_batch["labels"]) / num_targets
+                    )
 
-            loss = outputs.loss
-            train_loss += loss.detach().float()
+                train_loss += loss.detach().float()
+                loss.backward()
 
-            loss.backward()
             self.optimizer.step()
             self.lr_scheduler.step()
 
@@ -120,34 +273,14 @@ class Trainer:
     def valid(self):
         self.model.eval()
         metrics = {}
-        max_new_tokens = self.config["max_target_length"]
 
         for task_name in self.valid_dataloaders:
             valid_loss = 0
             metric_key_prefix = f"{task_name}_valid"
 
-            with torch.no_grad():
+            with torch.no_grad(), self.autocast():
                 for _, batch in enumerate(tqdm(self.valid_dataloaders[task_name])):
-                    outputs = self.model(
-                        input_ids=batch["input_ids"].to(self.config["device"]),
-                        labels=batch["labels"].to(self.config["device"]),
-                        attention_mask=batch["attention_mask"].to(
-                            self.config["device"]
-                        ),
-                        task_ids=batch.get("task_ids", None),
-                    )
-
-                    preds = self.model.generate(
-                        input_ids=batch["input_ids"].to(self.config["device"]),
-                        labels=batch["labels"].to(self.config["device"]),
-                        attention_mask=batch["attention_mask"].to(
-                            self.config["device"]
-                        ),
-                        max_new_tokens=max_new_tokens,
-                        task_ids=batch.get("task_ids", None),
-                    )
-
-                    loss = outputs.loss
+                    loss, preds = self.eval_step(self.model, batch, task_name)
                     valid_loss += loss.detach().float()
                     metrics.update(
                         self.metrics_fn[task_name]["compute_metrics"](
@@ -196,34 +329,13 @@ class Trainer:
         model.eval()
         metrics = {}
 
-        max_new_tokens = self.config["max_target_length"]
-
         for task_name in self.test_dataloaders:
             valid_loss = 0
             metric_key_prefix = f"{task_name}_test"
 
-            with torch.no_grad():
+            with torch.no_grad(), self.autocast():
                 for _, batch in enumerate(tqdm(self.test_dataloaders[task_name])):
-                    outputs = model(
-                        input_ids=batch["input_ids"].to(self.config["device"]),
-                        labels=batch["labels"].to(self.config["device"]),
-                        attention_mask=batch["attention_mask"].to(
-                            self.config["device"]
-                        ),
-                        task_ids=batch.get("task_ids", None),
-                    )
-
-                    preds = model.generate(
-                        input_ids=batch["input_ids"].to(self.config["device"]),
-                        labels=batch["labels"].to(self.config["device"]),
-                        attention_mask=batch["attention_mask"].to(
-                            self.config["device"]
-                        ),
-                        max_new_tokens=max_new_tokens,
-                        task_ids=batch.get("task_ids", None),
-                    )
-
-                    loss = outputs.loss
+                    loss, preds = self.eval_step(model, batch, task_name)
                     valid_loss += loss.detach().float()
                     metrics.update(
                         self.metrics_fn[task_name]["compute_metrics"](
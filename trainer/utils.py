@@ -1,3 +1,4 @@
+import torch
 import numpy as np
 from typing import Union, NamedTuple, Tuple, Dict, Any
 
@@ -6,3 +7,62 @@ class EvalPrediction(NamedTuple):
     predictions: Union[np.ndarray, Tuple[np.ndarray]]
     label_ids: np.ndarray
     data_info: Dict[str, Any]
+
+
+def split_batch(batch, micro_batch_size=None, max_micro_batch_tokens=None):
+    """Splits a batch into consecutive micro-batches.
+
+    A micro-batch has at most micro_batch_size rows and at most
+    max_micro_batch_tokens input tokens counted with padding. Padding columns
+    that no row of a micro-batch uses are cut off.
+    """
+    if micro_batch_size is None and max_micro_batch_tokens is None:
+        return [batch]
+
+    batch_size = batch["input_ids"].shape[0]
+    lengths = _used_lengths(batch["attention_mask"] != 0)
+    label_lengths = _used_lengths(batch["labels"] != -100)
+
+    micro_batches, start = [], 0
+    while start < batch_size:
+        end, max_length = start + 1, lengths[start]
+
+        while end < batch_size:
+            length = max(max_length, lengths[end])
+            num_rows = end + 1 - start
+
+            if micro_batch_size is not None and num_rows > micro_batch_size:
+                break
+
+            if (
+                max_micro_batch_tokens is not None
+                and num_rows * length > max_micro_batch_tokens
+            ):
+                break
+
+            end, max_length = end + 1, length
+
+        micro_batch = {}
+        for key, value in batch.items():
+            if isinstance(value, (torch.Tensor, list)) and len(value) == batch_size:
+                value = value[start:end]
+
+            micro_batch[key] = value
+
+        # contiguous, T5 views the labels when computing the loss
+        for key in ["input_ids", "attention_mask"]:
+            micro_batch[key] = micro_batch[key][:, :max_length].contiguous()
+        micro_batch["labels"] = micro_batch["labels"][
+            :, : max(label_lengths[start:end])
+        ].contiguous()
+
+        micro_batches.append(micro_batch)
+        start = end
+
+    return micro_batches
+
+
+def _used_lengths(mask):
+    # position after the last used column of every row, padding can be on any side
+    last = mask.shape[1] - mask.flip(dims=[1]).int().argmax(dim=1)
+    return torch.where(mask.any(dim=1), last, 1).tolist()
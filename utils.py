@@ -4,6 +4,10 @@ import regex as re
 import numpy as np
 
 
+PUNCTUATION = re.compile(r"([^_\s\p{N}\p{L}\p{M}])")
+WHITESPACE = re.compile(r"\s+")
+
+
 def pad_punctuation(text):
     """Re-implementation of _pad_punctuation in t5. This function adds spaces
     around punctuation. While this pads punctuation as expected, it has the
@@ -11,9 +15,9 @@ def pad_punctuation(text):
     spaces as well. For instance: "François" becomes "Fran ç ois"""
     # Pad everything except for: underscores (_), whitespace (\s),
     # numbers (\p{N}), letters (\p{L}) and accent characters (\p{M}).
-    text = re.sub(r"([^_\s\p{N}\p{L}\p{M}])", r" \1 ", str(text))
+    text = PUNCTUATION.sub(r" \1 ", str(text))
     # Collapse consecutive whitespace into one space.
-    text = re.sub(r"\s+", " ", text)
+    text = WHITESPACE.sub(" ", text)
     return text
 
 